@@ -1,57 +1,448 @@
 # Import packages
 import os
-from fastapi import FastAPI
-from pydantic import BaseModel
+import time
+from typing import List, Literal, Optional, Tuple
+import asyncio
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
+from pydantic import BaseModel, Field
 from dotenv import load_dotenv
-from src import dataset
-from src.modeling import predict
+from src import ann, dataset, metrics
+from src.cache import ResponseCache
+from src.embeddings import EmbeddingStore
+from src.interactions import InteractionIndex
+from src.profiles import UserProfiles
+from src.modeling import hybrid, precompute, predict
+from src.modeling.registry import get_registry
+from src.serving import PoolSaturated, RequestCoalescer, ScoringPool
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Load pickle object
-df = dataset.load_pickle_file(
-    os.path.join(os.getenv("ROOT_DIR"), "app", "backend", "dataset.pickle")
+# Memory-map the columnar interaction store when it exists (see
+# src/interactions.py), otherwise index the clicks of the pickle object once
+interactions_path = os.path.join(os.getenv("ROOT_DIR"), "app", "backend", "interactions")
+if os.path.exists(interactions_path):
+    interactions = InteractionIndex.load(interactions_path)
+else:
+    interactions = InteractionIndex.from_frame(
+        dataset.load_pickle_file(
+            os.path.join(os.getenv("ROOT_DIR"), "app", "backend", "dataset.pickle")
+        )
+    )
+
+# Load articles embeddings once, memory-mapped from the .npy file when it exists
+# (see src/embeddings.py to convert the original pickle)
+embeddings_path = os.path.join(os.getenv("ROOT_DIR"), "models", "articles_embeddings.npy")
+if not os.path.exists(embeddings_path):
+    embeddings_path = os.path.join(
+        os.getenv("ROOT_DIR"), "models", "articles_embeddings.pickle"
+    )
+# EMBEDDINGS_QUANTIZATION=float16 or int8 scans a compact copy of the
+# embeddings first and re-ranks the best candidates exactly
+embeddings = EmbeddingStore.load(
+    embeddings_path, quantization=os.getenv("EMBEDDINGS_QUANTIZATION") or None
+)
+
+# Load the optional user profiles, queried by user_id (see src/profiles.py)
+profiles_path = os.path.join(os.getenv("ROOT_DIR"), "app", "backend", "profiles")
+profiles = UserProfiles.load(profiles_path) if os.path.exists(profiles_path) else None
+
+# Load the optional approximate nearest-neighbour index (see src/ann.py)
+ivf_index = None
+if os.path.exists(ann.index_path(embeddings_path)):
+    ivf_index = ann.IVFIndex.load(ann.index_path(embeddings_path))
+
+# Load the collaborative filtering models once, they are reloaded when their
+# files change
+models = get_registry(os.getenv("ROOT_DIR"))
+models.preload(predict.MODEL_NAMES)
+
+# In "precomputed" serving mode, answer known users from the top-N tables built
+# by src/modeling/precompute.py
+serving_mode = os.getenv("SERVING_MODE", "online")
+top_n_tables = {}
+if serving_mode == "precomputed":
+    for model_name in predict.MODEL_NAMES:
+        path = precompute.table_path(os.getenv("ROOT_DIR"), model_name)
+        if os.path.exists(path):
+            top_n_tables[model_name] = precompute.TopNTable.load(path)
+
+# Cache of the responses, dropped for a model when its file is reloaded
+response_cache = ResponseCache(
+    maxsize=int(os.getenv("CACHE_MAXSIZE", "10000")),
+    ttl=float(os.getenv("CACHE_TTL", "300")),
+)
+models.on_reload(lambda entry: response_cache.invalidate(entry.name))
+
+
+def store_version(dir_path: str):
+    """Identity of the interaction store on disk, new every time it is replaced."""
+    if not os.path.exists(dir_path):
+        return None
+    stat = os.stat(dir_path)
+
+    return stat.st_ino, stat.st_mtime_ns
+
+
+# src/modeling/incremental.py replaces the interaction store and the user
+# profiles, even when no model is updated: swap the new ones in at most every
+# STORE_CHECK_INTERVAL seconds, and whenever a model is reloaded
+STORE_CHECK_INTERVAL = float(os.getenv("STORE_CHECK_INTERVAL", "1"))
+interactions_version = store_version(interactions_path)
+profiles_version = store_version(profiles_path)
+stores_checked = time.monotonic()
+
+
+def reload_stores(force: bool = False):
+    """Load the interaction store and the user profiles again if replaced on disk."""
+    global interactions, interactions_version, profiles, profiles_version, stores_checked
+    now = time.monotonic()
+    if not force and now - stores_checked < STORE_CHECK_INTERVAL:
+        return
+    stores_checked = now
+
+    version = store_version(interactions_path)
+    if version is not None and version != interactions_version:
+        interactions = InteractionIndex.load(interactions_path)
+        interactions_version = version
+        # Cached recommendations may include articles clicked since
+        for model_name in predict.MODEL_NAMES:
+            response_cache.invalidate(model_name)
+    version = store_version(profiles_path)
+    if version is not None and version != profiles_version:
+        profiles = UserProfiles.load(profiles_path)
+        profiles_version = version
+
+
+models.on_reload(lambda entry: reload_stores(force=True))
+
+# Dedicated bounded pools per model, so that slow collaborative filtering
+# requests cannot delay content-based ones (see src/serving.py)
+pools = {
+    "content_based_filtering": ScoringPool.from_env(
+        "content_based_filtering", max_workers=4, max_queue=64, timeout=5
+    ),
+    "content_based_filtering_batch": ScoringPool.from_env(
+        "content_based_filtering_batch", max_workers=1, max_queue=2, timeout=600
+    ),
+    "model_based_knn": ScoringPool.from_env(
+        "model_based_knn", max_workers=2, max_queue=8, timeout=30
+    ),
+    "model_based_svd": ScoringPool.from_env(
+        "model_based_svd", max_workers=2, max_queue=32, timeout=10
+    ),
+    "model_based_als": ScoringPool.from_env(
+        "model_based_als", max_workers=2, max_queue=32, timeout=10
+    ),
+    "hybrid": ScoringPool.from_env("hybrid", max_workers=4, max_queue=64, timeout=5),
+}
+
+# Concurrent SVD (and ALS) requests are scored together, one matrix product
+# per batch
+svd_coalescer = RequestCoalescer.from_env(
+    pools["model_based_svd"],
+    lambda requests: recommend_many("model_based_svd", requests),
+    max_wait=0.002,
+    max_batch=32,
+)
+als_coalescer = RequestCoalescer.from_env(
+    pools["model_based_als"],
+    lambda requests: recommend_many("model_based_als", requests),
+    max_wait=0.002,
+    max_batch=32,
 )
 
 app = FastAPI(title="MyApp", description="News Recommender System")
 
 
+# Time every request, see src/metrics.py
+if metrics.enabled():
+    app.add_middleware(metrics.TimingMiddleware)
+
+
+@app.exception_handler(PoolSaturated)
+async def pool_saturated_handler(request: Request, exc: PoolSaturated):
+    return JSONResponse(
+        status_code=429,
+        content={"detail": f"Too many requests queued for {exc}"},
+        headers={"Retry-After": "1"},
+    )
+
+
+@app.exception_handler(asyncio.TimeoutError)
+async def timeout_handler(request: Request, exc: asyncio.TimeoutError):
+    return JSONResponse(status_code=504, content={"detail": "Scoring timed out"})
+
+
+# Largest number of articles a request may ask for; invalid counts get a 422
+MAX_NB_ARTICLES = 1000
+
+
 class RecommendationRequest(BaseModel):
     selected_user_id: int
-    random_article_id: int
-    nb_articles: int
+    random_article_id: Optional[int] = None
+    nb_articles: int = Field(gt=0, le=MAX_NB_ARTICLES)
+    query: Literal["article", "user"] = "article"
+    search: Literal["exact", "ivf"] = "exact"
+    nprobe: Optional[int] = Field(None, gt=0)
+
+
+class HybridRecommendationRequest(BaseModel):
+    selected_user_id: int
+    nb_articles: int = Field(gt=0, le=MAX_NB_ARTICLES)
+    model: Literal["model_based_svd", "model_based_knn", "model_based_als"] = "model_based_svd"
+    blend: float = Field(0.5, ge=0, le=1)
+    n_candidates: int = Field(300, gt=0, le=5000)
+    # The IVF index when one is loaded, the exact search otherwise
+    search: Optional[Literal["exact", "ivf"]] = None
+
+
+class BatchRecommendationRequest(BaseModel):
+    article_ids: List[int]
+    nb_articles: int = Field(gt=0, le=MAX_NB_ARTICLES)
+    memory_budget_mb: float = Field(256, gt=0)
+
+
+def lookup(model_name: str, model_version: str, user_id: int, nb_articles: int) -> Optional[dict]:
+    """
+    Answer from the response cache, then from the precomputed top-N table of
+    a model when it is up to date with the model serving, None otherwise.
+    """
+    result = response_cache.get((model_name, user_id, model_version), nb_articles)
+    if result is not None:
+        return result
+
+    table = top_n_tables.get(model_name)
+    if table is not None and table.model_version == model_version:
+        result = table.lookup(user_id, nb_articles)
+        if result is not None:
+            response_cache.put((model_name, user_id, model_version), nb_articles, result)
+
+    return result
+
+
+def recommend(model_name: str, user_id: int, nb_articles: int) -> dict:
+    """
+    Recommendations of a user, scored on-line when they are neither cached
+    nor precomputed (e.g. unknown users).
+    """
+    reload_stores()
+    # Checking the version reloads the model (and invalidates it) if needed
+    model_version = models.entry(model_name).version
+    result = lookup(model_name, model_version, user_id, nb_articles)
+    if result is None:
+        result = predict.recommend(
+            os.getenv("ROOT_DIR"), model_name, user_id, interactions, nb_articles
+        )
+        response_cache.put((model_name, user_id, model_version), nb_articles, result)
+
+    return result
+
+
+def recommend_many(model_name: str, requests: List[Tuple[int, int]]) -> List[dict]:
+    """
+    Same as `recommend` for a batch of (user_id, nb_articles) requests, the
+    users to score on-line being scored together by `predict.recommend_batch`.
+    """
+    reload_stores()
+    model_version = models.entry(model_name).version
+    results = [
+        lookup(model_name, model_version, user_id, nb_articles)
+        for user_id, nb_articles in requests
+    ]
+
+    misses = [i for i, result in enumerate(results) if result is None]
+    if misses:
+        max_nb_articles = max(requests[i][1] for i in misses)
+        scored = predict.recommend_batch(
+            os.getenv("ROOT_DIR"),
+            model_name,
+            [requests[i][0] for i in misses],
+            interactions,
+            max_nb_articles,
+        )
+        for i, result in zip(misses, scored):
+            user_id, nb_articles = requests[i]
+            response_cache.put((model_name, user_id, model_version), max_nb_articles, result)
+            results[i] = {name: value[:nb_articles] for name, value in result.items()}
+
+    return results
+
+
+def closest_articles(
+    article_id: int, nb_articles: int, search: str, nprobe: Optional[int]
+) -> dict:
+    """Closest articles of an article, through the response cache."""
+    cache_key = ("content_based_filtering", article_id, search, nprobe)
+    result = response_cache.get(cache_key, nb_articles)
+    if result is not None:
+        return result
+
+    result = dataset.closest_articles(
+        embeddings,
+        article_id,
+        nb_articles,
+        index=ivf_index if search == "ivf" else None,
+        nprobe=nprobe,
+    )
+    response_cache.put(cache_key, nb_articles, result)
+
+    return result
+
+
+def closest_articles_to_user(
+    user_id: int, nb_articles: int, search: str, nprobe: Optional[int]
+) -> dict:
+    """Closest articles of a user profile, excluding the articles already clicked."""
+    vector = profiles.vector(user_id)
+    if vector is None:
+        raise HTTPException(status_code=404, detail=f"No profile for user {user_id}")
+
+    return dataset.closest_articles_to_vector(
+        embeddings,
+        vector,
+        nb_articles,
+        exclude_ids=interactions.user_articles(user_id),
+        index=ivf_index if search == "ivf" else None,
+        nprobe=nprobe,
+    )
 
 
 @app.post("/content_based_filtering")
-def cbf(request: RecommendationRequest):
+async def cbf(request: RecommendationRequest):
     article_id = request.random_article_id
     nb_articles = request.nb_articles
 
-    result = dataset.closest_articles(
-        os.path.join(os.getenv("ROOT_DIR"), "models", "articles_embeddings.pickle"),
-        article_id,
-        nb_articles
+    if request.search == "ivf" and ivf_index is None:
+        raise HTTPException(status_code=400, detail="No IVF index available")
+
+    # Query by the profile of the user rather than by one of their articles
+    if request.query == "user":
+        reload_stores()
+        if profiles is None:
+            raise HTTPException(status_code=404, detail="No user profiles built")
+        return await pools["content_based_filtering"].run(
+            closest_articles_to_user,
+            request.selected_user_id,
+            nb_articles,
+            request.search,
+            request.nprobe,
+        )
+
+    if article_id is None:
+        raise HTTPException(status_code=422, detail="random_article_id is required")
+
+    result = await pools["content_based_filtering"].run(
+        closest_articles, article_id, nb_articles, request.search, request.nprobe
+    )
+
+    return result
+
+
+@app.post("/content_based_filtering_batch")
+async def cbf_batch(request: BatchRecommendationRequest):
+    unknown = [
+        article_id for article_id in request.article_ids
+        if not 0 <= article_id < embeddings.n_articles
+    ]
+    if unknown:
+        raise HTTPException(status_code=422, detail=f"Unknown article ids: {unknown[:10]}")
+
+    result = await pools["content_based_filtering_batch"].run(
+        dataset.closest_articles_batch,
+        embeddings,
+        request.article_ids,
+        request.nb_articles,
+        memory_budget_mb=request.memory_budget_mb,
     )
 
     return result
 
 
 @app.post("/collaborative_filtering_knnWithMeans")
-def cf_algo_knn(request: RecommendationRequest):
+async def cf_algo_knn(request: RecommendationRequest):
     user_id = request.selected_user_id
     nb_articles = request.nb_articles
 
-    result = predict.cf_knn(os.getenv("ROOT_DIR"), user_id, df, nb_articles)
+    result = await pools["model_based_knn"].run(
+        recommend, "model_based_knn", user_id, nb_articles
+    )
 
     return result
 
 
 @app.post("/collaborative_filtering_svd")
-def cf_algo_svd(request: RecommendationRequest):
+async def cf_algo_svd(request: RecommendationRequest):
     user_id = request.selected_user_id
     nb_articles = request.nb_articles
 
-    result = predict.cf_svd(os.getenv("ROOT_DIR"), user_id, df, nb_articles)
+    result = await svd_coalescer.submit((user_id, nb_articles))
 
     return result
+
+
+@app.post("/collaborative_filtering_als")
+async def cf_algo_als(request: RecommendationRequest):
+    user_id = request.selected_user_id
+    nb_articles = request.nb_articles
+
+    if not os.path.exists(models.file_path("model_based_als")):
+        raise HTTPException(status_code=404, detail="No ALS model trained")
+
+    result = await als_coalescer.submit((user_id, nb_articles))
+
+    return result
+
+
+@app.post("/hybrid")
+async def hybrid_recommendations(request: HybridRecommendationRequest):
+    search = request.search or ("ivf" if ivf_index is not None else "exact")
+    if search == "ivf" and ivf_index is None:
+        raise HTTPException(status_code=400, detail="No IVF index available")
+    if not os.path.exists(models.file_path(request.model)):
+        raise HTTPException(status_code=404, detail=f"No {request.model} model trained")
+
+    reload_stores()
+    result = await pools["hybrid"].run(
+        hybrid.recommend,
+        os.getenv("ROOT_DIR"),
+        request.model,
+        request.selected_user_id,
+        interactions,
+        embeddings,
+        request.nb_articles,
+        blend=request.blend,
+        n_candidates=request.n_candidates,
+        index=ivf_index if search == "ivf" else None,
+    )
+
+    return result
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    return metrics.render()
+
+
+@app.get("/models")
+def model_versions():
+    return models.describe()
+
+
+@app.get("/stats/cache")
+def cache_stats():
+    return response_cache.stats()
+
+
+@app.get("/stats/pools")
+def pool_stats():
+    return {name: pool.stats() for name, pool in pools.items()}
+
+
+@app.get("/stats/batching")
+def batching_stats():
+    return {
+        "model_based_svd": svd_coalescer.stats(),
+        "model_based_als": als_coalescer.stats(),
+    }
@@ -3,18 +3,27 @@ import os
 import json
 import requests
 import streamlit as st
+import numpy as np
 import pandas as pd
 from dotenv import load_dotenv
 from src import dataset
+from src.interactions import InteractionIndex
 
 # Load environment variables from .env file
 load_dotenv()
 ROOT_DIR = os.getenv("ROOT_DIR")
 
-# Load pickle object
-df = dataset.load_pickle_file(
-    os.path.join(ROOT_DIR, "app", "backend", "dataset.pickle")
-)
+# Memory-map the columnar interaction store when it exists (see
+# src/interactions.py), otherwise index the clicks of the pickle object once
+interactions_path = os.path.join(ROOT_DIR, "app", "backend", "interactions")
+if os.path.exists(interactions_path):
+    interactions = InteractionIndex.load(interactions_path)
+else:
+    interactions = InteractionIndex.from_frame(
+        dataset.load_pickle_file(
+            os.path.join(ROOT_DIR, "app", "backend", "dataset.pickle")
+        )
+    )
 
 
 def app():
@@ -31,13 +40,13 @@ def app():
     st.sidebar.write("## Input Data :gear:")
 
     # Extract unique user_id, article_id and nb_articles
-    unique_user_ids = df["user_id"].unique().tolist()
+    unique_user_ids = interactions.user_ids.tolist()
     selected_user_id = st.sidebar.selectbox("Choose an user_id", unique_user_ids)
     st.write(f"You selected user_id: {selected_user_id}")
     if selected_user_id:
-        user_articles = df[df["user_id"] == selected_user_id]["article_id"]
-    if not user_articles.empty:
-        random_article_id = user_articles.sample(1).iloc[0]
+        user_articles = interactions.user_articles(selected_user_id)
+    if len(user_articles):
+        random_article_id = np.random.choice(user_articles)
         st.write(
             f"Random article_id associated: {random_article_id}\n"
             "(Only useful for the content-based filtering model)"
@@ -63,7 +72,9 @@ def app():
         [
             "content_based_filtering",
             "collaborative_filtering_knnWithMeans",
-            "collaborative_filtering_svd"
+            "collaborative_filtering_svd",
+            "collaborative_filtering_als",
+            "hybrid"
         ]
     )
 
@@ -0,0 +1,134 @@
+"""Training time and ranking quality of the implicit ALS model against the SVD model
+
+Holds out one clicked article per user (among the users with at least two),
+trains `model_based_svd` (surprise, fixed parameters) and `model_based_als`
+on the remaining ratings, and ranks the articles not clicked in training for
+a sample of users with `predict.recommend_batch`.
+
+Usage (from the root of the repo):
+    python -m benchmarks.als_vs_svd --dataset app/backend/dataset.pickle --k 10
+    python -m benchmarks.als_vs_svd --n-users 20000 --n-articles 5000 --n-clicks 300000
+"""
+
+# Import packages
+import argparse
+import os
+import pickle
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from surprise import Dataset, Reader, SVD
+from benchmarks import synthetic
+from src import dataset
+from src.features import rating_implicite
+from src.interactions import InteractionIndex
+from src.modeling import als, predict
+
+
+def leave_one_out(df: pd.DataFrame, seed: int = 0):
+    """Split off one random (user, article) pair of every user with two or more."""
+    rng = np.random.default_rng(seed)
+    pairs = df[["user_id", "article_id"]].drop_duplicates()
+    pairs = pairs[pairs.groupby("user_id")["user_id"].transform("size") >= 2]
+    held_out = pairs.iloc[rng.permutation(len(pairs))].drop_duplicates("user_id")
+
+    is_held_out = pd.MultiIndex.from_frame(df[["user_id", "article_id"]]).isin(
+        pd.MultiIndex.from_frame(held_out)
+    )
+
+    return df[~is_held_out], held_out.set_index("user_id")["article_id"]
+
+
+def ranking_metrics(recommended: list, held_out: pd.Series, users: list, k: int) -> dict:
+    hits = np.array(
+        [held_out[user] in result["article_ids"][:k] for user, result in zip(users, recommended)]
+    )
+    ranks = np.array(
+        [
+            result["article_ids"].index(held_out[user]) if hit else -1
+            for user, result, hit in zip(users, recommended, hits)
+        ]
+    )
+    ndcg = np.where(hits, 1 / np.log2(np.maximum(ranks, 0) + 2), 0.0)
+    catalogue = set(a for result in recommended for a in result["article_ids"][:k])
+
+    return {
+        f"recall@{k}": hits.mean(),
+        f"precision@{k}": hits.mean() / k,
+        f"ndcg@{k}": ndcg.mean(),
+        "distinct_articles": len(catalogue),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dataset", help="ratings pickle, synthetic clicks otherwise")
+    parser.add_argument("--n-users", type=int, default=5000)
+    parser.add_argument("--n-articles", type=int, default=3000)
+    parser.add_argument("--n-clicks", type=int, default=100000)
+    parser.add_argument("--n-eval-users", type=int, default=2000)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--factors", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.dataset:
+        ratings = dataset.load_pickle_file(args.dataset)
+    else:
+        ratings = rating_implicite(
+            synthetic.generate_clicks(args.n_users, args.n_articles, args.n_clicks, args.seed)
+        )
+    train, held_out = leave_one_out(ratings, args.seed)
+    interactions = InteractionIndex.from_frame(train)
+
+    rng = np.random.default_rng(args.seed)
+    users = rng.choice(
+        held_out.index.to_numpy(), min(args.n_eval_users, len(held_out)), replace=False
+    ).tolist()
+    print(f"{len(train)} training ratings, {len(users)} evaluated users")
+
+    with tempfile.TemporaryDirectory() as ROOT_DIR:
+        os.makedirs(os.path.join(ROOT_DIR, "models"))
+
+        start = time.perf_counter()
+        svd = SVD(n_factors=args.factors, n_epochs=10, random_state=args.seed)
+        svd.fit(
+            Dataset.load_from_df(
+                train[["user_id", "article_id", "rating"]], Reader(rating_scale=(0, 10))
+            ).build_full_trainset()
+        )
+        fit_seconds = {"model_based_svd": time.perf_counter() - start}
+        with open(os.path.join(ROOT_DIR, "models", "model_based_svd.pickle"), "wb") as f:
+            pickle.dump(svd, f)
+
+        start = time.perf_counter()
+        als.model_based_als(
+            train,
+            os.path.join(ROOT_DIR, "models", "model_based_als.npz"),
+            factors=args.factors,
+            seed=args.seed,
+        )
+        fit_seconds["model_based_als"] = time.perf_counter() - start
+
+        print(f"{'model':>16} {'fit (s)':>8} {'score (ms/user)':>16} {'recall@' + str(args.k):>10} "
+              f"{'ndcg@' + str(args.k):>8} {'distinct':>9}")
+        for model_name in ["model_based_svd", "model_based_als"]:
+            start = time.perf_counter()
+            recommended = []
+            for i in range(0, len(users), 256):
+                recommended.extend(
+                    predict.recommend_batch(
+                        ROOT_DIR, model_name, users[i:i + 256], interactions, args.k
+                    )
+                )
+            score_ms = (time.perf_counter() - start) * 1000 / len(users)
+
+            scores = ranking_metrics(recommended, held_out, users, args.k)
+            print(f"{model_name:>16} {fit_seconds[model_name]:>8.2f} {score_ms:>16.3f} "
+                  f"{scores[f'recall@{args.k}']:>10.3f} {scores[f'ndcg@{args.k}']:>8.3f} "
+                  f"{scores['distinct_articles']:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Recall@k vs. latency report of the IVF index against the exact search
+
+Usage (from the root of the repo):
+    python -m benchmarks.ann_recall models/articles_embeddings.npy --k 10
+"""
+
+# Import packages
+import argparse
+import os
+import time
+import numpy as np
+from src import ann, dataset
+from src.embeddings import EmbeddingStore
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("embeddings_path")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--n-queries", type=int, default=200)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    args = parser.parse_args()
+
+    store = EmbeddingStore.load(args.embeddings_path)
+    index_file = ann.index_path(args.embeddings_path)
+    if os.path.exists(index_file):
+        index = ann.IVFIndex.load(index_file)
+    else:
+        start = time.perf_counter()
+        index = ann.IVFIndex.build(store)
+        print(f"Built index with {index.n_lists} lists in "
+              f"{time.perf_counter() - start:.1f} s")
+
+    rng = np.random.default_rng(0)
+    queries = rng.choice(store.n_articles, args.n_queries, replace=False)
+
+    def run(**kwargs):
+        results, durations = [], []
+        for article_id in queries:
+            start = time.perf_counter()
+            result = dataset.closest_articles(store, int(article_id), args.k, **kwargs)
+            durations.append((time.perf_counter() - start) * 1000)
+            results.append(result["indices"])
+        return results, np.array(durations)
+
+    exact, exact_durations = run()
+    print(f"{'search':>12} {'recall@' + str(args.k):>10} {'p50 (ms)':>10} {'p95 (ms)':>10}")
+    print(f"{'exact':>12} {1.0:>10.3f} {np.percentile(exact_durations, 50):>10.2f} "
+          f"{np.percentile(exact_durations, 95):>10.2f}")
+    for nprobe in args.nprobe:
+        approx, durations = run(index=index, nprobe=nprobe)
+        recall = np.mean(
+            [len(set(a) & set(e)) / len(e) for a, e in zip(approx, exact)]
+        )
+        print(f"{'ivf/' + str(nprobe):>12} {recall:>10.3f} "
+              f"{np.percentile(durations, 50):>10.2f} "
+              f"{np.percentile(durations, 95):>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Memory and recall@k report of the quantized embeddings against the exact search
+
+For each quantization, reports the resident size of the compact copy, the
+recall@k of its first-pass scan alone and after the exact float32 re-rank of
+`closest_articles`, and the latency of both searches.
+
+Usage (from the root of the repo):
+    python -m benchmarks.quantization models/articles_embeddings.npy --k 10
+"""
+
+# Import packages
+import argparse
+import time
+import numpy as np
+from src import dataset, ranking
+from src.embeddings import QUANTIZATIONS, EmbeddingStore, QuantizedEmbeddings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("embeddings_path")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--n-queries", type=int, default=200)
+    parser.add_argument("--rerank-candidates", type=int, nargs="+", default=[50, 100, 200])
+    args = parser.parse_args()
+
+    store = EmbeddingStore.load(args.embeddings_path, mmap=False)
+    rng = np.random.default_rng(0)
+    queries = rng.choice(store.n_articles, min(args.n_queries, store.n_articles), replace=False)
+
+    def run(store, **kwargs):
+        results, durations = [], []
+        for article_id in queries:
+            start = time.perf_counter()
+            result = dataset.closest_articles(store, int(article_id), args.k, **kwargs)
+            durations.append((time.perf_counter() - start) * 1000)
+            results.append(result["indices"])
+        return results, np.array(durations)
+
+    def recall(approx, exact):
+        return np.mean([len(set(a) & set(e)) / len(e) for a, e in zip(approx, exact)])
+
+    exact, exact_durations = run(store)
+    float32_mb = store.vectors.nbytes / 2**20
+    print(f"{store.n_articles} articles x {store.dim} dims, k={args.k}")
+    print(f"{'search':>18} {'memory (MB)':>12} {'saved':>7} {'recall@' + str(args.k):>10} "
+          f"{'p50 (ms)':>10} {'p95 (ms)':>10}")
+    print(f"{'float32':>18} {float32_mb:>12.1f} {'':>7} {1.0:>10.3f} "
+          f"{np.percentile(exact_durations, 50):>10.2f} {np.percentile(exact_durations, 95):>10.2f}")
+
+    for quantization in QUANTIZATIONS:
+        quantized = QuantizedEmbeddings.from_vectors(store.vectors, quantization)
+        quantized_mb = quantized.nbytes / 2**20
+        saved = f"{1 - quantized_mb / float32_mb:.0%}"
+
+        # First pass alone, without the exact re-rank
+        first_pass = [
+            ranking.top_k(
+                quantized.similarities(store.vector(int(article_id))), args.k,
+                exclude=[int(article_id)],
+            )[0]
+            for article_id in queries
+        ]
+        print(f"{quantization + ' scan':>18} {quantized_mb:>12.1f} {saved:>7} "
+              f"{recall(first_pass, exact):>10.3f} {'':>10} {'':>10}")
+
+        quantized_store = EmbeddingStore(store.vectors, quantized)
+        for rerank_candidates in args.rerank_candidates:
+            approx, durations = run(quantized_store, rerank_candidates=rerank_candidates)
+            print(f"{quantization + '/' + str(rerank_candidates):>18} {quantized_mb:>12.1f} "
+                  f"{saved:>7} {recall(approx, exact):>10.3f} "
+                  f"{np.percentile(durations, 50):>10.2f} {np.percentile(durations, 95):>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+"""Latency, throughput and memory benchmark of the recommendation paths
+
+For each scale, generates a synthetic ROOT_DIR (see benchmarks/synthetic.py),
+times the public functions of `src.dataset` and `src.modeling.predict` and
+the routes of the FastAPI backend through the in-process test client, and
+reports p50/p95/p99 latencies, throughput and peak traced memory. The
+response cache is disabled so that every request is scored.
+
+Usage (from the root of the repo):
+    python -m benchmarks.suite --scales small medium --output bench.json
+    python -m benchmarks.suite --scales small --compare bench.json
+"""
+
+# Import packages
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, List, Optional
+import numpy as np
+from benchmarks import synthetic
+from src import dataset
+from src.embeddings import EmbeddingStore
+from src.interactions import InteractionIndex
+from src.modeling import predict
+
+# Sizes of the synthetic datasets. The KNN similarity matrix is quadratic in
+# the number of clicked articles, so it is left out of the large scale.
+SCALES = {
+    "small": {"n_users": 1000, "n_articles": 2000, "n_clicks": 20000, "dim": 64, "knn": True},
+    "medium": {"n_users": 10000, "n_articles": 5000, "n_clicks": 200000, "dim": 250, "knn": True},
+    "large": {"n_users": 50000, "n_articles": 50000, "n_clicks": 1000000, "dim": 250, "knn": False},
+}
+
+
+def measure(func: Callable[[int], object], n_calls: int, warmup: int = 3) -> dict:
+    """
+    Latency percentiles (ms) and sequential throughput of `func(i)` over
+    `n_calls` calls, then the peak memory traced during a few more calls.
+    """
+    for i in range(warmup):
+        func(i)
+
+    durations = []
+    start = time.perf_counter()
+    for i in range(n_calls):
+        call_start = time.perf_counter()
+        func(i)
+        durations.append((time.perf_counter() - call_start) * 1000)
+    elapsed = time.perf_counter() - start
+
+    # Traced separately, tracemalloc slows down the allocations
+    tracemalloc.start()
+    baseline, _ = tracemalloc.get_traced_memory()
+    for i in range(min(n_calls, 5)):
+        func(i)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return summarize(durations, n_calls / elapsed, peak - baseline)
+
+
+def summarize(durations: List[float], throughput: float, peak_bytes: Optional[int]) -> dict:
+    durations = np.array(durations)
+
+    return {
+        "n_calls": len(durations),
+        "mean_ms": float(durations.mean()),
+        "p50_ms": float(np.percentile(durations, 50)),
+        "p95_ms": float(np.percentile(durations, 95)),
+        "p99_ms": float(np.percentile(durations, 99)),
+        "throughput_per_s": float(throughput),
+        "peak_memory_mb": None if peak_bytes is None else peak_bytes / 2**20,
+    }
+
+
+def bench_functions(ROOT_DIR: str, knn: bool, n_calls: int, nb: int, seed: int) -> dict:
+    """Benchmarks of the functions called by the backend routes."""
+    store = EmbeddingStore.load(os.path.join(ROOT_DIR, "models", "articles_embeddings.npy"))
+    frame = dataset.load_pickle_file(os.path.join(ROOT_DIR, "app", "backend", "dataset.pickle"))
+    index = InteractionIndex.load(os.path.join(ROOT_DIR, "app", "backend", "interactions"))
+
+    rng = np.random.default_rng(seed)
+    users = rng.choice(index.user_ids, n_calls + 3).tolist()
+    articles = rng.integers(0, store.n_articles, n_calls + 3).tolist()
+
+    benchmarks = {
+        "closest_articles": lambda i: dataset.closest_articles(store, articles[i], nb),
+        "articles_not_clicked_by_user[index]": lambda i: dataset.articles_not_clicked_by_user(
+            index, users[i]
+        ),
+        "articles_not_clicked_by_user[frame]": lambda i: dataset.articles_not_clicked_by_user(
+            frame, users[i]
+        ),
+        "cf_baseline_only": lambda i: predict.cf_baseline_only(ROOT_DIR, users[i], index, nb),
+        "cf_svd": lambda i: predict.cf_svd(ROOT_DIR, users[i], index, nb),
+    }
+    if knn:
+        benchmarks["cf_knn"] = lambda i: predict.cf_knn(ROOT_DIR, users[i], index, nb)
+
+    results = {}
+    for name, func in benchmarks.items():
+        results[name] = measure(func, n_calls)
+        print(f"  {name:<40} p50 {results[name]['p50_ms']:8.2f} ms")
+
+    return results
+
+
+def load_backend(ROOT_DIR: str):
+    """Import a fresh instance of the backend app serving `ROOT_DIR`."""
+    os.environ["ROOT_DIR"] = ROOT_DIR
+    os.environ["CACHE_MAXSIZE"] = "0"
+    backend_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app", "backend")
+    if backend_dir not in sys.path:
+        sys.path.insert(0, backend_dir)
+    sys.modules.pop("fastapi_app", None)
+
+    return importlib.import_module("fastapi_app")
+
+
+async def concurrent_throughput(app, route: str, payloads: List[dict], concurrency: int) -> float:
+    """Requests per second with `concurrency` requests in flight."""
+    import httpx
+
+    async with httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app), base_url="http://bench"
+    ) as client:
+        start = time.perf_counter()
+        for i in range(0, len(payloads), concurrency):
+            responses = await asyncio.gather(
+                *[client.post(route, json=payload) for payload in payloads[i:i + concurrency]]
+            )
+            assert all(r.status_code == 200 for r in responses), route
+        elapsed = time.perf_counter() - start
+
+    return len(payloads) / elapsed
+
+
+def bench_routes(
+    ROOT_DIR: str, knn: bool, n_calls: int, nb: int, concurrency: int, seed: int
+) -> dict:
+    """Benchmarks of the backend routes through the in-process test client."""
+    from fastapi.testclient import TestClient
+
+    backend = load_backend(ROOT_DIR)
+    rng = np.random.default_rng(seed)
+    users = rng.choice(backend.interactions.user_ids, n_calls + 3).tolist()
+    articles = rng.integers(0, backend.embeddings.n_articles, n_calls + 3).tolist()
+    payloads = [
+        {"selected_user_id": u, "random_article_id": a, "nb_articles": nb}
+        for u, a in zip(users, articles)
+    ]
+
+    routes = ["/content_based_filtering", "/collaborative_filtering_svd"]
+    if knn:
+        routes.append("/collaborative_filtering_knnWithMeans")
+
+    results = {}
+    with TestClient(backend.app) as client:
+        for route in routes:
+            def call(i, route=route):
+                response = client.post(route, json=payloads[i])
+                assert response.status_code == 200, response.text
+
+            results[route] = measure(call, n_calls)
+            if concurrency > 1:
+                results[route]["concurrent_throughput_per_s"] = asyncio.run(
+                    concurrent_throughput(backend.app, route, payloads[:n_calls], concurrency)
+                )
+            print(f"  {route:<40} p50 {results[route]['p50_ms']:8.2f} ms")
+
+    return results
+
+
+def run(
+    scales: List[str], n_calls: int, nb: int, concurrency: int, seed: int, routes: bool
+) -> dict:
+    report = {
+        "metadata": {
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "n_calls": n_calls,
+            "nb_articles": nb,
+            "concurrency": concurrency,
+        },
+        "scales": {},
+    }
+
+    for scale in scales:
+        with tempfile.TemporaryDirectory(prefix=f"bench_{scale}_") as ROOT_DIR:
+            print(f"{scale}: generating data")
+            start = time.perf_counter()
+            data = synthetic.generate(ROOT_DIR, seed=seed, **SCALES[scale])
+            data["generation_seconds"] = time.perf_counter() - start
+
+            results = bench_functions(ROOT_DIR, data["knn"], n_calls, nb, seed)
+            if routes:
+                results.update(bench_routes(ROOT_DIR, data["knn"], n_calls, nb, concurrency, seed))
+            report["scales"][scale] = {"data": data, "results": results}
+
+    return report
+
+
+def compare(previous: dict, current: dict, threshold: float) -> List[str]:
+    """
+    Print the p50 and p95 latencies of both runs side by side and return the
+    benchmarks whose p50 grew by more than `threshold` times.
+    """
+    regressions = []
+    print(f"{'benchmark':<52} {'p50 before':>11} {'p50 after':>11} {'ratio':>7} "
+          f"{'p95 before':>11} {'p95 after':>11}")
+    for scale, entry in current["scales"].items():
+        before_results = previous["scales"].get(scale, {}).get("results", {})
+        for name, after in entry["results"].items():
+            before = before_results.get(name)
+            if before is None:
+                continue
+            ratio = after["p50_ms"] / before["p50_ms"] if before["p50_ms"] else float("inf")
+            flag = " !" if ratio > threshold else ""
+            print(f"{scale + ' ' + name:<52} {before['p50_ms']:>11.2f} {after['p50_ms']:>11.2f} "
+                  f"{ratio:>7.2f} {before['p95_ms']:>11.2f} {after['p95_ms']:>11.2f}{flag}")
+            if flag:
+                regressions.append(f"{scale} {name}")
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scales", nargs="+", choices=list(SCALES), default=["small"])
+    parser.add_argument("--n-calls", type=int, default=100)
+    parser.add_argument("--nb-articles", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--no-routes", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="JSON file to write the results to")
+    parser.add_argument("--compare", help="JSON file of a previous run to compare to")
+    parser.add_argument("--threshold", type=float, default=1.2,
+                        help="p50 ratio above which a benchmark is reported as a regression")
+    args = parser.parse_args()
+
+    report = run(
+        args.scales, args.n_calls, args.nb_articles, args.concurrency, args.seed,
+        not args.no_routes,
+    )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        regressions = compare(previous, report, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
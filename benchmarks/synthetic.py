@@ -0,0 +1,177 @@
+"""Synthetic Globo-shaped dataset and models for the benchmarks
+
+Writes, under a ROOT_DIR laid out like the repo, everything the backend
+loads at startup: the article embeddings, the implicit ratings
+(`app/backend/dataset.pickle` and its interaction store) and the three
+collaborative filtering models, trained with fixed small parameters.
+
+Usage (from the root of the repo):
+    python -m benchmarks.synthetic /tmp/bench --n-users 1000 --n-articles 2000
+"""
+
+# Import packages
+import argparse
+import os
+import pickle
+import numpy as np
+import pandas as pd
+from surprise import BaselineOnly, Dataset, KNNWithMeans, Reader, SVD
+from src.embeddings import normalize_rows
+from src.features import rating_implicite
+from src.interactions import write_interaction_store
+
+
+def generate_clicks(
+    n_users: int, n_articles: int, n_clicks: int, seed: int = 0
+) -> pd.DataFrame:
+    """
+    Clicks with the columns of the Globo click files used downstream: a
+    heavy-tailed number of clicks per user, a Zipf-like article popularity,
+    sessions of a few clicks and timestamps (ms) spread over 16 days.
+    """
+    rng = np.random.default_rng(seed)
+
+    # Every user clicks at least once, the rest follows a lognormal activity
+    activity = rng.lognormal(0, 1.2, n_users)
+    extra = rng.multinomial(n_clicks - n_users, activity / activity.sum())
+    user_ids = np.repeat(np.arange(n_users), 1 + extra)
+
+    popularity = 1 / np.arange(1, n_articles + 1) ** 1.1
+    article_ids = rng.permutation(n_articles)[
+        rng.choice(n_articles, len(user_ids), p=popularity / popularity.sum())
+    ]
+
+    # A new session starts with each user and at random between clicks
+    new_session = np.ones(len(user_ids), dtype=bool)
+    new_session[1:] = (user_ids[1:] != user_ids[:-1]) | (rng.random(len(user_ids) - 1) < 0.4)
+    session_ids = np.cumsum(new_session) - 1
+    session_sizes = np.bincount(session_ids)[session_ids]
+
+    start = 1506826800000  # 2017-10-01, as in the Globo dataset
+    user_start = start + rng.integers(0, 16 * 24 * 3600 * 1000, n_users)
+    elapsed = np.cumsum(rng.integers(30_000, 600_000, len(user_ids)))
+    first_click = np.r_[0, np.cumsum(1 + extra)[:-1]]
+    click_timestamps = user_start[user_ids] + elapsed - elapsed[first_click][user_ids]
+
+    return pd.DataFrame(
+        {
+            "user_id": user_ids,
+            "session_id": session_ids,
+            "session_size": session_sizes,
+            "article_id": article_ids,
+            "click_timestamp": click_timestamps,
+        }
+    )
+
+
+def generate_embeddings(n_articles: int, dim: int, seed: int = 0) -> np.ndarray:
+    """Article embeddings drawn around a few topic centers, as float32."""
+    rng = np.random.default_rng(seed)
+    n_topics = max(1, n_articles // 200)
+    centers = rng.normal(0, 1, (n_topics, dim))
+    topics = rng.integers(0, n_topics, n_articles)
+
+    return (centers[topics] + rng.normal(0, 0.7, (n_articles, dim))).astype(np.float32)
+
+
+def train_models(ratings: pd.DataFrame, model_dir: str, knn: bool = True, seed: int = 0):
+    """Fit the served models with fixed parameters and pickle them."""
+    data = Dataset.load_from_df(
+        ratings[["user_id", "article_id", "rating"]], Reader(rating_scale=(0, 10))
+    )
+    trainset = data.build_full_trainset()
+
+    algos = {
+        "model_baseline_only": BaselineOnly(
+            bsl_options={"method": "als", "n_epochs": 10}, verbose=False
+        ),
+        "model_based_svd": SVD(n_factors=50, n_epochs=10, random_state=seed),
+    }
+    if knn:
+        algos["model_based_knn"] = KNNWithMeans(
+            sim_options={"name": "msd", "min_support": 4, "user_based": False},
+            verbose=False,
+        )
+
+    for name, algo in algos.items():
+        algo.fit(trainset)
+        with open(os.path.join(model_dir, name + ".pickle"), "wb") as model_file:
+            pickle.dump(algo, model_file)
+
+
+def generate(
+    ROOT_DIR: str,
+    n_users: int = 1000,
+    n_articles: int = 2000,
+    n_clicks: int = 20000,
+    dim: int = 64,
+    knn: bool = True,
+    seed: int = 0,
+) -> dict:
+    """
+    Write a complete synthetic ROOT_DIR.
+
+    Parameters:
+    ROOT_DIR (str): Directory to write into.
+    n_users (int): Number of users.
+    n_articles (int): Number of articles of the catalogue.
+    n_clicks (int): Number of clicks (at least `n_users`).
+    dim (int): Dimension of the article embeddings (250 in Globo).
+    knn (bool): Whether to train the KNN model, whose similarity matrix is
+    quadratic in the number of clicked articles.
+    seed (int): Seed of the generators.
+
+    Returns:
+    dict: The parameters and the sizes of what was generated.
+    """
+    model_dir = os.path.join(ROOT_DIR, "models")
+    backend_dir = os.path.join(ROOT_DIR, "app", "backend")
+    os.makedirs(model_dir, exist_ok=True)
+    os.makedirs(backend_dir, exist_ok=True)
+
+    np.save(
+        os.path.join(model_dir, "articles_embeddings.npy"),
+        normalize_rows(generate_embeddings(n_articles, dim, seed)),
+    )
+
+    clicks = generate_clicks(n_users, n_articles, max(n_clicks, n_users), seed)
+    ratings = rating_implicite(clicks)
+    with open(os.path.join(backend_dir, "dataset.pickle"), "wb") as f:
+        pickle.dump(ratings, f)
+    write_interaction_store(ratings, os.path.join(backend_dir, "interactions"))
+
+    train_models(ratings, model_dir, knn, seed)
+
+    return {
+        "n_users": n_users,
+        "n_articles": n_articles,
+        "n_clicks": len(clicks),
+        "n_clicked_articles": int(ratings["article_id"].nunique()),
+        "dim": dim,
+        "knn": knn,
+        "seed": seed,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("root_dir")
+    parser.add_argument("--n-users", type=int, default=1000)
+    parser.add_argument("--n-articles", type=int, default=2000)
+    parser.add_argument("--n-clicks", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=64)
+    parser.add_argument("--no-knn", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(
+        generate(
+            args.root_dir,
+            args.n_users,
+            args.n_articles,
+            args.n_clicks,
+            args.dim,
+            not args.no_knn,
+            args.seed,
+        )
+    )
@@ -0,0 +1,68 @@
+"""Benchmark of top-k selection over a catalogue-sized similarity vector
+
+Compares the former ranking of `closest_articles` (two full sorts) with
+`src.ranking.top_k` (argpartition, then a sort of the k winners only).
+
+Usage (from the root of the repo):
+    python -m benchmarks.top_k --n-items 364047 --k 5 10 100
+"""
+
+# Import packages
+import argparse
+import time
+import numpy as np
+from src.ranking import top_k
+
+
+def two_full_sorts(scores: np.ndarray, k: int):
+    """Ranking as previously done in `closest_articles`."""
+    sorted_indices = np.argsort(-scores)[1:][:k]
+    sorted_scores = np.sort(scores)[::-1][1:][:k]
+
+    return sorted_indices, sorted_scores
+
+
+def timeit(func, repeat: int) -> np.ndarray:
+    """Run `func` `repeat` times and return the durations in milliseconds."""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append((time.perf_counter() - start) * 1000)
+
+    return np.array(durations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--n-items", type=int, default=364047)
+    parser.add_argument("--k", type=int, nargs="+", default=[5, 10, 100])
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    scores = rng.uniform(-1, 1, args.n_items).astype(np.float32)
+    query_id = int(np.argmax(scores))
+
+    print(f"n_items={args.n_items}, repeat={args.repeat}")
+    print(f"{'k':>5} {'method':>16} {'p50 (ms)':>10} {'p95 (ms)':>10}")
+    for k in args.k:
+        runs = {
+            "two_full_sorts": lambda: two_full_sorts(scores, k),
+            "top_k": lambda: top_k(scores, k, exclude=[query_id]),
+        }
+        for name, func in runs.items():
+            durations = timeit(func, args.repeat)
+            print(
+                f"{k:>5} {name:>16} {np.percentile(durations, 50):>10.2f} "
+                f"{np.percentile(durations, 95):>10.2f}"
+            )
+
+        # Both methods must return the same neighbours
+        expected, _ = two_full_sorts(scores, k)
+        actual, _ = top_k(scores, k, exclude=[query_id])
+        assert np.array_equal(expected, actual)
+
+
+if __name__ == "__main__":
+    main()
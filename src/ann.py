@@ -0,0 +1,193 @@
+"""Module containing an approximate nearest-neighbour index of articles embeddings"""
+
+# Import packages
+import argparse
+import os
+from typing import Iterable, Optional, Tuple
+import numpy as np
+from src import ranking
+from src.embeddings import EmbeddingStore, normalize_rows
+
+
+class IVFIndex:
+    """
+    Inverted file (IVF) index over normalized article embeddings.
+
+    Articles are clustered with a spherical k-means; each cluster keeps the
+    list of its articles. A query only scores the articles of the `nprobe`
+    clusters whose centroids are the most similar to it, instead of the whole
+    catalogue. The inverted lists are stored CSR-style: `article_ids` holds
+    the articles grouped by cluster and `offsets[c]:offsets[c + 1]` delimits
+    cluster `c`.
+    """
+
+    def __init__(
+        self,
+        centroids: np.ndarray,
+        article_ids: np.ndarray,
+        offsets: np.ndarray,
+        nprobe: int = 8,
+    ):
+        self.centroids = centroids
+        self.article_ids = article_ids
+        self.offsets = offsets
+        self.nprobe = nprobe
+
+    @property
+    def n_lists(self) -> int:
+        return self.centroids.shape[0]
+
+    @classmethod
+    def build(
+        cls,
+        store: EmbeddingStore,
+        n_lists: Optional[int] = None,
+        n_iter: int = 10,
+        sample_size: Optional[int] = None,
+        chunk_size: int = 65536,
+        seed: int = 0,
+    ) -> "IVFIndex":
+        """
+        Cluster the embeddings of a store and build the inverted lists.
+
+        Parameters:
+        store (EmbeddingStore): Store of normalized articles embeddings.
+        n_lists (Optional[int]): Number of clusters, 2 * sqrt(n) by default.
+        n_iter (int): Number of k-means iterations.
+        sample_size (Optional[int]): Number of articles used to train the
+        centroids, 64 per cluster by default.
+        chunk_size (int): Number of articles assigned per matrix product.
+        seed (int): Seed of the random generator.
+
+        Returns:
+        IVFIndex: The built index.
+        """
+        rng = np.random.default_rng(seed)
+        n = store.n_articles
+        if n_lists is None:
+            n_lists = max(1, int(2 * np.sqrt(n)))
+        if sample_size is None:
+            sample_size = 64 * n_lists
+        sample_size = min(max(sample_size, n_lists), n)
+
+        # Train the centroids with a spherical k-means on a sample
+        sample_ids = np.sort(rng.choice(n, sample_size, replace=False))
+        sample = np.asarray(store.vectors[sample_ids], dtype=np.float32)
+        centroids = sample[rng.choice(sample_size, n_lists, replace=False)]
+        for _ in range(n_iter):
+            assignment = _assign(sample, centroids, chunk_size)
+            counts = np.bincount(assignment, minlength=n_lists)
+            starts = np.cumsum(counts) - counts
+            empty = counts == 0
+            sums = np.zeros_like(centroids)
+            sums[~empty] = np.add.reduceat(
+                sample[np.argsort(assignment, kind="stable")], starts[~empty], axis=0
+            )
+            # Re-seed empty clusters with random sample points
+            sums[empty] = sample[rng.choice(sample_size, int(empty.sum()))]
+            centroids = normalize_rows(sums)
+
+        # Assign every article to its closest centroid
+        assignment = _assign(store.vectors, centroids, chunk_size)
+        article_ids = np.argsort(assignment, kind="stable").astype(np.uint32)
+        offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignment, minlength=n_lists), out=offsets[1:])
+
+        return cls(centroids, article_ids, offsets)
+
+    def save(self, file_path: str) -> str:
+        """Persist the index as a `.npz` file."""
+        tmp_path = file_path + ".tmp.npz"
+        np.savez(
+            tmp_path,
+            centroids=self.centroids,
+            article_ids=self.article_ids,
+            offsets=self.offsets,
+        )
+        os.replace(tmp_path, file_path)
+
+        return file_path
+
+    @classmethod
+    def load(cls, file_path: str, nprobe: int = 8) -> "IVFIndex":
+        """Load an index written by `save`."""
+        with np.load(file_path) as data:
+            return cls(
+                data["centroids"], data["article_ids"], data["offsets"], nprobe
+            )
+
+    def candidates(self, query: np.ndarray, nprobe: Optional[int] = None) -> np.ndarray:
+        """Article ids of the `nprobe` clusters closest to a query."""
+        nprobe = min(nprobe or self.nprobe, self.n_lists)
+        lists, _ = ranking.top_k(self.centroids @ query, nprobe)
+
+        return np.concatenate(
+            [self.article_ids[self.offsets[c]:self.offsets[c + 1]] for c in lists]
+        )
+
+    def search(
+        self,
+        store: EmbeddingStore,
+        query: np.ndarray,
+        k: int,
+        exclude: Optional[Iterable[int]] = None,
+        nprobe: Optional[int] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Approximate top-k articles by cosine similarity to a normalized query.
+
+        Parameters:
+        store (EmbeddingStore): The store the index was built from.
+        query (np.ndarray): Normalized query vector.
+        k (int): Number of articles to return.
+        exclude (Optional[Iterable[int]]): Article ids that must not be returned.
+        nprobe (Optional[int]): Number of clusters to scan, defaults to the
+        one of the index.
+
+        Returns:
+        Tuple[np.ndarray, np.ndarray]: The article ids and their similarities,
+        sorted by decreasing similarity.
+        """
+        candidate_ids = np.sort(self.candidates(query, nprobe))
+        scores = np.asarray(store.vectors[candidate_ids], dtype=np.float32) @ query
+
+        excluded_positions = None
+        if exclude is not None:
+            excluded_positions = np.flatnonzero(
+                np.isin(candidate_ids, np.asarray(list(exclude)))
+            )
+        positions, similarities = ranking.top_k(scores, k, exclude=excluded_positions)
+
+        return candidate_ids[positions].astype(np.intp), similarities
+
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray, chunk_size: int) -> np.ndarray:
+    """Index of the most similar centroid for every vector, chunk by chunk."""
+    assignment = np.empty(vectors.shape[0], dtype=np.int64)
+    for start in range(0, vectors.shape[0], chunk_size):
+        chunk = np.asarray(vectors[start:start + chunk_size], dtype=np.float32)
+        assignment[start:start + chunk_size] = np.argmax(chunk @ centroids.T, axis=1)
+
+    return assignment
+
+
+def index_path(embeddings_path: str) -> str:
+    """Path of the IVF index persisted next to an embeddings file."""
+    return os.path.splitext(embeddings_path)[0] + ".ivf.npz"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build the IVF index of the articles embeddings"
+    )
+    parser.add_argument("embeddings_path")
+    parser.add_argument("--n-lists", type=int, default=None)
+    parser.add_argument("--n-iter", type=int, default=10)
+    args = parser.parse_args()
+
+    index = IVFIndex.build(
+        EmbeddingStore.load(args.embeddings_path),
+        n_lists=args.n_lists,
+        n_iter=args.n_iter,
+    )
+    index.save(index_path(args.embeddings_path))
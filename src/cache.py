@@ -0,0 +1,95 @@
+"""Module containing the in-process cache of recommendation responses"""
+
+# Import packages
+import threading
+import time
+from collections import OrderedDict
+from typing import Hashable, Optional, Tuple
+from src import metrics
+
+
+class ResponseCache:
+    """
+    Bounded LRU cache of recommendation responses with a time to live.
+
+    Responses are dictionaries of lists ranked best first (e.g. "article_ids"
+    and "predicted_ratings"), keyed on everything they depend on except the
+    number of articles asked. The first element of a key names the model or
+    endpoint, so that `invalidate` can drop every entry of a reloaded model.
+    A response cached for n articles also serves any request for fewer
+    articles, by truncating its lists.
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[Tuple, Tuple[float, int, dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key: Tuple[Hashable, ...], nb_articles: int) -> Optional[dict]:
+        """Cached response for `nb_articles` articles, None on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, cached_nb_articles, result = entry
+                if expires_at < time.monotonic():
+                    del self._entries[key]
+                    entry = None
+                elif cached_nb_articles < nb_articles:
+                    entry = None
+            if entry is None:
+                self.misses += 1
+                metrics.count("cache_lookups", help="Response cache lookups", model=key[0], result="miss")
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+        metrics.count("cache_lookups", help="Response cache lookups", model=key[0], result="hit")
+
+        return {
+            name: value[:nb_articles] if isinstance(value, list) else value
+            for name, value in result.items()
+        }
+
+    def put(self, key: Tuple[Hashable, ...], nb_articles: int, result: dict):
+        """Cache the response computed for `nb_articles` articles."""
+        with self._lock:
+            entry = self._entries.get(key)
+            # Keep a longer valid response, it serves this request size too
+            if entry is not None and entry[1] > nb_articles and entry[0] >= time.monotonic():
+                return
+
+            self._entries[key] = (time.monotonic() + self.ttl, nb_articles, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, name: Optional[Hashable] = None):
+        """Drop the entries whose key starts with `name`, or all of them."""
+        with self._lock:
+            if name is None:
+                keys = list(self._entries)
+            else:
+                keys = [key for key in self._entries if key[0] == name]
+            for key in keys:
+                del self._entries[key]
+            self.invalidations += len(keys)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
@@ -1,10 +1,18 @@
 # Import packages
-from typing import List
+from typing import Iterable, Iterator, List, Optional, Tuple, Union
 import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
 import _pickle as cPickle
-from sklearn.metrics.pairwise import cosine_similarity
+from src import metrics, ranking
+from src.ann import IVFIndex
+from src.embeddings import EmbeddingStore
+from src.interactions import InteractionIndex
 
 # Load environment variables from .env file
 from dotenv import load_dotenv
@@ -75,34 +83,266 @@ def merge_csv_files(file1_path: str, file2_path: str, output_file: str) -> pd.Da
     return merged_df
 
 
+# Compact dtypes of the hourly click files and of the articles metadata
+CLICK_DTYPES = {
+    "user_id": "uint32",
+    "session_id": "int64",
+    "session_start": "int64",
+    "session_size": "uint16",
+    "click_article_id": "uint32",
+    "click_timestamp": "int64",
+    "click_environment": "uint8",
+    "click_deviceGroup": "uint8",
+    "click_os": "uint8",
+    "click_country": "uint8",
+    "click_region": "uint8",
+    "click_referrer_type": "uint8",
+}
+ARTICLE_DTYPES = {
+    "article_id": "uint32",
+    "category_id": "uint16",
+    "created_at_ts": "int64",
+    "publisher_id": "uint16",
+    "words_count": "uint16",
+}
+
+
+def _read_clicks(filepath: str, articles: pd.DataFrame) -> pd.DataFrame:
+    """
+    Read one hourly click file with compact dtypes and join it against the
+    articles metadata, indexed by article_id.
+    """
+    clicks = pd.read_csv(filepath, dtype=CLICK_DTYPES)
+
+    # Join by position in the articles table; articles missing from the
+    # metadata get null (nullable integer) attributes
+    positions = articles.index.get_indexer(clicks["click_article_id"])
+    found = positions >= 0
+    positions[~found] = 0
+    clicks = clicks.rename(columns={"click_article_id": "article_id"})
+    for column in articles.columns:
+        values = articles[column].to_numpy()[positions]
+        clicks[column] = pd.arrays.IntegerArray(values, ~found)
+
+    return clicks
+
+
+def ingest_click_files(
+    filepaths: Iterable[str],
+    articles_file: str,
+    output_file: str,
+    n_jobs: int = 4,
+) -> int:
+    """
+    Stream hourly click CSV files into a single Parquet file, joined against
+    the articles metadata, with bounded peak memory.
+
+    Files are read by a pool of `n_jobs` threads with explicit compact dtypes
+    (uint32 ids, int64 timestamps, small unsigned integers for the enum codes
+    such as click_os or click_country). Each file is joined against the small
+    articles table as soon as it is read and appended to the Parquet output,
+    so that at most about 2 * `n_jobs` files are in memory at once, whatever
+    the number of files.
+
+    Args:
+    filepaths (Iterable[str]): The click CSV files to ingest, in order.
+    articles_file (str): The articles metadata CSV file.
+    output_file (str): The Parquet file to write.
+    n_jobs (int): Number of files read in parallel.
+
+    Returns:
+    int: The number of click rows written.
+    """
+    articles = pd.read_csv(articles_file, dtype=ARTICLE_DTYPES).set_index("article_id")
+
+    nb_rows = 0
+    writer = None
+    tmp_file = output_file + ".tmp"
+    filepaths = iter(list(filepaths))
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        # Keep a bounded window of files being read ahead of the writer
+        window = deque(
+            executor.submit(_read_clicks, filepath, articles)
+            for filepath in islice(filepaths, 2 * n_jobs)
+        )
+        try:
+            while window:
+                clicks = window.popleft().result()
+                for filepath in islice(filepaths, 1):
+                    window.append(executor.submit(_read_clicks, filepath, articles))
+
+                table = pa.Table.from_pandas(clicks, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(tmp_file, table.schema)
+                writer.write_table(table.cast(writer.schema))
+                nb_rows += len(clicks)
+        finally:
+            for future in window:
+                future.cancel()
+            if writer is not None:
+                writer.close()
+
+    if writer is not None:
+        os.replace(tmp_file, output_file)
+
+    return nb_rows
+
+
+def ingest_clicks(
+    directory: str, articles_file: str, output_file: str, n_jobs: int = 4
+) -> int:
+    """
+    Streaming replacement of `concat_csv_files` followed by `merge_csv_files`:
+    ingest every CSV file of a directory with `ingest_click_files`.
+
+    Args:
+    directory (str): The directory containing the hourly click CSV files.
+    articles_file (str): The articles metadata CSV file.
+    output_file (str): The Parquet file to write.
+    n_jobs (int): Number of files read in parallel.
+
+    Returns:
+    int: The number of click rows written.
+    """
+    filepaths = [
+        os.path.join(directory, filename)
+        for filename in sorted(os.listdir(directory))
+        if filename.endswith(".csv")
+    ]
+
+    return ingest_click_files(filepaths, articles_file, output_file, n_jobs)
+
+
+def iter_clicks(
+    file_path: str, columns: Optional[List[str]] = None, batch_size: int = 1_000_000
+) -> Iterator[pd.DataFrame]:
+    """
+    Read the Parquet output of `ingest_clicks` chunk by chunk.
+
+    Args:
+    file_path (str): The Parquet file.
+    columns (Optional[List[str]]): The columns to read, all by default.
+    batch_size (int): Maximum number of rows per chunk.
+
+    Yields:
+    pd.DataFrame: The successive chunks of clicks.
+    """
+    parquet_file = pq.ParquetFile(file_path)
+    for batch in parquet_file.iter_batches(batch_size=batch_size, columns=columns):
+        yield batch.to_pandas()
+
+
 def closest_articles(
-    model_dir_path: str, article_id: int, nb_closest_articles: int
+    embeddings: Union[str, EmbeddingStore],
+    article_id: int,
+    nb_closest_articles: int,
+    exclude_ids: Optional[Iterable[int]] = None,
+    index: Optional[IVFIndex] = None,
+    nprobe: Optional[int] = None,
+    rerank_candidates: Optional[int] = None,
 ) -> dict:
     """
     Find the closest articles to a given article based on cosine similarity.
 
     Parameters:
-    model_dir_path (str): The directory path where the articles embeddings are.
+    embeddings (Union[str, EmbeddingStore]): The resident store of articles
+    embeddings, or the path of a file to load it from (slow, the file is then
+    read on every call).
     article_id (int): The ID of the article for which the closest articles are to be found.
     nb_closest_articles (int): The number of closest articles to retrieve.
+    exclude_ids (Optional[Iterable[int]]): Articles that must not be returned,
+    e.g. the ones already clicked by the user. The query article is always
+    excluded.
+    index (Optional[IVFIndex]): Approximate nearest-neighbour index built from
+    the same embeddings. When given, only the articles of the closest clusters
+    are scored instead of the whole catalogue.
+    nprobe (Optional[int]): Number of clusters scanned with `index`.
+    rerank_candidates (Optional[int]): When the store has a quantized copy
+    (and no `index` is given), number of the best approximate candidates
+    re-ranked with the exact float32 embeddings, max(10 * nb, 100) by default.
 
     Returns:
     dict: A dictionary containing:
         - "indices": The indices of the closest articles.
         - "cosine_similarities": The cosine similarity values of the closest articles.
     """
-    # Deserialize pickle object
-    #model_dir_path = os.path.join(ROOT_DIR, "models", "articles_embeddings.pickle")
-    with open(model_dir_path, "rb") as f:
-        articles_embeddings = cPickle.load(f)
+    if isinstance(embeddings, str):
+        embeddings = EmbeddingStore.load(embeddings)
+
+    # Exclude the query article by id rather than assuming it ranks first
+    excluded = [article_id]
+    if exclude_ids is not None:
+        excluded.extend(exclude_ids)
+
+    return closest_articles_to_vector(
+        embeddings,
+        embeddings.vector(article_id),
+        nb_closest_articles,
+        excluded,
+        index,
+        nprobe,
+        rerank_candidates,
+    )
 
-    row = articles_embeddings[article_id].reshape(1, -1)
-    cosine_similarities = cosine_similarity(row, articles_embeddings).flatten()
 
-    sorted_indices = np.argsort(-cosine_similarities)[1:][:nb_closest_articles]
-    sorted_cosine_similarities = np.sort(cosine_similarities)[::-1][1:][
-        :nb_closest_articles
-    ]
+def closest_articles_to_vector(
+    embeddings: EmbeddingStore,
+    row: np.ndarray,
+    nb_closest_articles: int,
+    exclude_ids: Optional[Iterable[int]] = None,
+    index: Optional[IVFIndex] = None,
+    nprobe: Optional[int] = None,
+    rerank_candidates: Optional[int] = None,
+) -> dict:
+    """
+    Same as `closest_articles` for any normalized query vector, e.g. a user
+    profile (see src/profiles.py) instead of the embedding of an article.
+
+    Parameters:
+    embeddings (EmbeddingStore): The resident store of articles embeddings.
+    row (np.ndarray): The normalized query vector.
+    nb_closest_articles (int): The number of closest articles to retrieve.
+    exclude_ids (Optional[Iterable[int]]): Articles that must not be returned.
+    index (Optional[IVFIndex]): Approximate nearest-neighbour index.
+    nprobe (Optional[int]): Number of clusters scanned with `index`.
+    rerank_candidates (Optional[int]): Candidates of the quantized scan
+    re-ranked exactly, see `closest_articles`.
+
+    Returns:
+    dict: The "indices" and "cosine_similarities" of the closest articles.
+    """
+    excluded = [] if exclude_ids is None else list(exclude_ids)
+
+    # Rows are pre-normalized, so cosine similarity is a dot product
+    row = np.asarray(row, dtype=np.float32)
+    if index is not None:
+        with metrics.span("ivf_search"):
+            sorted_indices, sorted_cosine_similarities = index.search(
+                embeddings, row, nb_closest_articles, exclude=excluded, nprobe=nprobe
+            )
+    elif embeddings.quantized is not None:
+        with metrics.span("quantized_scan"):
+            approximate_similarities = embeddings.quantized.similarities(row)
+            candidates, _ = ranking.top_k(
+                approximate_similarities,
+                rerank_candidates or max(10 * nb_closest_articles, 100),
+                exclude=excluded,
+            )
+        # Exact re-rank, reading only the float32 rows of the candidates
+        with metrics.span("rerank"):
+            candidates = np.sort(candidates)
+            best, sorted_cosine_similarities = ranking.top_k(
+                np.asarray(embeddings.vectors[candidates], dtype=np.float32) @ row,
+                nb_closest_articles,
+            )
+            sorted_indices = candidates[best]
+    else:
+        with metrics.span("similarities"):
+            cosine_similarities = embeddings.similarities(row)
+        with metrics.span("top_k"):
+            sorted_indices, sorted_cosine_similarities = ranking.top_k(
+                cosine_similarities, nb_closest_articles, exclude=excluded
+            )
 
     results = {
         "indices": sorted_indices.tolist(),
@@ -112,6 +352,88 @@ def closest_articles(
     return results
 
 
+def iter_closest_articles_batch(
+    embeddings: EmbeddingStore,
+    article_ids: Iterable[int],
+    nb_closest_articles: int,
+    memory_budget_mb: float = 256,
+) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    Find the closest articles of many seed articles at once, chunk by chunk.
+
+    Similarities of a chunk of seeds against the whole catalogue are computed
+    as one matrix-matrix product; the chunk size is chosen so that the
+    similarity matrix and the intp array of the same shape allocated by the
+    `np.argpartition` of `ranking.top_k_rows` fit in `memory_budget_mb`
+    together. Useful for offline jobs that precompute related articles over
+    the whole catalogue.
+
+    Parameters:
+    embeddings (EmbeddingStore): The resident store of articles embeddings.
+    article_ids (Iterable[int]): The IDs of the seed articles.
+    nb_closest_articles (int): The number of closest articles per seed.
+    memory_budget_mb (float): Upper bound of the memory used per chunk.
+
+    Yields:
+    Tuple[np.ndarray, np.ndarray, np.ndarray]: For each chunk, the seed
+    article ids, the indices of their closest articles and the cosine
+    similarities, the last two of shape (chunk size, nb_closest_articles),
+    at most the number of other articles of the catalogue.
+    """
+    article_ids = np.asarray(list(article_ids), dtype=np.intp)
+    # float32 similarities plus the intp positions of the argpartition
+    bytes_per_seed = embeddings.n_articles * (
+        np.dtype(np.float32).itemsize + np.dtype(np.intp).itemsize
+    )
+    chunk_size = max(1, int(memory_budget_mb * 2**20 // bytes_per_seed))
+
+    for start in range(0, len(article_ids), chunk_size):
+        seeds = article_ids[start:start + chunk_size]
+        rows = np.asarray(embeddings.vectors[seeds], dtype=np.float32)
+        cosine_similarities = rows @ np.asarray(embeddings.vectors).T
+
+        # Never recommend a seed article for itself: at most n_articles - 1
+        # finite similarities per row, so never more neighbours than that
+        cosine_similarities[np.arange(len(seeds)), seeds] = -np.inf
+
+        indices, similarities = ranking.top_k_rows(
+            cosine_similarities, min(nb_closest_articles, embeddings.n_articles - 1)
+        )
+
+        yield seeds, indices, similarities
+
+
+def closest_articles_batch(
+    embeddings: EmbeddingStore,
+    article_ids: Iterable[int],
+    nb_closest_articles: int,
+    memory_budget_mb: float = 256,
+) -> dict:
+    """
+    Find the closest articles of many seed articles at once, see
+    `iter_closest_articles_batch`.
+
+    Returns:
+    dict: A dictionary containing:
+        - "article_ids": The seed article ids.
+        - "indices": For each seed, the indices of the closest articles.
+        - "cosine_similarities": For each seed, their cosine similarity values.
+    """
+    results = {
+        "article_ids": [],
+        "indices": [],
+        "cosine_similarities": [],
+    }
+    for seeds, indices, similarities in iter_closest_articles_batch(
+        embeddings, article_ids, nb_closest_articles, memory_budget_mb
+    ):
+        results["article_ids"].extend(seeds.tolist())
+        results["indices"].extend(indices.tolist())
+        results["cosine_similarities"].extend(similarities.tolist())
+
+    return results
+
+
 def filter_by_user_counts(df: pd.DataFrame, number_of_articles: int):
     """
     DataFrame to keep users who have clicked on a min number of articles.
@@ -123,26 +445,108 @@ def filter_by_user_counts(df: pd.DataFrame, number_of_articles: int):
     Returns:
         pd.DataFrame: A filtered DataFrame containing only users who have clicked on at least `min_click_articles` articles.
     """
-    user_counts = df["user_id"].value_counts()
-    filtered_users = user_counts[user_counts > number_of_articles].index
-    filtered_df = df[df["user_id"].isin(filtered_users)]
+    # Count clicks per integer-coded user instead of value_counts + isin
+    user_codes, _ = pd.factorize(df["user_id"])
+    user_counts = np.bincount(user_codes)
+    filtered_df = df[user_counts[user_codes] > number_of_articles]
 
     return filtered_df
 
 
-def articles_not_clicked_by_user(df: pd.DataFrame, user_id: int) -> dict:
+def k_core_filter(
+    df: pd.DataFrame, min_user_clicks: int, min_article_clicks: int, max_iter: int = 100
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Iteratively drop the users with fewer than `min_user_clicks` clicks and
+    the articles with fewer than `min_article_clicks` clicks, until every
+    remaining user and article satisfies both thresholds (k-core).
+
+    Ids are integer-coded once, and degrees are counted at each iteration with
+    `np.bincount` over the rows still kept, without rescanning the DataFrame.
+
+    Args:
+        df (pd.DataFrame): The input DataFrame with columns user_id and article_id.
+        min_user_clicks (int): Minimum number of clicks of a kept user.
+        min_article_clicks (int): Minimum number of clicks of a kept article.
+        max_iter (int): Maximum number of iterations.
+
+    Returns:
+        Tuple[pd.DataFrame, pd.DataFrame]: The filtered DataFrame, and a report
+        with the rows, users and articles dropped and remaining per iteration.
+    """
+    user_codes, user_uniques = pd.factorize(df["user_id"])
+    article_codes, article_uniques = pd.factorize(df["article_id"])
+    nb_users, nb_articles = len(user_uniques), len(article_uniques)
+
+    keep = np.ones(len(df), dtype=bool)
+    user_counts = np.bincount(user_codes, minlength=nb_users)
+    article_counts = np.bincount(article_codes, minlength=nb_articles)
+
+    report = []
+    for iteration in range(1, max_iter + 1):
+        new_keep = keep & (
+            (user_counts[user_codes] >= min_user_clicks)
+            & (article_counts[article_codes] >= min_article_clicks)
+        )
+        rows_dropped = int(keep.sum() - new_keep.sum())
+        if rows_dropped == 0:
+            break
+
+        new_user_counts = np.bincount(user_codes[new_keep], minlength=nb_users)
+        new_article_counts = np.bincount(article_codes[new_keep], minlength=nb_articles)
+        report.append(
+            {
+                "iteration": iteration,
+                "rows_dropped": rows_dropped,
+                "users_dropped": int((user_counts > 0).sum() - (new_user_counts > 0).sum()),
+                "articles_dropped": int(
+                    (article_counts > 0).sum() - (new_article_counts > 0).sum()
+                ),
+                "rows": int(new_keep.sum()),
+                "users": int((new_user_counts > 0).sum()),
+                "articles": int((new_article_counts > 0).sum()),
+            }
+        )
+        keep, user_counts, article_counts = new_keep, new_user_counts, new_article_counts
+
+    report = pd.DataFrame(
+        report,
+        columns=[
+            "iteration", "rows_dropped", "users_dropped", "articles_dropped",
+            "rows", "users", "articles",
+        ],
+    )
+
+    return df[keep], report
+
+
+def articles_not_clicked_by_user(
+    df: Union[pd.DataFrame, InteractionIndex], user_id: int
+) -> dict:
     """
     Extract all unique article_id values from the DataFrame that are not
     associated with the given user_id.
 
     Parameters:
-    df (pd.DataFrame): DataFrame containing columns user_id, article_id
+    df (Union[pd.DataFrame, InteractionIndex]): DataFrame containing columns
+    user_id, article_id, or the interaction index built from it (fast path).
     user_id (int): The user ID for which to exclude the articles.
 
     Returns:
     dict: A dictionary with the key as user_id and
-    value as a list of unique article_id elements.
+    value as the unique article_id elements (a sorted array when
+    `df` is an InteractionIndex, a list otherwise).
     """
+    if isinstance(df, InteractionIndex):
+        with metrics.span("articles_not_clicked"):
+            result = {
+                "user_id": user_id,
+                "article_id": df.articles_not_clicked(user_id),
+            }
+        metrics.observe("candidates", len(result["article_id"]), help="Candidate articles per user")
+
+        return result
+
     # Identify all article_id associated with the given user_id
     user_articles = df[df["user_id"] == user_id]["article_id"].to_list()
 
@@ -0,0 +1,272 @@
+"""Module containing the resident store of article embeddings"""
+
+# Import packages
+import argparse
+import os
+import numpy as np
+import _pickle as cPickle
+from typing import Optional
+
+# Compact representations of the embeddings available for the first-pass scan
+QUANTIZATIONS = ["float16", "int8"]
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """
+    L2-normalize each row of a matrix so that a dot product between two rows
+    is their cosine similarity. Rows with a null norm are left at zero, like
+    sklearn's cosine_similarity does.
+
+    Parameters:
+    matrix (np.ndarray): 2D array of embeddings.
+
+    Returns:
+    np.ndarray: float32 array of the same shape with unit-norm rows.
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+
+    return matrix / norms
+
+
+class QuantizedEmbeddings:
+    """
+    Compact copy of the normalized embeddings, used to scan the whole
+    catalogue cheaply before re-ranking a few candidates exactly.
+
+    - "float16": the vectors in half precision (half the memory of float32).
+    - "int8": every row divided by its own scale, max(|x|) / 127, and rounded
+      to int8 (a quarter of the memory, plus one float32 scale per row).
+
+    The scan converts `chunk_size` rows at a time to float32 into a buffer
+    that stays in the CPU cache, so that it never materializes a float32
+    copy of the whole matrix.
+    """
+
+    def __init__(
+        self, codes: np.ndarray, scales: Optional[np.ndarray] = None, chunk_size: int = 2048
+    ):
+        self.codes = codes
+        self.scales = scales
+        self.chunk_size = chunk_size
+
+    @classmethod
+    def from_vectors(cls, vectors: np.ndarray, quantization: str) -> "QuantizedEmbeddings":
+        """Quantize normalized float32 embeddings."""
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization {quantization}, expected one of {QUANTIZATIONS}")
+
+        if quantization == "float16":
+            return cls(np.asarray(vectors, dtype=np.float16))
+
+        chunk_size = 16384
+        codes = np.empty(vectors.shape, dtype=np.int8)
+        scales = np.empty(vectors.shape[0], dtype=np.float32)
+        for start in range(0, vectors.shape[0], chunk_size):
+            block = np.asarray(vectors[start:start + chunk_size], dtype=np.float32)
+            block_scales = np.abs(block).max(axis=1) / 127
+            block_scales[block_scales == 0] = 1.0
+            codes[start:start + chunk_size] = np.round(block / block_scales[:, None])
+            scales[start:start + chunk_size] = block_scales
+
+        return cls(codes, scales)
+
+    @property
+    def quantization(self) -> str:
+        return "float16" if self.scales is None else "int8"
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + (0 if self.scales is None else self.scales.nbytes)
+
+    def similarities(self, query: np.ndarray) -> np.ndarray:
+        """Approximate cosine similarities between a query and every article."""
+        query = np.asarray(query, dtype=np.float32)
+        result = np.empty(self.codes.shape[0], dtype=np.float32)
+        buffer = np.empty(
+            (min(self.chunk_size, self.codes.shape[0]), self.codes.shape[1]), dtype=np.float32
+        )
+        for start in range(0, self.codes.shape[0], self.chunk_size):
+            codes = self.codes[start:start + self.chunk_size]
+            block = buffer[:len(codes)]
+            block[...] = codes
+            np.matmul(block, query, out=result[start:start + len(codes)])
+        if self.scales is not None:
+            result *= self.scales
+
+        return result
+
+    def save(self, file_path: str) -> str:
+        """Write the codes (and the int8 scales next to them) as .npy files."""
+        arrays = [(file_path, self.codes)]
+        if self.scales is not None:
+            arrays.append((scales_path(file_path), self.scales))
+        for path, array in arrays:
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                np.save(f, np.ascontiguousarray(array))
+            os.replace(tmp_path, path)
+
+        return file_path
+
+    @classmethod
+    def load(cls, file_path: str, mmap: bool = True) -> "QuantizedEmbeddings":
+        mmap_mode = "r" if mmap else None
+        codes = np.load(file_path, mmap_mode=mmap_mode)
+        scales = None
+        if codes.dtype == np.int8:
+            scales = np.load(scales_path(file_path), mmap_mode=mmap_mode)
+
+        return cls(codes, scales)
+
+
+def quantized_path(npy_path: str, quantization: str) -> str:
+    """Path of a quantized copy of an embeddings .npy file."""
+    return os.path.splitext(npy_path)[0] + f".{quantization}.npy"
+
+
+def scales_path(quantized_file_path: str) -> str:
+    """Path of the per-row scales of an int8 quantized file."""
+    return os.path.splitext(quantized_file_path)[0] + ".scales.npy"
+
+
+class EmbeddingStore:
+    """
+    Article embeddings kept resident in memory, with rows pre-normalized so
+    that cosine similarities reduce to a single matrix-vector product.
+
+    The store is meant to be loaded once (e.g. at FastAPI startup) and then
+    queried by every request. When loaded from a `.npy` file produced by
+    `convert_pickle_to_npy`, the matrix is memory-mapped read-only so that
+    several uvicorn workers share the same pages of the page cache.
+
+    With a `quantized` copy, `closest_articles` scans the compact copy and
+    only reads the float32 rows of the best candidates, to re-rank them.
+    """
+
+    def __init__(self, vectors: np.ndarray, quantized: Optional[QuantizedEmbeddings] = None):
+        self.vectors = vectors
+        self.quantized = quantized
+
+    @classmethod
+    def from_pickle(cls, file_path: str) -> "EmbeddingStore":
+        """
+        Load the embeddings from the original `articles_embeddings.pickle`
+        and normalize them in memory.
+        """
+        with open(file_path, "rb") as f:
+            articles_embeddings = cPickle.load(f)
+
+        return cls(normalize_rows(articles_embeddings))
+
+    @classmethod
+    def from_npy(cls, file_path: str, mmap: bool = True) -> "EmbeddingStore":
+        """
+        Load pre-normalized float32 embeddings written by
+        `convert_pickle_to_npy`, memory-mapped unless `mmap` is False.
+        """
+        vectors = np.load(file_path, mmap_mode="r" if mmap else None)
+
+        return cls(vectors)
+
+    @classmethod
+    def load(
+        cls, file_path: str, mmap: bool = True, quantization: Optional[str] = None
+    ) -> "EmbeddingStore":
+        """
+        Load a store from either a `.npy` file or the original pickle,
+        depending on the file extension. With `quantization`, also load the
+        quantized copy written by `quantize_embeddings`, or compute it in
+        memory when there is none.
+        """
+        if file_path.endswith(".npy"):
+            store = cls.from_npy(file_path, mmap=mmap)
+        else:
+            store = cls.from_pickle(file_path)
+
+        if quantization is not None:
+            path = quantized_path(file_path, quantization)
+            if file_path.endswith(".npy") and os.path.exists(path):
+                store.quantized = QuantizedEmbeddings.load(path, mmap=mmap)
+            else:
+                store.quantized = QuantizedEmbeddings.from_vectors(store.vectors, quantization)
+
+        return store
+
+    @property
+    def n_articles(self) -> int:
+        return self.vectors.shape[0]
+
+    @property
+    def dim(self) -> int:
+        return self.vectors.shape[1]
+
+    def vector(self, article_id: int) -> np.ndarray:
+        """Return the normalized embedding of an article."""
+        return np.asarray(self.vectors[article_id], dtype=np.float32)
+
+    def similarities(self, query: np.ndarray) -> np.ndarray:
+        """
+        Cosine similarities between a normalized query vector and every
+        article of the store.
+        """
+        return self.vectors @ query
+
+
+def convert_pickle_to_npy(pickle_path: str, npy_path: str) -> str:
+    """
+    One-off conversion of `articles_embeddings.pickle` into a float32 `.npy`
+    file whose rows are already L2-normalized, ready to be memory-mapped by
+    `EmbeddingStore.from_npy`.
+
+    Parameters:
+    pickle_path (str): Path to the original articles embeddings pickle.
+    npy_path (str): Path of the `.npy` file to write.
+
+    Returns:
+    str: The path of the written file.
+    """
+    store = EmbeddingStore.from_pickle(pickle_path)
+
+    # Write to a temporary file first so that readers never see a partial file
+    tmp_path = npy_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, np.ascontiguousarray(store.vectors))
+    os.replace(tmp_path, npy_path)
+
+    return npy_path
+
+
+def quantize_embeddings(npy_path: str, quantization: str) -> str:
+    """
+    Write a quantized copy of a normalized `.npy` file written by
+    `convert_pickle_to_npy`, next to it.
+
+    Parameters:
+    npy_path (str): Path of the normalized float32 embeddings.
+    quantization (str): One of `QUANTIZATIONS`.
+
+    Returns:
+    str: The path of the quantized file.
+    """
+    vectors = np.load(npy_path, mmap_mode="r")
+
+    return QuantizedEmbeddings.from_vectors(vectors, quantization).save(
+        quantized_path(npy_path, quantization)
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Convert articles_embeddings.pickle to a normalized .npy file"
+    )
+    parser.add_argument("pickle_path")
+    parser.add_argument("npy_path")
+    parser.add_argument("--quantize", nargs="*", choices=QUANTIZATIONS, default=[],
+                        help="also write quantized copies of the .npy file")
+    args = parser.parse_args()
+
+    convert_pickle_to_npy(args.pickle_path, args.npy_path)
+    for quantization in args.quantize:
+        quantize_embeddings(args.npy_path, quantization)
@@ -0,0 +1,208 @@
+"""Module containing the compact index of user-article interactions"""
+
+# Import packages
+import argparse
+import os
+import shutil
+from typing import Optional
+import numpy as np
+import pandas as pd
+import _pickle as cPickle
+
+# Columns of the on-disk interaction store, one .npy file each
+STORE_COLUMNS = ["user_ids", "indptr", "article_ids", "ratings", "items", "timestamps"]
+
+
+class InteractionIndex:
+    """
+    CSR-style index of the (user_id, article_id, rating) interactions, with
+    the click_timestamp of each one when known.
+
+    Interactions are sorted by user then article: the articles of the user at
+    position `p` of `user_ids` are `article_ids[indptr[p]:indptr[p + 1]]`.
+    `items` is the sorted universe of all the articles clicked by anyone, so
+    that the candidate articles of a user are a set difference between two
+    small sorted integer arrays instead of scans of the whole DataFrame.
+
+    The index doubles as the columnar on-disk interaction store: `save` writes
+    one `.npy` file per array and `load` memory-maps them, so that startup
+    does not depend on the size of the click log and every worker shares the
+    same pages. Only the slices of the users actually requested are read.
+    """
+
+    def __init__(
+        self,
+        user_ids: np.ndarray,
+        indptr: np.ndarray,
+        article_ids: np.ndarray,
+        ratings: Optional[np.ndarray] = None,
+        items: Optional[np.ndarray] = None,
+        timestamps: Optional[np.ndarray] = None,
+    ):
+        self.user_ids = user_ids
+        self.indptr = indptr
+        self.article_ids = article_ids
+        self.ratings = ratings
+        self.items = np.unique(article_ids) if items is None else items
+        self.timestamps = timestamps
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> "InteractionIndex":
+        """
+        Build the index from a DataFrame with columns user_id, article_id and
+        optionally rating and click_timestamp, e.g. the content of
+        `dataset.pickle`.
+        """
+        users = df["user_id"].to_numpy()
+        articles = df["article_id"].to_numpy()
+        order = np.lexsort((articles, users))
+
+        user_ids, counts = np.unique(users[order], return_counts=True)
+        indptr = np.zeros(len(user_ids) + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+
+        ratings = None
+        if "rating" in df.columns:
+            ratings = df["rating"].to_numpy(dtype=np.float32)[order]
+        timestamps = None
+        if "click_timestamp" in df.columns:
+            timestamps = df["click_timestamp"].to_numpy(dtype=np.int64)[order]
+
+        return cls(
+            user_ids.astype(np.uint32),
+            indptr,
+            articles[order].astype(np.uint32),
+            ratings,
+            timestamps=timestamps,
+        )
+
+    def to_frame(self) -> pd.DataFrame:
+        """The interactions as a DataFrame with columns user_id, article_id (rating, click_timestamp)."""
+        columns = {
+            "user_id": np.repeat(self.user_ids, np.diff(self.indptr)),
+            "article_id": np.asarray(self.article_ids),
+        }
+        if self.ratings is not None:
+            columns["rating"] = np.asarray(self.ratings)
+        if self.timestamps is not None:
+            columns["click_timestamp"] = np.asarray(self.timestamps)
+
+        return pd.DataFrame(columns)
+
+    def merge(self, df: pd.DataFrame) -> "InteractionIndex":
+        """New index of these interactions plus the ones of `df`, e.g. new clicks."""
+        frame = self.to_frame()
+
+        return InteractionIndex.from_frame(
+            pd.concat([frame, df[frame.columns]], ignore_index=True)
+        )
+
+    def save(self, dir_path: str) -> str:
+        """Write the index as a directory of `.npy` files, replaced at once."""
+        tmp_path = dir_path + ".tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        for name in STORE_COLUMNS:
+            if getattr(self, name) is not None:
+                np.save(os.path.join(tmp_path, name + ".npy"), getattr(self, name))
+
+        old_path = dir_path + ".old"
+        if os.path.exists(dir_path):
+            os.replace(dir_path, old_path)
+        os.replace(tmp_path, dir_path)
+        shutil.rmtree(old_path, ignore_errors=True)
+
+        return dir_path
+
+    @classmethod
+    def load(cls, dir_path: str, mmap: bool = True) -> "InteractionIndex":
+        """Load a store written by `save`, memory-mapped unless `mmap` is False."""
+        columns = {}
+        for name in STORE_COLUMNS:
+            file_path = os.path.join(dir_path, name + ".npy")
+            if os.path.exists(file_path):
+                columns[name] = np.load(file_path, mmap_mode="r" if mmap else None)
+
+        return cls(**columns)
+
+    @property
+    def n_users(self) -> int:
+        return len(self.user_ids)
+
+    def user_position(self, user_id: int) -> Optional[int]:
+        """Position of a user in `user_ids`, None if the user is unknown."""
+        position = int(np.searchsorted(self.user_ids, user_id))
+        if position < len(self.user_ids) and self.user_ids[position] == user_id:
+            return position
+
+        return None
+
+    def user_articles(self, user_id: int) -> np.ndarray:
+        """Sorted articles clicked by a user (empty for unknown users)."""
+        position = self.user_position(user_id)
+        if position is None:
+            return self.article_ids[:0]
+
+        return self.article_ids[self.indptr[position]:self.indptr[position + 1]]
+
+    def user_ratings(self, user_id: int) -> np.ndarray:
+        """Ratings aligned with `user_articles`."""
+        position = self.user_position(user_id)
+        if position is None or self.ratings is None:
+            return np.empty(0, dtype=np.float32)
+
+        return self.ratings[self.indptr[position]:self.indptr[position + 1]]
+
+    def recent_articles(self, user_id: int, n: int) -> np.ndarray:
+        """
+        The `n` articles a user clicked last, latest first. Without
+        timestamps, the `n` best rated ones (or the first `n`) instead.
+        """
+        position = self.user_position(user_id)
+        if position is None:
+            return self.article_ids[:0]
+
+        start, end = self.indptr[position], self.indptr[position + 1]
+        if self.timestamps is not None:
+            order = np.argsort(-np.asarray(self.timestamps[start:end]), kind="stable")
+        elif self.ratings is not None:
+            order = np.argsort(-np.asarray(self.ratings[start:end]), kind="stable")
+        else:
+            order = np.arange(end - start)
+
+        return np.asarray(self.article_ids[start:end])[order[:n]]
+
+    def articles_not_clicked(self, user_id: int) -> np.ndarray:
+        """Sorted articles of the universe that a user never clicked."""
+        clicked = self.user_articles(user_id)
+        mask = np.ones(len(self.items), dtype=bool)
+        mask[np.searchsorted(self.items, clicked)] = False
+
+        return self.items[mask]
+
+
+def write_interaction_store(df: pd.DataFrame, dir_path: str) -> str:
+    """
+    Write the output of `features.rating_implicite` (columns user_id,
+    article_id, rating) as a columnar interaction store sorted by user.
+
+    Parameters:
+    df (pd.DataFrame): The user-article ratings.
+    dir_path (str): The directory of the store.
+
+    Returns:
+    str: The directory of the store.
+    """
+    return InteractionIndex.from_frame(df).save(dir_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Convert dataset.pickle to a columnar interaction store"
+    )
+    parser.add_argument("pickle_path")
+    parser.add_argument("dir_path")
+    args = parser.parse_args()
+
+    with open(args.pickle_path, "rb") as f:
+        write_interaction_store(cPickle.load(f), args.dir_path)
@@ -0,0 +1,252 @@
+"""Module containing the in-process metrics of the recommendation paths"""
+
+# Import packages
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Upper bounds of the buckets of the duration (seconds) and size histograms
+DURATION_BUCKETS = (
+    0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10
+)
+SIZE_BUCKETS = (1, 10, 100, 1000, 10000, 100000, 1000000)
+
+# Metrics are on unless METRICS_ENABLED is set to 0
+_enabled = os.getenv("METRICS_ENABLED", "1") != "0"
+
+# (span, seconds) of the request being served, set by `collect_timings`
+_timings: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("timings", default=None)
+
+_lock = threading.Lock()
+
+
+def _label_string(labels: Tuple[Tuple[str, str], ...], extra: str = "") -> str:
+    parts = [f'{key}="{value}"' for key, value in labels]
+    if extra:
+        parts.append(extra)
+
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    """Monotonic counter, one value per combination of labels."""
+
+    type = "counter"
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.values: Dict[Tuple[Tuple[str, str], ...], float] = {}
+
+    def inc(self, amount: float = 1, labels: Tuple[Tuple[str, str], ...] = ()):
+        with _lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        with _lock:
+            return [
+                f"{self.name}{_label_string(labels)} {value}"
+                for labels, value in sorted(self.values.items())
+            ]
+
+
+class Histogram:
+    """Cumulative histogram with fixed buckets, one per combination of labels."""
+
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: Tuple[float, ...]):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        # labels -> [count per bucket (the last one is +Inf), sum, count]
+        self.values: Dict[Tuple[Tuple[str, str], ...], list] = {}
+
+    def observe(self, value: float, labels: Tuple[Tuple[str, str], ...] = ()):
+        with _lock:
+            series = self.values.get(labels)
+            if series is None:
+                series = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = []
+        with _lock:
+            for labels, (counts, total, count) in sorted(self.values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                    cumulative += bucket_count
+                    le = f'le="{bound}"'
+                    lines.append(f"{self.name}_bucket{_label_string(labels, le)} {cumulative}")
+                lines.append(f"{self.name}_sum{_label_string(labels)} {total}")
+                lines.append(f"{self.name}_count{_label_string(labels)} {count}")
+
+        return lines
+
+
+_metrics: Dict[str, object] = {}
+
+
+def _metric(cls, name: str, help: str, *args):
+    metric = _metrics.get(name)
+    if metric is None:
+        with _lock:
+            metric = _metrics.setdefault(name, cls(name, help, *args))
+
+    return metric
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def enable(flag: bool = True):
+    """Turn the metrics on or off, e.g. in benchmarks."""
+    global _enabled
+    _enabled = flag
+
+
+def count(name: str, amount: float = 1, help: str = "", **labels):
+    """Increment the counter `recsys_<name>_total`."""
+    if not _enabled:
+        return
+    _metric(Counter, f"recsys_{name}_total", help).inc(amount, tuple(sorted(labels.items())))
+
+
+def observe(name: str, value: float, buckets: Tuple[float, ...] = SIZE_BUCKETS, help: str = "", **labels):
+    """Record a value, e.g. a number of candidates, in the histogram `recsys_<name>`."""
+    if not _enabled:
+        return
+    _metric(Histogram, f"recsys_{name}", help, buckets).observe(
+        value, tuple(sorted(labels.items()))
+    )
+
+
+class _Span:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        duration = time.perf_counter() - self.start
+        _metric(
+            Histogram, "recsys_span_seconds", "Duration of the named stages", DURATION_BUCKETS
+        ).observe(duration, (("span", self.name),))
+        timings = _timings.get()
+        if timings is not None:
+            timings.append((self.name, duration))
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name: str):
+    """
+    Context manager timing a named stage into the histogram
+    `recsys_span_seconds{span=name}`, and into the breakdown of the current
+    request when one is collected. A shared no-op when metrics are disabled.
+    """
+    if not _enabled:
+        return _NO_SPAN
+
+    return _Span(name)
+
+
+@contextmanager
+def collect_timings() -> Iterator[List[Tuple[str, float]]]:
+    """
+    Collect the (span, seconds) of the current request. The list is shared
+    with the threads of the scoring pools, which run in a copy of the
+    context; a batch of coalesced requests is attributed to the request
+    which triggered it.
+    """
+    timings = []
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+
+
+def server_timing(timings: List[Tuple[str, float]]) -> str:
+    """Value of a Server-Timing header, durations in milliseconds."""
+    return ", ".join(f"{name};dur={1000 * duration:.3f}" for name, duration in timings)
+
+
+class TimingMiddleware:
+    """
+    ASGI middleware timing every HTTP request into
+    `recsys_http_request_seconds{path, status}`. `path` is the template of the
+    route matched, set in the scope by the router, or "other" when no route
+    matched, so that probes of unknown paths add no time series. Requests
+    sent with the header X-Server-Timing: 1 get their breakdown by span in a
+    Server-Timing header.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        breakdown = (b"x-server-timing", b"1") in scope["headers"]
+        status = 500
+
+        with collect_timings() as timings:
+            async def send_with_timing(message):
+                nonlocal status
+                if message["type"] == "http.response.start":
+                    status = message["status"]
+                    if breakdown:
+                        timings.append(("total", time.perf_counter() - start))
+                        message["headers"] = list(message.get("headers", [])) + [
+                            (b"server-timing", server_timing(timings).encode())
+                        ]
+                await send(message)
+
+            await self.app(scope, receive, send_with_timing)
+
+        observe(
+            "http_request_seconds",
+            time.perf_counter() - start,
+            DURATION_BUCKETS,
+            help="Duration of the HTTP requests",
+            path=getattr(scope.get("route"), "path", "other"),
+            status=status,
+        )
+
+
+def render() -> str:
+    """All the metrics in the Prometheus text exposition format."""
+    lines = []
+    for name, metric in sorted(_metrics.items()):
+        if metric.help:
+            lines.append(f"# HELP {name} {metric.help}")
+        lines.append(f"# TYPE {name} {metric.type}")
+        lines.extend(metric.render())
+
+    return "\n".join(lines) + "\n"
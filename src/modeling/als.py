@@ -0,0 +1,279 @@
+"""Module containing the implicit-feedback ALS trainer"""
+
+# Import packages
+import argparse
+import json
+import os
+import time
+from typing import Tuple
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from src import dataset
+
+
+class ALSModel:
+    """
+    Factors of an implicit-feedback ALS model, as plain NumPy arrays.
+
+    Row `u` of `user_factors` belongs to the raw user `user_ids[u]` and row `i`
+    of `item_factors` to the raw article `item_ids[i]`, both sorted. The
+    number of users who clicked each article, `item_popularity`, ranks the
+    articles of users unknown to the model.
+    """
+
+    def __init__(
+        self,
+        user_ids: np.ndarray,
+        item_ids: np.ndarray,
+        user_factors: np.ndarray,
+        item_factors: np.ndarray,
+        item_popularity: np.ndarray,
+        params: dict,
+    ):
+        self.user_ids = user_ids
+        self.item_ids = item_ids
+        self.user_factors = user_factors
+        self.item_factors = item_factors
+        self.item_popularity = item_popularity
+        self.params = params
+
+    def save(self, file_path: str) -> str:
+        """Write the model as a .npz file, replaced at once."""
+        tmp_path = file_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                user_ids=self.user_ids,
+                item_ids=self.item_ids,
+                user_factors=self.user_factors,
+                item_factors=self.item_factors,
+                item_popularity=self.item_popularity,
+                params=np.array(json.dumps(self.params)),
+            )
+        os.replace(tmp_path, file_path)
+
+        return file_path
+
+    @classmethod
+    def load(cls, file_path: str) -> "ALSModel":
+        with np.load(file_path) as data:
+            return cls(
+                data["user_ids"],
+                data["item_ids"],
+                data["user_factors"],
+                data["item_factors"],
+                data["item_popularity"],
+                json.loads(str(data["params"])),
+            )
+
+
+def confidence_matrix(
+    df: pd.DataFrame, alpha: float = 2.0
+) -> Tuple[sp.csr_matrix, np.ndarray, np.ndarray]:
+    """
+    Build the sparse user x item matrix of the confidences minus one,
+    `alpha * rating`, from the output of `features.rating_implicite`. The
+    ratings of repeated (user, article) pairs are summed. Every stored entry,
+    even a null one, is a positive preference.
+
+    Parameters:
+    df (pd.DataFrame): DataFrame with columns user_id, article_id and rating.
+    alpha (float): Weight of the rating in the confidence 1 + alpha * rating.
+
+    Returns:
+    Tuple[sp.csr_matrix, np.ndarray, np.ndarray]: The matrix, and the sorted
+    raw user and article ids of its rows and columns.
+    """
+    user_ids, users = np.unique(df["user_id"].to_numpy(), return_inverse=True)
+    item_ids, items = np.unique(df["article_id"].to_numpy(), return_inverse=True)
+
+    # Sorting the keys sorts the entries by row then column, as CSR expects
+    keys, inverse = np.unique(
+        users.astype(np.int64) * len(item_ids) + items, return_inverse=True
+    )
+    data = alpha * np.bincount(inverse, weights=df["rating"].to_numpy(dtype=np.float64))
+    indptr = np.zeros(len(user_ids) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(keys // len(item_ids), minlength=len(user_ids)), out=indptr[1:])
+
+    matrix = sp.csr_matrix(
+        (data.astype(np.float32), keys % len(item_ids), indptr),
+        shape=(len(user_ids), len(item_ids)),
+    )
+
+    return matrix, user_ids, item_ids
+
+
+def _conjugate_gradient(
+    confidence: sp.csr_matrix,
+    X: np.ndarray,
+    Y: np.ndarray,
+    gram: np.ndarray,
+    cg_steps: int,
+) -> np.ndarray:
+    """
+    A few conjugate gradient steps on the normal equations of every row of
+    `X` at once, warm-started from `X`:
+
+        (Y^T Y + reg I + Y^T (C_u - I) Y) x_u = Y^T C_u p_u
+
+    The products by Y^T Y are dense matrix products (multi-threaded BLAS),
+    the corrections of the observed entries are sparse matrix products.
+    """
+    rows = np.repeat(np.arange(X.shape[0]), np.diff(confidence.indptr))
+    cols = confidence.indices
+    Y_observed = Y[cols]
+
+    def product(V: np.ndarray) -> np.ndarray:
+        weights = np.einsum("ij,ij->i", V[rows], Y_observed) * confidence.data
+        correction = sp.csr_matrix(
+            (weights, cols, confidence.indptr), shape=confidence.shape
+        ) @ Y
+
+        return V @ gram + correction
+
+    b = sp.csr_matrix(
+        (confidence.data + 1, cols, confidence.indptr), shape=confidence.shape
+    ) @ Y
+    residuals = b - product(X)
+    directions = residuals.copy()
+    norms = np.einsum("ij,ij->i", residuals, residuals)
+
+    for _ in range(cg_steps):
+        A_directions = product(directions)
+        curvatures = np.einsum("ij,ij->i", directions, A_directions)
+        steps = np.divide(norms, curvatures, out=np.zeros_like(norms), where=curvatures > 0)
+        X += steps[:, None] * directions
+        residuals -= steps[:, None] * A_directions
+        new_norms = np.einsum("ij,ij->i", residuals, residuals)
+        betas = np.divide(new_norms, norms, out=np.zeros_like(norms), where=norms > 0)
+        directions = residuals + betas[:, None] * directions
+        norms = new_norms
+
+    return X
+
+
+def _least_squares(
+    confidence: sp.csr_matrix,
+    X: np.ndarray,
+    Y: np.ndarray,
+    regularization: float,
+    cg_steps: int,
+    block_nnz: int,
+) -> np.ndarray:
+    """Update every row of `X` given `Y`, by blocks of about `block_nnz` entries."""
+    gram = Y.T @ Y + regularization * np.eye(Y.shape[1], dtype=Y.dtype)
+
+    start = 0
+    while start < X.shape[0]:
+        end = int(np.searchsorted(
+            confidence.indptr, confidence.indptr[start] + block_nnz, side="right"
+        ))
+        end = min(max(end - 1, start + 1), X.shape[0])
+        X[start:end] = _conjugate_gradient(
+            confidence[start:end], X[start:end], Y, gram, cg_steps
+        )
+        start = end
+
+    return X
+
+
+def fit_als(
+    df: pd.DataFrame,
+    factors: int = 64,
+    regularization: float = 10.0,
+    alpha: float = 2.0,
+    iterations: int = 15,
+    cg_steps: int = 3,
+    block_nnz: int = 1_000_000,
+    seed: int = 0,
+) -> ALSModel:
+    """
+    Fit an implicit-feedback ALS model (Hu, Koren and Volinsky, 2008) on the
+    implicit ratings, solving each half-step with conjugate gradient
+    (Takacs, Pilaszy and Tikk, 2011) vectorized across users or items.
+
+    Parameters:
+    df (pd.DataFrame): Output of `features.rating_implicite`.
+    factors (int): Number of latent factors.
+    regularization (float): L2 regularization of the factors.
+    alpha (float): Weight of the rating in the confidence 1 + alpha * rating.
+    iterations (int): Number of alternating iterations.
+    cg_steps (int): Conjugate gradient steps per half-iteration.
+    block_nnz (int): Number of observed entries solved at once, bounding the
+    memory used by the vectorized solves.
+    seed (int): Seed of the initial factors.
+
+    Returns:
+    ALSModel: The fitted model.
+    """
+    start = time.perf_counter()
+    confidence, user_ids, item_ids = confidence_matrix(df, alpha)
+    confidence_T = confidence.T.tocsr()
+
+    rng = np.random.default_rng(seed)
+    user_factors = rng.normal(0, 0.01, (len(user_ids), factors)).astype(np.float32)
+    item_factors = rng.normal(0, 0.01, (len(item_ids), factors)).astype(np.float32)
+
+    for _ in range(iterations):
+        user_factors = _least_squares(
+            confidence, user_factors, item_factors, regularization, cg_steps, block_nnz
+        )
+        item_factors = _least_squares(
+            confidence_T, item_factors, user_factors, regularization, cg_steps, block_nnz
+        )
+
+    return ALSModel(
+        user_ids=user_ids,
+        item_ids=item_ids,
+        user_factors=user_factors,
+        item_factors=item_factors,
+        item_popularity=np.diff(confidence_T.indptr).astype(np.int64),
+        params={
+            "factors": factors,
+            "regularization": regularization,
+            "alpha": alpha,
+            "iterations": iterations,
+            "cg_steps": cg_steps,
+            "seed": seed,
+            "fit_seconds": round(time.perf_counter() - start, 2),
+        },
+    )
+
+
+def model_based_als(df: pd.DataFrame, model_filename: str, **params) -> ALSModel:
+    """
+    Fit an implicit ALS model and save it where `predict` serves it from.
+
+    Parameters:
+    df (pd.DataFrame): DataFrame containing the user-item implicit ratings.
+    model_filename (str): The .npz file to save the model to.
+    **params: Parameters of `fit_als`.
+
+    Returns:
+    ALSModel: The fitted model.
+    """
+    model = fit_als(df, **params)
+    model.save(model_filename)
+
+    return model
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the implicit ALS model")
+    parser.add_argument("--factors", type=int, default=64)
+    parser.add_argument("--regularization", type=float, default=10.0)
+    parser.add_argument("--alpha", type=float, default=2.0)
+    parser.add_argument("--iterations", type=int, default=15)
+    args = parser.parse_args()
+
+    ROOT_DIR = os.getenv("ROOT_DIR")
+    model = model_based_als(
+        dataset.load_pickle_file(os.path.join(ROOT_DIR, "app", "backend", "dataset.pickle")),
+        os.path.join(ROOT_DIR, "models", "model_based_als.npz"),
+        factors=args.factors,
+        regularization=args.regularization,
+        alpha=args.alpha,
+        iterations=args.iterations,
+    )
+    print(model.params)
@@ -0,0 +1,306 @@
+"""Module containing the offline ranking evaluation of the recommenders"""
+
+# Import packages
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+from src import dataset, ranking
+from src.embeddings import EmbeddingStore
+from src.features import rating_implicite
+from src.interactions import InteractionIndex
+from src.modeling import predict
+
+# Models evaluated by default: the content-based recommender seeded with the
+# last article clicked by each user, and the collaborative filtering models
+EVALUATED_MODELS = ["closest_articles"] + predict.MODEL_NAMES
+
+
+def time_split(
+    clicks: pd.DataFrame, test_fraction: float = 0.2
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Split the clicks at the `1 - test_fraction` quantile of click_timestamp:
+    models learn from the past clicks and are evaluated on the future ones.
+    The test clicks are restricted to the users seen in training and to the
+    articles they had not clicked yet, one row per (user, article).
+
+    Parameters:
+    clicks (pd.DataFrame): Clicks with columns user_id, article_id and
+    click_timestamp (and session_size, for `rating_implicite`).
+    test_fraction (float): Fraction of the clicks, the latest, held out.
+
+    Returns:
+    Tuple[pd.DataFrame, pd.DataFrame]: The train clicks and the test pairs.
+    """
+    timestamps = clicks["click_timestamp"].to_numpy()
+    cutoff = np.quantile(timestamps, 1 - test_fraction)
+    train = clicks[timestamps < cutoff]
+    test = clicks.loc[timestamps >= cutoff, ["user_id", "article_id"]].drop_duplicates()
+
+    test = test[test["user_id"].isin(train["user_id"].unique())]
+    seen = pd.MultiIndex.from_frame(train[["user_id", "article_id"]])
+    test = test[~pd.MultiIndex.from_frame(test).isin(seen)]
+
+    return train, test
+
+
+def ranking_metrics(
+    recommended: np.ndarray, user_ids: np.ndarray, relevant: InteractionIndex, k: int
+) -> Dict[str, float]:
+    """
+    Sums over users of precision, recall, NDCG and average precision at k,
+    computed for all the users at once.
+
+    Parameters:
+    recommended (np.ndarray): Recommended article ids of shape
+    (n_users, >= k), best first, padded with -1.
+    user_ids (np.ndarray): The users of the rows of `recommended`, all
+    present in `relevant`.
+    relevant (InteractionIndex): The relevant (test) articles of each user.
+    k (int): Cutoff of the metrics.
+
+    Returns:
+    Dict[str, float]: The sums, and the number of users.
+    """
+    recommended = np.asarray(recommended, dtype=np.int64)[:, :k]
+    positions = np.searchsorted(relevant.user_ids, user_ids)
+    n_relevant = relevant.indptr[positions + 1] - relevant.indptr[positions]
+
+    # (user, article) pairs as sorted integer keys, looked up all at once
+    span = int(max(relevant.article_ids.max(initial=0), recommended.max(initial=0))) + 1
+    relevant_keys = (
+        np.repeat(np.arange(relevant.n_users, dtype=np.int64), np.diff(relevant.indptr)) * span
+        + relevant.article_ids
+    )
+    keys = positions[:, None].astype(np.int64) * span + recommended
+    found = np.searchsorted(relevant_keys, keys)
+    found[found == len(relevant_keys)] = 0
+    hits = (relevant_keys[found] == keys) & (recommended >= 0)
+
+    ranks = np.arange(1, k + 1)
+    discounts = 1 / np.log2(ranks + 1)
+    n_hits = hits.sum(axis=1)
+    ideal = np.cumsum(discounts)[np.minimum(n_relevant, k) - 1]
+    average_precision = (hits * np.cumsum(hits, axis=1) / ranks).sum(axis=1) / np.minimum(
+        n_relevant, k
+    )
+
+    return {
+        "users": len(user_ids),
+        "precision": float((n_hits / k).sum()),
+        "recall": float((n_hits / n_relevant).sum()),
+        "ndcg": float(((hits * discounts).sum(axis=1) / ideal).sum()),
+        "map": float(average_precision.sum()),
+    }
+
+
+# State of the worker processes, set once by `_init_worker`
+_worker = {}
+
+
+def _init_worker(
+    ROOT_DIR: str,
+    embeddings_path: str,
+    train: InteractionIndex,
+    test: InteractionIndex,
+    seeds: pd.Series,
+):
+    _worker["ROOT_DIR"] = ROOT_DIR
+    _worker["embeddings_path"] = embeddings_path
+    _worker["train"] = train
+    _worker["test"] = test
+    _worker["seeds"] = seeds
+
+
+def _closest_articles(user_ids: np.ndarray, k: int, chunk_size: int = 64) -> np.ndarray:
+    """
+    Content-based recommendations: the closest articles of the last article
+    clicked by each user, excluding everything the user already clicked.
+    """
+    # Loaded on first use, so that evaluating only CF models needs no embeddings
+    if "embeddings" not in _worker:
+        _worker["embeddings"] = EmbeddingStore.load(_worker["embeddings_path"])
+    store = _worker["embeddings"]
+    vectors = np.asarray(store.vectors)
+    seeds = _worker["seeds"].loc[user_ids].to_numpy()
+    recommended = np.empty((len(user_ids), k), dtype=np.int64)
+
+    for start in range(0, len(user_ids), chunk_size):
+        block = slice(start, start + chunk_size)
+        similarities = vectors[seeds[block]] @ vectors.T
+        for row, user_id in enumerate(user_ids[block]):
+            similarities[row, _worker["train"].user_articles(user_id)] = -np.inf
+        best, best_similarities = ranking.top_k_rows(similarities, k)
+        recommended[block] = np.where(np.isfinite(best_similarities), best, -1)
+
+    return recommended
+
+
+def _warm_up(_) -> None:
+    """No-op task, run once per worker before any timer starts."""
+
+
+def _evaluate_chunk(model_name: str, user_ids: np.ndarray, k: int) -> Tuple[dict, np.ndarray]:
+    """Metrics sums and recommended articles of a chunk of users, in a worker."""
+    if model_name == "closest_articles":
+        recommended = _closest_articles(user_ids, k)
+    else:
+        results = predict.recommend_batch(
+            _worker["ROOT_DIR"], model_name, user_ids.tolist(), _worker["train"], k
+        )
+        recommended = np.full((len(user_ids), k), -1, dtype=np.int64)
+        for row, result in enumerate(results):
+            recommended[row, :len(result["article_ids"])] = result["article_ids"]
+
+    scores = ranking_metrics(recommended, user_ids, _worker["test"], k)
+
+    return scores, np.unique(recommended[recommended >= 0])
+
+
+def evaluate(
+    ROOT_DIR: str,
+    train: pd.DataFrame,
+    test: pd.DataFrame,
+    model_names: Iterable[str] = EVALUATED_MODELS,
+    k: int = 10,
+    embeddings_path: Optional[str] = None,
+    max_users: Optional[int] = None,
+    n_jobs: Optional[int] = None,
+    chunk_size: int = 500,
+    seed: int = 0,
+) -> pd.DataFrame:
+    """
+    Evaluate recommenders on a time split: every test user gets k articles
+    from each model, computed by batches of users across a pool of processes,
+    compared with the articles they actually clicked later.
+
+    Parameters:
+    ROOT_DIR (str): Directory whose `models` were trained on `train` only.
+    train (pd.DataFrame): Train clicks, see `time_split`.
+    test (pd.DataFrame): Test (user_id, article_id) pairs, see `time_split`.
+    model_names (Iterable[str]): Models of `EVALUATED_MODELS` to evaluate.
+    k (int): Number of recommended articles.
+    embeddings_path (Optional[str]): Embeddings of "closest_articles",
+    `<ROOT_DIR>/models/articles_embeddings.npy` by default.
+    max_users (Optional[int]): Evaluate a random sample of test users.
+    n_jobs (Optional[int]): Number of worker processes, all CPUs by default.
+    chunk_size (int): Number of users per task.
+    seed (int): Seed of the sample of users.
+
+    Returns:
+    pd.DataFrame: One row per model with precision, recall, NDCG and MAP at
+    k averaged over users, the catalogue coverage (distinct recommended
+    articles over articles clicked in training) and the wall time per 1k
+    users.
+    """
+    if embeddings_path is None:
+        embeddings_path = os.path.join(ROOT_DIR, "models", "articles_embeddings.npy")
+    train_index = InteractionIndex.from_frame(train)
+    test_index = InteractionIndex.from_frame(test)
+    seeds = train.sort_values("click_timestamp", kind="stable").groupby("user_id")["article_id"].last()
+
+    user_ids = np.asarray(test_index.user_ids, dtype=np.int64)
+    if max_users is not None and max_users < len(user_ids):
+        rng = np.random.default_rng(seed)
+        user_ids = np.sort(rng.choice(user_ids, max_users, replace=False))
+    chunks = [user_ids[i:i + chunk_size] for i in range(0, len(user_ids), chunk_size)]
+
+    rows = []
+    n_workers = n_jobs or os.cpu_count()
+    with ProcessPoolExecutor(
+        max_workers=n_workers,
+        initializer=_init_worker,
+        initargs=(ROOT_DIR, embeddings_path, train_index, test_index, seeds),
+    ) as executor:
+        # Start every worker (and run its initializer) outside of the timings
+        list(executor.map(_warm_up, range(n_workers)))
+
+        for model_name in model_names:
+            start = time.perf_counter()
+            results = list(
+                executor.map(
+                    _evaluate_chunk, [model_name] * len(chunks), chunks, [k] * len(chunks)
+                )
+            )
+            elapsed = time.perf_counter() - start
+
+            totals = pd.DataFrame([scores for scores, _ in results]).sum()
+            recommended = np.unique(np.concatenate([articles for _, articles in results]))
+            rows.append(
+                {
+                    "model": model_name,
+                    "users": int(totals["users"]),
+                    f"precision@{k}": totals["precision"] / totals["users"],
+                    f"recall@{k}": totals["recall"] / totals["users"],
+                    f"ndcg@{k}": totals["ndcg"] / totals["users"],
+                    f"map@{k}": totals["map"] / totals["users"],
+                    "coverage": len(recommended) / len(train_index.items),
+                    "seconds_per_1k_users": 1000 * elapsed / len(user_ids),
+                }
+            )
+
+    return pd.DataFrame(rows).set_index("model")
+
+
+def fit_models(train: pd.DataFrame, model_dir: str, seed: int = 0, **search_options) -> List[str]:
+    """
+    Train every collaborative filtering model on the implicit ratings of the
+    train clicks only, into `model_dir`.
+    """
+    # Imported here, the trainers pull in the grid search machinery
+    from src.modeling import als
+    from src.modeling.train import train_all
+
+    os.makedirs(model_dir, exist_ok=True)
+    ratings = rating_implicite(train)
+    train_all(ratings, model_dir, seed, **search_options)
+    als.model_based_als(ratings, os.path.join(model_dir, "model_based_als.npz"), seed=seed)
+
+    return predict.MODEL_NAMES
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Evaluate the recommenders on a time split of the clicks"
+    )
+    parser.add_argument("clicks_file", help="Parquet output of dataset.ingest_clicks")
+    parser.add_argument("--models", nargs="*", default=EVALUATED_MODELS)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--test-fraction", type=float, default=0.2)
+    parser.add_argument("--max-users", type=int, default=None)
+    parser.add_argument("--n-jobs", type=int, default=None)
+    parser.add_argument("--fit", action="store_true",
+                        help="train the models on the train split into <ROOT_DIR>/evaluation")
+    parser.add_argument("--output", help="CSV file to write the table to")
+    args = parser.parse_args()
+
+    ROOT_DIR = os.getenv("ROOT_DIR")
+    clicks = pd.concat(
+        dataset.iter_clicks(
+            args.clicks_file, ["user_id", "article_id", "session_size", "click_timestamp"]
+        )
+    )
+    train, test = time_split(clicks, args.test_fraction)
+
+    evaluation_dir = ROOT_DIR
+    if args.fit:
+        evaluation_dir = os.path.join(ROOT_DIR, "evaluation")
+        fit_models(train, os.path.join(evaluation_dir, "models"), strategy="random", n_iter=4)
+
+    table = evaluate(
+        evaluation_dir,
+        train,
+        test,
+        args.models,
+        k=args.k,
+        embeddings_path=os.path.join(ROOT_DIR, "models", "articles_embeddings.npy"),
+        max_users=args.max_users,
+        n_jobs=args.n_jobs,
+    )
+    print(table.to_string(float_format="{:.4f}".format))
+    if args.output:
+        table.to_csv(args.output)
@@ -0,0 +1,190 @@
+"""Module containing the hybrid content + collaborative filtering ranker"""
+
+# Import packages
+from functools import lru_cache
+from typing import Optional
+import numpy as np
+from src import metrics, ranking
+from src.ann import IVFIndex
+from src.embeddings import EmbeddingStore
+from src.interactions import InteractionIndex
+from src.modeling.predict import SCORERS
+from src.modeling.registry import get_registry
+
+# Models that can re-rank the candidates
+HYBRID_MODELS = ["model_based_svd", "model_based_knn", "model_based_als"]
+
+
+class CandidateSources:
+    """
+    Article rankings shared by every request, computed once per interaction
+    index: the most popular articles overall (number of clicks) and the
+    trending ones, most clicked during the last `trending_hours` of the log
+    (empty when the index has no click timestamps).
+    """
+
+    def __init__(
+        self, interactions: InteractionIndex, size: int = 500, trending_hours: float = 24.0
+    ):
+        items = np.asarray(interactions.items, dtype=np.int64)
+        positions = np.searchsorted(items, interactions.article_ids)
+        counts = np.bincount(positions, minlength=len(items))
+        self.popular = items[ranking.top_k(counts, size)[0]]
+
+        self.trending = items[:0]
+        if interactions.timestamps is not None and len(interactions.timestamps):
+            timestamps = np.asarray(interactions.timestamps)
+            recent = timestamps >= timestamps.max() - trending_hours * 3600 * 1000
+            counts = np.bincount(positions[recent], minlength=len(items))
+            best, best_counts = ranking.top_k(counts, size)
+            self.trending = items[best[best_counts > 0]]
+
+
+@lru_cache(maxsize=2)
+def candidate_sources(interactions: InteractionIndex) -> CandidateSources:
+    """Sources of an interaction index, built once per index object."""
+    return CandidateSources(interactions)
+
+
+def _min_max(values: np.ndarray) -> np.ndarray:
+    """Rescale to [0, 1], constant values to 0."""
+    span = values.max() - values.min() if len(values) else 0
+    if span <= 0:
+        return np.zeros(len(values))
+
+    return (values - values.min()) / span
+
+
+def generate_candidates(
+    user_id: int,
+    interactions: InteractionIndex,
+    embeddings: EmbeddingStore,
+    n_candidates: int = 300,
+    n_seeds: int = 5,
+    index: Optional[IVFIndex] = None,
+) -> np.ndarray:
+    """
+    Candidate articles of a user, none of them already clicked: the closest
+    articles of each of the `n_seeds` articles clicked last, then the
+    trending and the popular articles, in this order, up to `n_candidates`.
+    The neighbours of all the seeds are scored in a single product against
+    the catalogue, or found through `index` when given.
+
+    Parameters:
+    user_id (int): The user to recommend articles to.
+    interactions (InteractionIndex): The user-article interactions.
+    embeddings (EmbeddingStore): The articles embeddings.
+    n_candidates (int): Maximum number of candidates.
+    n_seeds (int): Number of recent clicks whose neighbours are candidates.
+    index (Optional[IVFIndex]): Approximate nearest-neighbour index.
+
+    Returns:
+    np.ndarray: The candidate article ids.
+    """
+    clicked = np.asarray(interactions.user_articles(user_id), dtype=np.int64)
+    seeds = interactions.recent_articles(user_id, n_seeds)
+    seeds = seeds[seeds < embeddings.n_articles]
+    sources = candidate_sources(interactions)
+
+    # Half of the candidates from the content neighbours, split across seeds
+    lists = []
+    if len(seeds):
+        per_seed = max(n_candidates // (2 * len(seeds)), 1)
+        with metrics.span("content_candidates"):
+            if index is not None:
+                for seed in seeds.tolist():
+                    neighbours, _ = index.search(
+                        embeddings, embeddings.vector(seed), per_seed,
+                        exclude=np.append(clicked, seed),
+                    )
+                    lists.append(np.asarray(neighbours, dtype=np.int64))
+            else:
+                # One pass over the catalogue for all the seeds at once
+                similarities = np.asarray(embeddings.vectors[seeds], dtype=np.float32) @ (
+                    np.asarray(embeddings.vectors, dtype=np.float32).T
+                )
+                similarities[:, clicked[clicked < embeddings.n_articles]] = -np.inf
+                best, best_similarities = ranking.top_k_rows(similarities, per_seed)
+                lists.append(best[np.isfinite(best_similarities)].astype(np.int64))
+    lists.extend([sources.trending, sources.popular])
+
+    candidates = np.concatenate(lists)
+    candidates = candidates[~np.isin(candidates, clicked)]
+    _, first = np.unique(candidates, return_index=True)
+
+    return candidates[np.sort(first)][:n_candidates]
+
+
+def recommend(
+    ROOT_DIR: str,
+    model_name: str,
+    user_id: int,
+    interactions: InteractionIndex,
+    embeddings: EmbeddingStore,
+    nb_articles: int,
+    blend: float = 0.5,
+    n_candidates: int = 300,
+    n_seeds: int = 5,
+    index: Optional[IVFIndex] = None,
+) -> dict:
+    """
+    Two-stage hybrid recommendations: `generate_candidates` picks a few
+    hundred articles, which are then re-ranked by a blend of the rating
+    predicted by a collaborative filtering model and of the cosine similarity
+    to the user's recent clicks, each rescaled to [0, 1] over the candidates.
+    Only the candidate generation reads the whole catalogue, once for all
+    the seeds (or only the probed clusters with `index`): the scoring and
+    the blend depend on the number of candidates alone.
+
+    Parameters:
+    ROOT_DIR (str): Root directory of the repo, models are in ROOT_DIR/models.
+    model_name (str): The re-ranking model, one of `HYBRID_MODELS`.
+    user_id (int): The user to recommend articles to.
+    interactions (InteractionIndex): The user-article interactions.
+    embeddings (EmbeddingStore): The articles embeddings.
+    nb_articles (int): Number of articles to recommend.
+    blend (float): Weight of the collaborative filtering score, the content
+    similarity weighing 1 - blend.
+    n_candidates (int): Maximum number of candidates re-ranked.
+    n_seeds (int): Number of recent clicks used as content queries.
+    index (Optional[IVFIndex]): Approximate nearest-neighbour index.
+
+    Returns:
+    dict: A dictionary with the recommended "article_ids", their blended
+    "scores", "predicted_ratings" and "cosine_similarities".
+    """
+    with metrics.span("candidates"):
+        candidates = generate_candidates(
+            user_id, interactions, embeddings, n_candidates, n_seeds, index
+        )
+    metrics.observe(
+        "hybrid_candidates", len(candidates), help="Candidates re-ranked per hybrid request"
+    )
+
+    with metrics.span("model"):
+        scorer = get_registry(ROOT_DIR).scorer(model_name, SCORERS[model_name])
+    with metrics.span("score"):
+        predicted_ratings = scorer.score(user_id, candidates)
+
+    # Best similarity to any recent click, exact over the candidates only
+    cosine_similarities = np.zeros(len(candidates))
+    seeds = interactions.recent_articles(user_id, n_seeds)
+    seeds = seeds[seeds < embeddings.n_articles]
+    in_catalogue = candidates < embeddings.n_articles
+    if len(seeds) and in_catalogue.any():
+        with metrics.span("similarities"):
+            cosine_similarities[in_catalogue] = (
+                np.asarray(embeddings.vectors[candidates[in_catalogue]], dtype=np.float32)
+                @ np.asarray(embeddings.vectors[seeds], dtype=np.float32).T
+            ).max(axis=1)
+
+    scores = blend * _min_max(predicted_ratings) + (1 - blend) * _min_max(cosine_similarities)
+    with metrics.span("top_k"):
+        best, best_scores = ranking.top_k(scores, nb_articles)
+
+    return {
+        "article_ids": candidates[best].tolist(),
+        "scores": best_scores.tolist(),
+        "predicted_ratings": predicted_ratings[best].tolist(),
+        "cosine_similarities": cosine_similarities[best].tolist(),
+    }
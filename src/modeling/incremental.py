@@ -0,0 +1,507 @@
+"""Module containing the incremental update of the models from new click files"""
+
+# Import packages
+import argparse
+import json
+import os
+import pickle
+from typing import Iterable, List, Optional
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from src import dataset
+from src.features import ImplicitRatingState
+from src.embeddings import EmbeddingStore
+from src.interactions import InteractionIndex
+from src.modeling import als
+from src.modeling.registry import LOADERS, get_registry
+from src.profiles import UserProfiles
+
+# Models whose factors can be updated by folding in new users and articles
+FOLDED_MODELS = ["model_based_svd", "model_based_als"]
+
+# Columns of the ingested clicks needed by the implicit ratings
+RATING_COLUMNS = ["user_id", "article_id", "session_size", "click_timestamp"]
+
+
+def manifest_path(output_file: str) -> str:
+    """Manifest of the click files already ingested into `output_file`."""
+    return output_file + ".manifest.json"
+
+
+def parts_dir(output_file: str) -> str:
+    """Directory of the Parquet parts appended to `output_file`."""
+    return os.path.splitext(output_file)[0] + ".parts"
+
+
+def rating_state_path(output_file: str) -> str:
+    """Saved `ImplicitRatingState` of the clicks ingested into `output_file`."""
+    return os.path.splitext(output_file)[0] + ".rating_state.npz"
+
+
+def load_manifest(output_file: str) -> dict:
+    path = manifest_path(output_file)
+    if not os.path.exists(path):
+        return {"files": {}, "parts": []}
+
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_manifest(output_file: str, manifest: dict):
+    path = manifest_path(output_file)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(path + ".tmp", path)
+
+
+def click_files(output_file: str) -> List[str]:
+    """The Parquet files holding all the clicks ingested so far, in order."""
+    manifest = load_manifest(output_file)
+
+    return [output_file] + [
+        os.path.join(parts_dir(output_file), part) for part in manifest["parts"]
+    ]
+
+
+def ingest_new_clicks(
+    directory: str, articles_file: str, output_file: str, n_jobs: int = 4
+) -> Optional[str]:
+    """
+    Ingest the click CSV files of a directory that are not in the manifest
+    yet. The first time, every file is ingested into `output_file` with
+    `dataset.ingest_click_files`; afterwards, the new files are ingested
+    into a new Parquet part next to it, and the manifest records them.
+
+    Args:
+    directory (str): The directory containing the hourly click CSV files.
+    articles_file (str): The articles metadata CSV file.
+    output_file (str): The Parquet file of the first ingestion.
+    n_jobs (int): Number of files read in parallel.
+
+    Returns:
+    Optional[str]: The Parquet file written, None when there was no new file.
+    """
+    manifest = load_manifest(output_file)
+    if not os.path.exists(output_file):
+        manifest = {"files": {}, "parts": []}
+
+    new_files = [
+        filename
+        for filename in sorted(os.listdir(directory))
+        if filename.endswith(".csv") and filename not in manifest["files"]
+    ]
+    if not new_files:
+        return None
+
+    if os.path.exists(output_file):
+        part = f"part-{len(manifest['parts']):05d}.parquet"
+        os.makedirs(parts_dir(output_file), exist_ok=True)
+        target = os.path.join(parts_dir(output_file), part)
+    else:
+        part = None
+        target = output_file
+
+    nb_rows = dataset.ingest_click_files(
+        [os.path.join(directory, filename) for filename in new_files],
+        articles_file,
+        target,
+        n_jobs,
+    )
+
+    for filename in new_files:
+        manifest["files"][filename] = {
+            "size": os.path.getsize(os.path.join(directory, filename)),
+            "part": part,
+        }
+    if part is not None:
+        manifest["parts"].append(part)
+    manifest.setdefault("rows", 0)
+    manifest["rows"] += nb_rows
+    save_manifest(output_file, manifest)
+
+    return target
+
+
+def _ridge(design: np.ndarray, target: np.ndarray, reg: np.ndarray) -> np.ndarray:
+    """Solution of min |design @ x - target|^2 + sum(reg * x^2)."""
+    return np.linalg.solve(design.T @ design + np.diag(reg), design.T @ target)
+
+
+def _extend(mapping: dict, raw_ids: Iterable[int]) -> int:
+    """Give the next inner ids to the raw ids missing from a surprise mapping."""
+    added = 0
+    for raw_id in raw_ids:
+        if raw_id not in mapping:
+            mapping[raw_id] = len(mapping)
+            added += 1
+
+    return added
+
+
+def fold_in_svd(
+    model, interactions: InteractionIndex, new_ratings: pd.DataFrame, n_rounds: int = 2
+):
+    """
+    Update a trained surprise `SVD` model in place with new ratings, without
+    retraining: every user with new ratings gets its bias and factors
+    re-solved on all its ratings, with the item parameters fixed, and every
+    new article gets its bias and factors solved from the ratings of its
+    users. Each solve is a small ridge regression on the same objective as
+    the SGD of surprise (regularization counted once per rating).
+
+    Parameters:
+    model: The trained surprise SVD model.
+    interactions (InteractionIndex): All the ratings, new ones included.
+    new_ratings (pd.DataFrame): The new ratings (user_id, article_id, rating).
+    n_rounds (int): Number of alternations between users and new articles.
+
+    Returns:
+    dict: The numbers of new users, new articles and users re-solved.
+    """
+    trainset = model.trainset
+    user_ids = np.unique(new_ratings["user_id"].to_numpy()).tolist()
+    article_ids = np.unique(new_ratings["article_id"].to_numpy()).tolist()
+    new_articles = [a for a in article_ids if a not in trainset._raw2inner_id_items]
+
+    # Register the new users and articles, with null parameters
+    nb_new_users = _extend(trainset._raw2inner_id_users, user_ids)
+    _extend(trainset._raw2inner_id_items, new_articles)
+    n_factors = model.pu.shape[1]
+    model.pu = np.vstack([model.pu, np.zeros((nb_new_users, n_factors))])
+    model.bu = np.concatenate([model.bu, np.zeros(nb_new_users)])
+    model.qi = np.vstack([model.qi, np.zeros((len(new_articles), n_factors))])
+    model.bi = np.concatenate([model.bi, np.zeros(len(new_articles))])
+    trainset.n_users = len(trainset._raw2inner_id_users)
+    trainset.n_items = len(trainset._raw2inner_id_items)
+    trainset._inner2raw_id_users = None
+    trainset._inner2raw_id_items = None
+
+    mu = trainset.global_mean
+    biased = getattr(model, "biased", True)
+    users = [(trainset._raw2inner_id_users[u], u) for u in user_ids]
+    items_of_users = {
+        inner: (
+            np.array([trainset._raw2inner_id_items.get(int(a), -1) for a in interactions.user_articles(raw)]),
+            np.asarray(interactions.user_ratings(raw), dtype=np.float64),
+        )
+        for inner, raw in users
+    }
+    new_by_article = new_ratings[new_ratings["article_id"].isin(new_articles)].groupby("article_id")
+
+    for _ in range(n_rounds):
+        for inner, _raw in users:
+            items, ratings = items_of_users[inner]
+            known = items >= 0
+            items, ratings = items[known], ratings[known]
+            if biased:
+                design = np.column_stack([np.ones(len(items)), model.qi[items]])
+                reg = len(items) * np.r_[model.reg_bu, np.full(n_factors, model.reg_pu)]
+                solution = _ridge(design, ratings - mu - model.bi[items], reg)
+                model.bu[inner], model.pu[inner] = solution[0], solution[1:]
+            else:
+                reg = np.full(n_factors, len(items) * model.reg_pu)
+                model.pu[inner] = _ridge(model.qi[items], ratings, reg)
+
+        for raw, group in new_by_article:
+            inner = trainset._raw2inner_id_items[raw]
+            raters = np.array([trainset._raw2inner_id_users[u] for u in group["user_id"]])
+            ratings = group["rating"].to_numpy(dtype=np.float64)
+            if biased:
+                design = np.column_stack([np.ones(len(raters)), model.pu[raters]])
+                reg = len(raters) * np.r_[model.reg_bi, np.full(n_factors, model.reg_qi)]
+                solution = _ridge(design, ratings - mu - model.bu[raters], reg)
+                model.bi[inner], model.qi[inner] = solution[0], solution[1:]
+            else:
+                reg = np.full(n_factors, len(raters) * model.reg_qi)
+                model.qi[inner] = _ridge(model.pu[raters], ratings, reg)
+
+    # surprise only predicts for the users and items of `ur` and `ir`
+    for inner, _raw in users:
+        items, ratings = items_of_users[inner]
+        trainset.ur[inner] = [(i, r) for i, r in zip(items.tolist(), ratings.tolist()) if i >= 0]
+    for raw, group in new_by_article:
+        trainset.ir[trainset._raw2inner_id_items[raw]] = [
+            (trainset._raw2inner_id_users[u], r)
+            for u, r in zip(group["user_id"], group["rating"])
+        ]
+    trainset.n_ratings += len(new_ratings)
+
+    return {
+        "new_users": nb_new_users,
+        "new_articles": len(new_articles),
+        "users_solved": len(users),
+    }
+
+
+def _insert_ids(ids: np.ndarray, factors: np.ndarray, new_ids: np.ndarray):
+    """Insert missing ids (and null factors) keeping the ids sorted."""
+    missing = np.setdiff1d(new_ids, ids)
+    positions = np.searchsorted(ids, missing)
+
+    return (
+        np.insert(ids, positions, missing),
+        np.insert(factors, positions, 0, axis=0),
+        missing,
+    )
+
+
+def _confidence_rows(
+    df: pd.DataFrame, row_column: str, column_column: str, column_ids: np.ndarray, alpha: float
+):
+    """Confidence matrix of `df` whose columns are positions in `column_ids`."""
+    frame = pd.DataFrame(
+        {"user_id": df[row_column], "article_id": df[column_column], "rating": df["rating"]}
+    )
+    matrix, row_ids, local_ids = als.confidence_matrix(frame, alpha)
+    columns = np.searchsorted(column_ids, local_ids)[matrix.indices]
+    matrix = sp.csr_matrix(
+        (matrix.data, columns, matrix.indptr), shape=(matrix.shape[0], len(column_ids))
+    )
+
+    return matrix, row_ids
+
+
+def fold_in_als(
+    model: als.ALSModel,
+    interactions: InteractionIndex,
+    new_ratings: pd.DataFrame,
+    n_rounds: int = 2,
+    cg_steps: int = 10,
+) -> dict:
+    """
+    Update an `als.ALSModel` in place with new ratings: the factors of every
+    user with new ratings are re-solved on all its ratings with the article
+    factors fixed, and the factors of the new articles are solved from the
+    users who clicked them, with the same conjugate gradient as training.
+
+    Parameters:
+    model (als.ALSModel): The trained model.
+    interactions (InteractionIndex): All the ratings, new ones included.
+    new_ratings (pd.DataFrame): The new ratings (user_id, article_id, rating).
+    n_rounds (int): Number of alternations between users and new articles.
+    cg_steps (int): Conjugate gradient steps per solve.
+
+    Returns:
+    dict: The numbers of new users, new articles and users re-solved.
+    """
+    regularization = model.params["regularization"]
+    alpha = model.params["alpha"]
+    user_ids = np.unique(new_ratings["user_id"].to_numpy()).astype(model.user_ids.dtype)
+    article_ids = np.unique(new_ratings["article_id"].to_numpy()).astype(model.item_ids.dtype)
+
+    model.user_ids, model.user_factors, new_users = _insert_ids(
+        model.user_ids, model.user_factors, user_ids
+    )
+    old_item_ids = model.item_ids
+    model.item_ids, model.item_factors, new_articles = _insert_ids(
+        model.item_ids, model.item_factors, article_ids
+    )
+    model.item_popularity = np.insert(
+        model.item_popularity, np.searchsorted(old_item_ids, new_articles), 0
+    )
+
+    # All the ratings of the users with new clicks, and the ratings of the new articles
+    user_ratings = pd.concat(
+        [
+            pd.DataFrame(
+                {
+                    "user_id": user_id,
+                    "article_id": interactions.user_articles(user_id),
+                    "rating": interactions.user_ratings(user_id),
+                }
+            )
+            for user_id in user_ids.tolist()
+        ],
+        ignore_index=True,
+    )
+    user_confidence, _ = _confidence_rows(
+        user_ratings, "user_id", "article_id", model.item_ids, alpha
+    )
+    user_rows = np.searchsorted(model.user_ids, user_ids)
+    article_ratings = new_ratings[new_ratings["article_id"].isin(new_articles)]
+    article_confidence, article_ids_solved = _confidence_rows(
+        article_ratings, "article_id", "user_id", model.user_ids, alpha
+    )
+    article_rows = np.searchsorted(model.item_ids, article_ids_solved)
+
+    for _ in range(n_rounds):
+        model.user_factors[user_rows] = als._least_squares(
+            user_confidence,
+            model.user_factors[user_rows],
+            model.item_factors,
+            regularization,
+            cg_steps,
+            block_nnz=1_000_000,
+        )
+        if len(article_rows):
+            model.item_factors[article_rows] = als._least_squares(
+                article_confidence,
+                model.item_factors[article_rows],
+                model.user_factors,
+                regularization,
+                cg_steps,
+                block_nnz=1_000_000,
+            )
+
+    # Number of distinct users per article, counting only the new pairs
+    pairs = new_ratings[["user_id", "article_id"]].drop_duplicates()
+    previous_counts = pairs.merge(
+        user_ratings.groupby(["user_id", "article_id"]).size().rename("all").reset_index()
+    ).merge(
+        new_ratings.groupby(["user_id", "article_id"]).size().rename("new").reset_index()
+    )
+    first_clicks = previous_counts[previous_counts["all"] == previous_counts["new"]]
+    np.add.at(
+        model.item_popularity,
+        np.searchsorted(model.item_ids, first_clicks["article_id"].to_numpy()),
+        1,
+    )
+
+    return {
+        "new_users": len(new_users),
+        "new_articles": len(new_articles),
+        "users_solved": len(user_rows),
+    }
+
+
+def load_embeddings(ROOT_DIR: str) -> EmbeddingStore:
+    """The article embeddings the user profiles are built from."""
+    return EmbeddingStore.load(os.path.join(ROOT_DIR, "models", "articles_embeddings.npy"))
+
+
+def save_model(model, file_path: str) -> str:
+    """Write a model at once, so that the registry swaps it in on its next check."""
+    if isinstance(model, als.ALSModel):
+        return model.save(file_path)
+
+    tmp_path = file_path + ".tmp"
+    with open(tmp_path, "wb") as model_file:
+        pickle.dump(model, model_file)
+    os.replace(tmp_path, file_path)
+
+    return file_path
+
+
+def update(
+    ROOT_DIR: str,
+    clicks_dir: str,
+    articles_file: str,
+    output_file: str,
+    model_names: Iterable[str] = FOLDED_MODELS,
+    scoring: str = "clicks_x_session",
+    n_jobs: int = 4,
+) -> dict:
+    """
+    Bring the serving data and models up to date with the new click files.
+
+    1. Ingest the click files missing from the manifest (`ingest_new_clicks`).
+    2. Update the implicit rating accumulators with the new clicks and rate
+       them. The ratings already stored are kept as they are.
+    3. Merge the new ratings into the interaction store of the backend, and
+       add the new clicks to the user profiles when they were built.
+    4. Fold the new users and articles into the factor models and write them
+       at once: the registry of the running backend reloads them on its next
+       check, without a restart.
+
+    The first run only ingests the files and builds the accumulators, the
+    interaction store and, if they exist, the user profiles: the models must
+    then be trained from scratch.
+
+    Parameters:
+    ROOT_DIR (str): Root directory of the repo.
+    clicks_dir (str): The directory of the hourly click CSV files.
+    articles_file (str): The articles metadata CSV file.
+    output_file (str): The Parquet file of the ingested clicks.
+    model_names (Iterable[str]): The models to update, see `FOLDED_MODELS`.
+    scoring (str): Implicit rating formula, see `features.SCORINGS`.
+    n_jobs (int): Number of files read in parallel.
+
+    Returns:
+    dict: A summary of the update.
+    """
+    new_file = ingest_new_clicks(clicks_dir, articles_file, output_file, n_jobs)
+    if new_file is None:
+        return {"new_clicks": 0}
+
+    store_path = os.path.join(ROOT_DIR, "app", "backend", "interactions")
+    profiles_path = os.path.join(ROOT_DIR, "app", "backend", "profiles")
+    state_file = rating_state_path(output_file)
+    if new_file == output_file:
+        # First ingestion: rate every click, there is no model to update yet
+        state = ImplicitRatingState(scoring)
+        for chunk in dataset.iter_clicks(output_file, RATING_COLUMNS):
+            state.update(chunk)
+        state.save(state_file)
+        ratings = pd.concat(
+            state.ratings(chunk, ["click_timestamp"])
+            for chunk in dataset.iter_clicks(output_file, RATING_COLUMNS)
+        )
+        interactions = InteractionIndex.from_frame(ratings)
+        interactions.save(store_path)
+        # Profiles built from a previous store would not match the new one
+        if os.path.exists(profiles_path):
+            UserProfiles.build(interactions, load_embeddings(ROOT_DIR)).save(profiles_path)
+        return {"new_clicks": len(ratings), "first_ingestion": True}
+
+    if os.path.exists(state_file):
+        state = ImplicitRatingState.load(state_file)
+    else:
+        state = ImplicitRatingState(scoring)
+        for file_path in click_files(output_file):
+            if file_path != new_file:
+                for chunk in dataset.iter_clicks(file_path, RATING_COLUMNS):
+                    state.update(chunk)
+    new_clicks = pd.concat(dataset.iter_clicks(new_file, RATING_COLUMNS))
+    state.update(new_clicks)
+    new_ratings = state.ratings(new_clicks, ["click_timestamp"])
+    state.save(state_file)
+
+    if os.path.exists(store_path):
+        interactions = InteractionIndex.load(store_path, mmap=False).merge(new_ratings)
+    else:
+        interactions = InteractionIndex.from_frame(new_ratings)
+    interactions.save(store_path)
+
+    if os.path.exists(profiles_path):
+        UserProfiles.load(profiles_path, mmap=False).update(
+            new_ratings, load_embeddings(ROOT_DIR)
+        ).save(profiles_path)
+
+    summary = {"new_clicks": len(new_clicks), "new_file": new_file}
+    registry = get_registry(ROOT_DIR)
+    for model_name in model_names:
+        file_path = registry.file_path(model_name)
+        if not os.path.exists(file_path):
+            continue
+        model = LOADERS[os.path.splitext(file_path)[1]](file_path)
+        if isinstance(model, als.ALSModel):
+            summary[model_name] = fold_in_als(model, interactions, new_ratings)
+        else:
+            summary[model_name] = fold_in_svd(model, interactions, new_ratings)
+        save_model(model, file_path)
+
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Update the interactions and models with the new click files"
+    )
+    parser.add_argument("clicks_dir")
+    parser.add_argument("articles_file")
+    parser.add_argument("output_file", help="Parquet file of the ingested clicks")
+    parser.add_argument("--models", nargs="*", default=FOLDED_MODELS)
+    parser.add_argument("--n-jobs", type=int, default=4)
+    args = parser.parse_args()
+
+    print(
+        update(
+            os.getenv("ROOT_DIR"),
+            args.clicks_dir,
+            args.articles_file,
+            args.output_file,
+            args.models,
+            n_jobs=args.n_jobs,
+        )
+    )
@@ -0,0 +1,233 @@
+"""Module containing the offline precomputation of top-N recommendation tables"""
+
+# Import packages
+import argparse
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Optional, Tuple
+import numpy as np
+from src import dataset
+from src.interactions import InteractionIndex
+from src.modeling import predict
+from src.modeling.registry import get_registry
+
+
+class TopNTable:
+    """
+    Precomputed top-N recommendations of every known user for one model.
+
+    Stored column by column as `.npy` files in a directory so that it can be
+    memory-mapped: `user_ids` (sorted), `article_ids` and `scores` of shape
+    (n_users, N) padded after `lengths[u]` entries, plus a `metadata.json`
+    recording the model version the table was computed with.
+    """
+
+    def __init__(
+        self,
+        user_ids: np.ndarray,
+        article_ids: np.ndarray,
+        scores: np.ndarray,
+        lengths: np.ndarray,
+        metadata: dict,
+    ):
+        self.user_ids = user_ids
+        self.article_ids = article_ids
+        self.scores = scores
+        self.lengths = lengths
+        self.metadata = metadata
+
+    @property
+    def width(self) -> int:
+        return self.article_ids.shape[1]
+
+    @property
+    def model_version(self) -> Optional[str]:
+        return self.metadata.get("model_version")
+
+    @classmethod
+    def load(cls, dir_path: str, mmap: bool = True) -> "TopNTable":
+        mmap_mode = "r" if mmap else None
+        columns = {
+            name: np.load(os.path.join(dir_path, name + ".npy"), mmap_mode=mmap_mode)
+            for name in ["user_ids", "article_ids", "scores", "lengths"]
+        }
+        with open(os.path.join(dir_path, "metadata.json")) as f:
+            metadata = json.load(f)
+
+        return cls(metadata=metadata, **columns)
+
+    def save(self, dir_path: str) -> str:
+        """Write the table, replacing any previous table at once."""
+        tmp_path = dir_path + ".tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        for name in ["user_ids", "article_ids", "scores", "lengths"]:
+            np.save(os.path.join(tmp_path, name + ".npy"), getattr(self, name))
+        with open(os.path.join(tmp_path, "metadata.json"), "w") as f:
+            json.dump(self.metadata, f)
+
+        old_path = dir_path + ".old"
+        if os.path.exists(dir_path):
+            os.replace(dir_path, old_path)
+        os.replace(tmp_path, dir_path)
+        shutil.rmtree(old_path, ignore_errors=True)
+
+        return dir_path
+
+    def lookup(self, user_id: int, nb_articles: int) -> Optional[dict]:
+        """
+        Recommendations of a user, in the same format as `predict.recommend`,
+        or None when the user is unknown or more articles than the table
+        width are asked.
+        """
+        position = int(np.searchsorted(self.user_ids, user_id))
+        if position >= len(self.user_ids) or self.user_ids[position] != user_id:
+            return None
+        if nb_articles > self.width:
+            return None
+
+        length = min(int(self.lengths[position]), nb_articles)
+        result = {
+            "article_ids": self.article_ids[position, :length].tolist(),
+            "predicted_ratings": self.scores[position, :length].tolist(),
+        }
+
+        return result
+
+
+def table_path(ROOT_DIR: str, model_name: str) -> str:
+    """Directory of the top-N table of a model."""
+    return os.path.join(ROOT_DIR, "models", model_name + ".top_n")
+
+
+# State of the worker processes, set once by `_init_worker`
+_worker = {}
+
+
+def _init_worker(ROOT_DIR: str, model_name: str, interactions: InteractionIndex):
+    _worker["ROOT_DIR"] = ROOT_DIR
+    _worker["model_name"] = model_name
+    _worker["interactions"] = interactions
+
+
+def _top_n_chunk(user_ids: np.ndarray, n: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Top-N of a chunk of users, in a worker process."""
+    article_ids = np.zeros((len(user_ids), n), dtype=np.uint32)
+    scores = np.zeros((len(user_ids), n), dtype=np.float32)
+    lengths = np.zeros(len(user_ids), dtype=np.int32)
+    for row, user_id in enumerate(user_ids):
+        result = predict.recommend(
+            _worker["ROOT_DIR"],
+            _worker["model_name"],
+            int(user_id),
+            _worker["interactions"],
+            n,
+        )
+        length = len(result["article_ids"])
+        article_ids[row, :length] = result["article_ids"]
+        scores[row, :length] = result["predicted_ratings"]
+        lengths[row] = length
+
+    return article_ids, scores, lengths
+
+
+def precompute_top_n(
+    ROOT_DIR: str,
+    model_name: str,
+    interactions: InteractionIndex,
+    n: int = 50,
+    n_jobs: Optional[int] = None,
+    chunk_size: int = 1000,
+) -> TopNTable:
+    """
+    Compute the top-N recommendations of every user of the interactions with
+    one model, across a pool of processes, and save them as a `TopNTable`.
+
+    Parameters:
+    ROOT_DIR (str): Root directory of the repo, models are in ROOT_DIR/models.
+    model_name (str): Name of the model, one of `predict.MODEL_NAMES`.
+    interactions (InteractionIndex): The user-article interactions.
+    n (int): Number of recommendations kept per user.
+    n_jobs (Optional[int]): Number of worker processes, all CPUs by default.
+    chunk_size (int): Number of users scored per task.
+
+    Returns:
+    TopNTable: The saved table.
+    """
+    start = time.time()
+    model_version = get_registry(ROOT_DIR).entry(model_name).version
+    user_ids = interactions.user_ids
+    chunks = [
+        user_ids[i:i + chunk_size] for i in range(0, len(user_ids), chunk_size)
+    ]
+
+    with ProcessPoolExecutor(
+        max_workers=n_jobs,
+        initializer=_init_worker,
+        initargs=(ROOT_DIR, model_name, interactions),
+    ) as executor:
+        results = list(executor.map(_top_n_chunk, chunks, [n] * len(chunks)))
+
+    article_ids = np.zeros((0, n), dtype=np.uint32)
+    scores = np.zeros((0, n), dtype=np.float32)
+    lengths = np.zeros(0, dtype=np.int32)
+    if results:
+        article_ids = np.concatenate([r[0] for r in results])
+        scores = np.concatenate([r[1] for r in results])
+        lengths = np.concatenate([r[2] for r in results])
+
+    table = TopNTable(
+        user_ids=np.asarray(user_ids, dtype=np.uint32),
+        article_ids=article_ids,
+        scores=scores,
+        lengths=lengths,
+        metadata={
+            "model_name": model_name,
+            "model_version": model_version,
+            "n": n,
+            "n_users": int(len(user_ids)),
+            "computed_at": time.time(),
+            "duration_seconds": round(time.time() - start, 2),
+        },
+    )
+    table.save(table_path(ROOT_DIR, model_name))
+
+    return table
+
+
+def precompute_all(
+    ROOT_DIR: str,
+    model_names: Iterable[str] = predict.MODEL_NAMES,
+    n: int = 50,
+    n_jobs: Optional[int] = None,
+):
+    """Precompute the top-N tables of every model from `dataset.pickle`."""
+    df = dataset.load_pickle_file(
+        os.path.join(ROOT_DIR, "app", "backend", "dataset.pickle")
+    )
+    interactions = InteractionIndex.from_frame(df)
+
+    for model_name in model_names:
+        if not os.path.exists(get_registry(ROOT_DIR).file_path(model_name)):
+            print(f"{model_name}: no model file, skipped")
+            continue
+        table = precompute_top_n(ROOT_DIR, model_name, interactions, n, n_jobs)
+        print(
+            f"{model_name}: {table.metadata['n_users']} users in "
+            f"{table.metadata['duration_seconds']} s"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Precompute the top-N recommendations of every user"
+    )
+    parser.add_argument("models", nargs="*", default=predict.MODEL_NAMES)
+    parser.add_argument("--n", type=int, default=50)
+    parser.add_argument("--n-jobs", type=int, default=None)
+    args = parser.parse_args()
+
+    precompute_all(os.getenv("ROOT_DIR"), args.models, args.n, args.n_jobs)
@@ -1,124 +1,165 @@
 """Module containing function to make prediction"""
 
-import os
-import pickle
+from typing import List, Union
+import numpy as np
 import pandas as pd
-from src import dataset
-
-
-def cf_baseline_only(
-    ROOT_DIR: str, user_id: int, df: pd.DataFrame, nb_articles_to_print: int
-):
-    # Deserialization pickle object
-    with open(
-        os.path.join(ROOT_DIR, "models/model_baseline_only.pickle"), "rb"
-    ) as file:
-        best_model_baseline_only = pickle.load(file)
-
-    # List all articles not click by a specific user
+from src import dataset, metrics, ranking
+from src.interactions import InteractionIndex
+from src.modeling.registry import get_registry
+from src.modeling.scoring import ModelScorer, als_scorer, factor_scorer, knn_scorer
+
+# Names of the models served, stored as <ROOT_DIR>/models/<name>.pickle
+# (<name>.npz for the ALS model, see src/modeling/als.py)
+MODEL_NAMES = ["model_baseline_only", "model_based_knn", "model_based_svd", "model_based_als"]
+
+# Vectorized scorer of each model
+SCORERS = {
+    "model_baseline_only": factor_scorer,
+    "model_based_knn": knn_scorer,
+    "model_based_svd": factor_scorer,
+    "model_based_als": als_scorer,
+}
+
+
+def recommend(
+    ROOT_DIR: str,
+    model_name: str,
+    user_id: int,
+    df: Union[pd.DataFrame, InteractionIndex],
+    nb_articles_to_print: int,
+) -> dict:
+    """
+    Recommend the articles not clicked by a user with the highest predicted
+    ratings according to one of the models of `MODEL_NAMES`.
+
+    Parameters:
+    ROOT_DIR (str): Root directory of the repo, models are in ROOT_DIR/models.
+    model_name (str): Name of the model to use.
+    user_id (int): The user to recommend articles to.
+    df (Union[pd.DataFrame, InteractionIndex]): The user-article interactions.
+    nb_articles_to_print (int): Number of articles to recommend.
+
+    Returns:
+    dict: A dictionary with the recommended "article_ids" and their
+    "predicted_ratings".
+    """
+    with metrics.span("model"):
+        scorer = get_registry(ROOT_DIR).scorer(model_name, SCORERS[model_name])
     articles_not_clicked_by_user = dataset.articles_not_clicked_by_user(df, user_id)
 
-    # Make predictions
-    predictions = []
-    for article_id in articles_not_clicked_by_user["article_id"]:
-        prediction = best_model_baseline_only.predict(
-            uid=articles_not_clicked_by_user["user_id"], iid=article_id
-        )
-        predictions.append(
+    return _top_k_predictions(scorer, articles_not_clicked_by_user, nb_articles_to_print)
+
+
+def recommend_batch(
+    ROOT_DIR: str,
+    model_name: str,
+    user_ids: List[int],
+    df: Union[pd.DataFrame, InteractionIndex],
+    nb_articles_to_print: int,
+) -> List[dict]:
+    """
+    Recommend articles to several users at once. For factorization models
+    (SVD, BaselineOnly, ALS), all the users are scored against the whole article
+    universe with one matrix product; other models score user by user.
+
+    Parameters:
+    ROOT_DIR (str): Root directory of the repo, models are in ROOT_DIR/models.
+    model_name (str): Name of the model to use.
+    user_ids (List[int]): The users to recommend articles to.
+    df (Union[pd.DataFrame, InteractionIndex]): The user-article interactions.
+    nb_articles_to_print (int): Number of articles to recommend per user.
+
+    Returns:
+    List[dict]: The result of `recommend` for each user, in order.
+    """
+    scorer = get_registry(ROOT_DIR).scorer(model_name, SCORERS[model_name])
+    if not hasattr(scorer, "score_users"):
+        return [
+            recommend(ROOT_DIR, model_name, user_id, df, nb_articles_to_print)
+            for user_id in user_ids
+        ]
+
+    if not isinstance(df, InteractionIndex):
+        df = InteractionIndex.from_frame(df)
+    universe = np.asarray(df.items, dtype=np.int64)
+    metrics.observe("batch_size", len(user_ids), help="Users scored per batch")
+    with metrics.span("score_batch"):
+        predicted_ratings = scorer.score_users(user_ids, universe)
+
+    # Never recommend an article already clicked
+    for row, user_id in enumerate(user_ids):
+        clicked = np.searchsorted(universe, df.user_articles(user_id))
+        predicted_ratings[row, clicked] = -np.inf
+
+    with metrics.span("top_k_batch"):
+        best, best_ratings = ranking.top_k_rows(predicted_ratings, nb_articles_to_print)
+
+    results = []
+    for row in range(len(user_ids)):
+        candidates = np.isfinite(best_ratings[row])
+        results.append(
             {
-                "user_id": prediction.uid,
-                "article_id": prediction.iid,
-                "predicted_rating": prediction.est,
-                "details": prediction.details,
+                "article_ids": universe[best[row, candidates]].tolist(),
+                "predicted_ratings": best_ratings[row, candidates].tolist(),
             }
         )
 
-    # Sort the predictions in descending order by 'predicted_rating'
-    predictions.sort(key=lambda x: x["predicted_rating"], reverse=True)
-    predictions = predictions[:nb_articles_to_print]
-
-    article_ids = [entry["article_id"] for entry in predictions]
-    predicted_ratings = [entry["predicted_rating"] for entry in predictions]
+    return results
 
-    result = {
-        "article_ids": article_ids,
-        "predicted_ratings": predicted_ratings,
-    }
 
-    return result
-
-
-def cf_knn(ROOT_DIR: str, user_id: int, df: pd.DataFrame, nb_articles_to_print: int):
-    # Deserialization pickle object
-    with open(os.path.join(ROOT_DIR, "models/model_based_knn.pickle"), "rb") as file:
-        best_model_knn = pickle.load(file)
-
-    # List all articles not click by a specific user
-    articles_not_clicked_by_user = dataset.articles_not_clicked_by_user(df, user_id)
-
-    # Make predictions
-    predictions = []
-    for article_id in articles_not_clicked_by_user["article_id"]:
-        prediction = best_model_knn.predict(
-            uid=articles_not_clicked_by_user["user_id"], iid=article_id
-        )
-        predictions.append(
-            {
-                "user_id": prediction.uid,
-                "article_id": prediction.iid,
-                "predicted_rating": prediction.est,
-                "details": prediction.details,
-            }
-        )
-
-    # Sort the predictions in descending order by 'predicted_rating'
-    predictions.sort(key=lambda x: x["predicted_rating"], reverse=True)
-    predictions = predictions[:nb_articles_to_print]
+def cf_baseline_only(
+    ROOT_DIR: str,
+    user_id: int,
+    df: Union[pd.DataFrame, InteractionIndex],
+    nb_articles_to_print: int,
+):
+    return recommend(ROOT_DIR, "model_baseline_only", user_id, df, nb_articles_to_print)
 
-    article_ids = [entry["article_id"] for entry in predictions]
-    predicted_ratings = [entry["predicted_rating"] for entry in predictions]
 
-    result = {
-        "article_ids": article_ids,
-        "predicted_ratings": predicted_ratings,
-    }
+def cf_knn(
+    ROOT_DIR: str,
+    user_id: int,
+    df: Union[pd.DataFrame, InteractionIndex],
+    nb_articles_to_print: int,
+):
+    return recommend(ROOT_DIR, "model_based_knn", user_id, df, nb_articles_to_print)
 
-    return result
 
+def cf_svd(
+    ROOT_DIR: str,
+    user_id: int,
+    df: Union[pd.DataFrame, InteractionIndex],
+    nb_articles_to_print: int,
+):
+    return recommend(ROOT_DIR, "model_based_svd", user_id, df, nb_articles_to_print)
 
-def cf_svd(ROOT_DIR: str, user_id: int, df: pd.DataFrame, nb_articles_to_print: int):
-    # Deserialization pickle object
-    with open(os.path.join(ROOT_DIR, "models/model_based_svd.pickle"), "rb") as file:
-        best_model_knn = pickle.load(file)
 
-    # List all articles not click by a specific user
-    articles_not_clicked_by_user = dataset.articles_not_clicked_by_user(df, user_id)
+def cf_als(
+    ROOT_DIR: str,
+    user_id: int,
+    df: Union[pd.DataFrame, InteractionIndex],
+    nb_articles_to_print: int,
+):
+    return recommend(ROOT_DIR, "model_based_als", user_id, df, nb_articles_to_print)
 
-    # Make predictions
-    predictions = []
-    for article_id in articles_not_clicked_by_user["article_id"]:
-        prediction = best_model_knn.predict(
-            uid=articles_not_clicked_by_user["user_id"], iid=article_id
-        )
-        predictions.append(
-            {
-                "user_id": prediction.uid,
-                "article_id": prediction.iid,
-                "predicted_rating": prediction.est,
-                "details": prediction.details,
-            }
-        )
 
-    # Sort the predictions in descending order by 'predicted_rating'
-    predictions.sort(key=lambda x: x["predicted_rating"], reverse=True)
-    predictions = predictions[:nb_articles_to_print]
+def _top_k_predictions(
+    scorer: ModelScorer, articles_not_clicked_by_user: dict, nb_articles_to_print: int
+) -> dict:
+    """
+    Score the candidate articles of a user in one NumPy operation and keep the
+    best ones, ranked like a stable sort of the per-article predictions.
+    """
+    article_ids = np.asarray(articles_not_clicked_by_user["article_id"], dtype=np.int64)
+    with metrics.span("score"):
+        predicted_ratings = scorer.score(articles_not_clicked_by_user["user_id"], article_ids)
 
-    article_ids = [entry["article_id"] for entry in predictions]
-    predicted_ratings = [entry["predicted_rating"] for entry in predictions]
+    with metrics.span("top_k"):
+        best, best_ratings = ranking.top_k(predicted_ratings, nb_articles_to_print)
 
     result = {
-        "article_ids": article_ids,
-        "predicted_ratings": predicted_ratings,
+        "article_ids": article_ids[best].tolist(),
+        "predicted_ratings": best_ratings.tolist(),
     }
 
     return result
@@ -0,0 +1,184 @@
+"""Module containing the registry keeping trained models resident in memory"""
+
+# Import packages
+import os
+import pickle
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, Optional
+from src import metrics
+
+
+def load_pickle_model(file_path: str) -> Any:
+    with open(file_path, "rb") as file:
+        return pickle.load(file)
+
+
+def load_npz_model(file_path: str) -> Any:
+    # Imported here, so that the registry does not depend on the ALS trainer
+    from src.modeling.als import ALSModel
+
+    return ALSModel.load(file_path)
+
+
+# Loader of each model file format, by extension, in lookup order
+LOADERS = {".pickle": load_pickle_model, ".npz": load_npz_model}
+
+
+class ModelEntry:
+    """
+    A loaded model with the file version it was loaded from, and its
+    vectorized scorer once built, released together when the model is
+    replaced.
+    """
+
+    def __init__(self, name: str, file_path: str, model: Any, mtime_ns: int,
+                 load_seconds: float):
+        self.name = name
+        self.file_path = file_path
+        self.model = model
+        self.mtime_ns = mtime_ns
+        self.load_seconds = load_seconds
+        self.loaded_at = time.time()
+        self.scorer = None
+
+    @property
+    def version(self) -> str:
+        """Version of the model, derived from the modification time of its file."""
+        return str(self.mtime_ns)
+
+    def describe(self) -> dict:
+        return {
+            "name": self.name,
+            "file_path": self.file_path,
+            "version": self.version,
+            "modified_at": datetime.fromtimestamp(
+                self.mtime_ns / 1e9, timezone.utc
+            ).isoformat(),
+            "loaded_at": datetime.fromtimestamp(
+                self.loaded_at, timezone.utc
+            ).isoformat(),
+            "load_seconds": round(self.load_seconds, 4),
+        }
+
+
+class ModelRegistry:
+    """
+    Keep trained models resident across requests.
+
+    Models are looked up by name as `<model_dir>/<name>.pickle` (or `.npz`,
+    see `LOADERS`), loaded on first use (or up front with `preload`) and
+    served from memory afterwards. At most every `check_interval` seconds the
+    modification time of the file is checked; when it changed, the model is
+    reloaded and swapped in at once, so that requests in flight keep using
+    the previous model until they end.
+    """
+
+    def __init__(
+        self,
+        model_dir: str,
+        check_interval: float = 1.0,
+        loaders: Optional[Dict[str, Callable[[str], Any]]] = None,
+    ):
+        self.model_dir = model_dir
+        self.check_interval = check_interval
+        self.loaders = LOADERS if loaders is None else loaders
+        self._entries: Dict[str, ModelEntry] = {}
+        self._last_checks: Dict[str, float] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._reload_callbacks = []
+
+    def file_path(self, name: str) -> str:
+        """File of a model, the first one found among the extensions of `loaders`."""
+        paths = [os.path.join(self.model_dir, name + extension) for extension in self.loaders]
+        for path in paths:
+            if os.path.exists(path):
+                return path
+
+        return paths[0]
+
+    def on_reload(self, callback: Callable[[ModelEntry], None]):
+        """Register a function called with the new entry after every (re)load."""
+        self._reload_callbacks.append(callback)
+
+    def entry(self, name: str) -> ModelEntry:
+        """Return the up-to-date entry of a model, loading it if needed."""
+        entry = self._entries.get(name)
+        now = time.monotonic()
+        if entry is not None and now - self._last_checks.get(name, 0) < self.check_interval:
+            return entry
+
+        # One lock per model so that reloading one does not block the others
+        with self._locks.setdefault(name, threading.Lock()):
+            self._last_checks[name] = now
+            entry = self._entries.get(name)
+            file_path = self.file_path(name)
+            try:
+                mtime_ns = os.stat(file_path).st_mtime_ns
+            except FileNotFoundError:
+                # Keep serving the loaded model while its file is being replaced
+                if entry is not None:
+                    return entry
+                raise
+            if entry is None or entry.mtime_ns != mtime_ns:
+                start = time.perf_counter()
+                model = self.loaders[os.path.splitext(file_path)[1]](file_path)
+                entry = ModelEntry(
+                    name, file_path, model, mtime_ns, time.perf_counter() - start
+                )
+                # Swap the reference in one assignment
+                self._entries[name] = entry
+                metrics.observe(
+                    "model_load_seconds",
+                    entry.load_seconds,
+                    metrics.DURATION_BUCKETS,
+                    help="Duration of the model (re)loads",
+                    model=name,
+                )
+                for callback in self._reload_callbacks:
+                    callback(entry)
+
+        return entry
+
+    def get(self, name: str) -> Any:
+        """Return the up-to-date model registered under `name`."""
+        return self.entry(name).model
+
+    def scorer(self, name: str, factory: Callable[[Any], Any]) -> Any:
+        """
+        Scorer of the up-to-date model `name`, built with `factory` on first
+        use and kept on its entry, so that a reload drops the old one.
+        """
+        entry = self.entry(name)
+        if entry.scorer is None:
+            entry.scorer = factory(entry.model)
+
+        return entry.scorer
+
+    def version(self, name: str) -> Optional[str]:
+        """Version of the model currently serving, None if it is not loaded."""
+        entry = self._entries.get(name)
+        return entry.version if entry is not None else None
+
+    def preload(self, names: Iterable[str]):
+        """Load the models whose files exist, e.g. at application startup."""
+        for name in names:
+            if os.path.exists(self.file_path(name)):
+                self.entry(name)
+
+    def describe(self) -> dict:
+        """Describe every loaded model and the version serving."""
+        return {name: entry.describe() for name, entry in self._entries.items()}
+
+
+_registries: Dict[str, ModelRegistry] = {}
+
+
+def get_registry(ROOT_DIR: str) -> ModelRegistry:
+    """Return the registry of the models stored in `<ROOT_DIR>/models`."""
+    model_dir = os.path.join(ROOT_DIR, "models")
+    if model_dir not in _registries:
+        _registries[model_dir] = ModelRegistry(model_dir)
+
+    return _registries[model_dir]
@@ -0,0 +1,313 @@
+"""Module containing vectorized scorers of trained surprise models"""
+
+# Import packages
+from abc import ABC, abstractmethod
+from typing import Optional
+import numpy as np
+
+
+class ModelScorer(ABC):
+    """
+    Base class of the vectorized scorers: maps raw user and article ids to the
+    inner ids of the trainset a surprise model was fitted on.
+    """
+
+    def __init__(self, model):
+        trainset = model.trainset
+        self.trainset = trainset
+        self.global_mean = trainset.global_mean
+        self.lower_bound, self.upper_bound = trainset.rating_scale
+
+        # Raw ids to inner ids; items as sorted arrays for vectorized lookups
+        self.user_inner_ids = {
+            int(raw): inner for raw, inner in trainset._raw2inner_id_users.items()
+        }
+        raw_item_ids = np.array(
+            [int(raw) for raw in trainset._raw2inner_id_items], dtype=np.int64
+        )
+        inner_item_ids = np.array(
+            list(trainset._raw2inner_id_items.values()), dtype=np.int64
+        )
+        order = np.argsort(raw_item_ids)
+        self.raw_item_ids = raw_item_ids[order]
+        self.inner_item_ids = inner_item_ids[order]
+
+    def inner_item_ids_of(self, article_ids: np.ndarray) -> np.ndarray:
+        """Inner ids of raw article ids, -1 for articles unknown to the model."""
+        article_ids = np.asarray(article_ids, dtype=np.int64)
+        if len(self.raw_item_ids) == 0:
+            return np.full(len(article_ids), -1, dtype=np.int64)
+
+        positions = np.searchsorted(self.raw_item_ids, article_ids)
+        positions[positions == len(self.raw_item_ids)] = 0
+        known = self.raw_item_ids[positions] == article_ids
+
+        return np.where(known, self.inner_item_ids[positions], -1)
+
+    @abstractmethod
+    def score(self, user_id: int, article_ids: np.ndarray) -> np.ndarray:
+        """
+        Estimated ratings of a user for many articles at once, equal to the
+        `est` of `model.predict` for each of them.
+
+        Parameters:
+        user_id (int): The raw id of the user, possibly unknown to the model.
+        article_ids (np.ndarray): The raw ids of the articles to score.
+
+        Returns:
+        np.ndarray: The estimated ratings, in the order of `article_ids`.
+        """
+
+
+class FactorScorer(ModelScorer):
+    """
+    Score many items for a user at once with the parameters of a trained
+    surprise `SVD` or `BaselineOnly` model.
+
+    The parameters are extracted once from the model: global mean, user and
+    item biases and, for SVD, the user and item factors. The estimate of every
+    candidate item is then `mu + bu + bi + P[u] @ Q.T` computed as a single
+    NumPy operation, following the same rules as `model.predict` for unknown
+    users or items and clipping to the rating scale.
+    """
+
+    def __init__(self, model):
+        super().__init__(model)
+        self.biased = getattr(model, "biased", True)
+        self.bu = np.asarray(model.bu, dtype=np.float64)
+        self.bi = np.asarray(model.bi, dtype=np.float64)
+        self.pu = getattr(model, "pu", None)
+        self.qi = getattr(model, "qi", None)
+
+    def score(self, user_id: int, article_ids: np.ndarray) -> np.ndarray:
+        """
+        Estimated ratings of a user for candidate articles.
+
+        Parameters:
+        user_id (int): The raw user ID.
+        article_ids (np.ndarray): The raw IDs of the candidate articles.
+
+        Returns:
+        np.ndarray: The estimated rating of each candidate article.
+        """
+        inner_user: Optional[int] = self.user_inner_ids.get(int(user_id))
+        inner_items = self.inner_item_ids_of(article_ids)
+        known_items = inner_items >= 0
+        known_inner_items = inner_items[known_items]
+
+        if self.biased:
+            est = np.full(len(inner_items), self.global_mean, dtype=np.float64)
+            if inner_user is not None:
+                est += self.bu[inner_user]
+            est[known_items] += self.bi[known_inner_items]
+            if inner_user is not None and self.pu is not None:
+                est[known_items] += self.qi[known_inner_items] @ self.pu[inner_user]
+        else:
+            # Unbiased SVD cannot predict unknown users or items and falls
+            # back to the global mean
+            est = np.full(len(inner_items), self.global_mean, dtype=np.float64)
+            if inner_user is not None:
+                est[known_items] = self.qi[known_inner_items] @ self.pu[inner_user]
+
+        return np.clip(est, self.lower_bound, self.upper_bound)
+
+    def score_users(self, user_ids: np.ndarray, article_ids: np.ndarray) -> np.ndarray:
+        """
+        Estimated ratings of several users for the same candidate articles,
+        with a single matrix product against the item factors.
+
+        Parameters:
+        user_ids (np.ndarray): The raw user IDs.
+        article_ids (np.ndarray): The raw IDs of the candidate articles.
+
+        Returns:
+        np.ndarray: Array of shape (n_users, n_articles) of estimated ratings.
+        """
+        inner_users = np.array(
+            [self.user_inner_ids.get(int(user_id), -1) for user_id in user_ids],
+            dtype=np.int64,
+        )
+        known_users = inner_users >= 0
+        inner_items = self.inner_item_ids_of(article_ids)
+        known_items = inner_items >= 0
+        known = np.ix_(known_users, known_items)
+
+        est = np.full((len(inner_users), len(inner_items)), self.global_mean)
+        if self.biased:
+            est[known_users] += self.bu[inner_users[known_users]][:, None]
+            est[:, known_items] += self.bi[inner_items[known_items]]
+            if self.pu is not None:
+                est[known] += (
+                    self.pu[inner_users[known_users]] @ self.qi[inner_items[known_items]].T
+                )
+        else:
+            est[known] = self.pu[inner_users[known_users]] @ self.qi[inner_items[known_items]].T
+
+        return np.clip(est, self.lower_bound, self.upper_bound)
+
+
+class KNNScorer(ModelScorer):
+    """
+    Score many items for a user at once with a trained item-based surprise
+    `KNNWithMeans` model.
+
+    For every candidate item i, the k items rated by the user that are the
+    most similar to i are selected from the stored similarity matrix, and the
+    estimate is `mean[i] + sum(sim * (r - mean[j])) / sum(sim)` over those
+    with a positive similarity, as in `KNNWithMeans.estimate`. The selection
+    keeps surprise's tie-breaking (first rated item first) and its `min_k`
+    rule; `min_support` is already applied in the similarity matrix. NaN
+    similarities are ignored, where surprise's heap order is undefined.
+    """
+
+    def __init__(self, model, max_block_size: int = 4_000_000):
+        super().__init__(model)
+        self.model = model
+        self.user_based = model.sim_options.get("user_based", True)
+        self.sim = model.sim
+        self.means = np.asarray(model.means, dtype=np.float64)
+        self.k = model.k
+        self.min_k = model.min_k
+        self.max_block_size = max_block_size
+
+    def score(self, user_id: int, article_ids: np.ndarray) -> np.ndarray:
+        """
+        Estimated ratings of a user for candidate articles.
+
+        Parameters:
+        user_id (int): The raw user ID.
+        article_ids (np.ndarray): The raw IDs of the candidate articles.
+
+        Returns:
+        np.ndarray: The estimated rating of each candidate article.
+        """
+        if self.user_based:
+            # Neighbours depend on the raters of each item: use surprise
+            est = np.array(
+                [self.model.predict(user_id, int(iid)).est for iid in article_ids],
+                dtype=np.float64,
+            )
+            return est
+
+        inner_user = self.user_inner_ids.get(int(user_id))
+        inner_items = self.inner_item_ids_of(article_ids)
+        known_items = inner_items >= 0
+
+        # Unknown users or items fall back to the global mean
+        est = np.full(len(inner_items), self.global_mean, dtype=np.float64)
+        if inner_user is None or not self.trainset.ur[inner_user]:
+            return np.clip(est, self.lower_bound, self.upper_bound)
+
+        rated = self.trainset.ur[inner_user]
+        rated_items = np.array([j for (j, _) in rated], dtype=np.int64)
+        deviations = np.array([r for (_, r) in rated]) - self.means[rated_items]
+
+        candidates = inner_items[known_items]
+        estimates = np.empty(len(candidates), dtype=np.float64)
+        block_size = max(1, self.max_block_size // len(rated_items))
+        for start in range(0, len(candidates), block_size):
+            block = candidates[start:start + block_size]
+            estimates[start:start + block_size] = self._estimate_block(
+                block, rated_items, deviations
+            )
+        est[known_items] = estimates
+
+        return np.clip(est, self.lower_bound, self.upper_bound)
+
+    def _estimate_block(
+        self, candidates: np.ndarray, rated_items: np.ndarray, deviations: np.ndarray
+    ) -> np.ndarray:
+        """Estimates of a block of known candidate items for one user."""
+        sims = self.sim[np.ix_(candidates, rated_items)]
+        # Undefined similarities (e.g. pearson on constant ratings) are never
+        # selected as neighbours
+        sims[np.isnan(sims)] = -np.inf
+        n_rated = len(rated_items)
+
+        # Select the k most similar rated items of every candidate
+        if n_rated > self.k:
+            kth = np.partition(sims, n_rated - self.k, axis=1)[:, n_rated - self.k]
+            above = sims > kth[:, None]
+            ties = sims == kth[:, None]
+            # Among ties, keep the first ones as heapq.nlargest does
+            nb_missing = self.k - above.sum(axis=1)
+            selected = above | (ties & (np.cumsum(ties, axis=1) <= nb_missing[:, None]))
+        else:
+            selected = np.ones(sims.shape, dtype=bool)
+
+        weights = np.where(selected & (sims > 0), sims, 0.0)
+        actual_k = np.count_nonzero(weights, axis=1)
+        sum_sim = weights.sum(axis=1)
+        sum_ratings = weights @ deviations
+        sum_ratings[actual_k < self.min_k] = 0
+
+        est = self.means[candidates].copy()
+        has_neighbours = actual_k > 0
+        est[has_neighbours] += sum_ratings[has_neighbours] / sum_sim[has_neighbours]
+
+        return est
+
+
+class ALSScorer:
+    """
+    Score many items for a user at once with an `als.ALSModel`: the score of
+    an article is the dot product of the user and article factors, a
+    preference rather than a rating. Articles unknown to the model score 0,
+    as with null factors, and users unknown to the model get the articles
+    clicked by the most users first (scores between 0 and 1).
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.user_ids = np.asarray(model.user_ids, dtype=np.int64)
+        self.item_ids = np.asarray(model.item_ids, dtype=np.int64)
+        self.popularity = model.item_popularity / max(int(model.item_popularity.max(initial=0)), 1)
+
+    def _positions(self, sorted_ids: np.ndarray, raw_ids: np.ndarray) -> np.ndarray:
+        """Rows of raw ids in `sorted_ids`, -1 for the unknown ones."""
+        raw_ids = np.asarray(raw_ids, dtype=np.int64)
+        if len(sorted_ids) == 0:
+            return np.full(len(raw_ids), -1, dtype=np.int64)
+
+        positions = np.searchsorted(sorted_ids, raw_ids)
+        positions[positions == len(sorted_ids)] = 0
+
+        return np.where(sorted_ids[positions] == raw_ids, positions, -1)
+
+    def score(self, user_id: int, article_ids: np.ndarray) -> np.ndarray:
+        """Scores of a user for candidate articles."""
+        return self.score_users(np.array([user_id]), article_ids)[0]
+
+    def score_users(self, user_ids: np.ndarray, article_ids: np.ndarray) -> np.ndarray:
+        """Scores of several users for the same candidate articles."""
+        users = self._positions(self.user_ids, user_ids)
+        items = self._positions(self.item_ids, article_ids)
+        known_users = users >= 0
+        known_items = items >= 0
+
+        scores = np.zeros((len(users), len(items)), dtype=np.float64)
+        scores[np.ix_(known_users, known_items)] = (
+            self.model.user_factors[users[known_users]]
+            @ self.model.item_factors[items[known_items]].T
+        )
+        scores[np.ix_(~known_users, known_items)] = self.popularity[items[known_items]]
+
+        return scores
+
+
+def factor_scorer(model) -> FactorScorer:
+    """
+    Scorer of a SVD or BaselineOnly model. The registry builds it once per
+    loaded model, see `ModelRegistry.scorer`.
+    """
+    return FactorScorer(model)
+
+
+def knn_scorer(model) -> KNNScorer:
+    """Scorer of a KNN model, see `ModelRegistry.scorer`."""
+    return KNNScorer(model)
+
+
+def als_scorer(model) -> ALSScorer:
+    """Scorer of an ALS model, see `ModelRegistry.scorer`."""
+    return ALSScorer(model)
@@ -1,25 +1,40 @@
 # Import packages
+import json
+import math
+import os
 import pickle
+import random
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import product
+from typing import List, Optional
+import numpy as np
 import pandas as pd
 from surprise import Dataset
 from surprise import Reader
 from surprise import BaselineOnly, KNNWithMeans, SVD
-from surprise.model_selection import GridSearchCV, train_test_split
+from surprise.model_selection import KFold, train_test_split
 from surprise import accuracy
 
 
-def model_baseline_only(df: pd.DataFrame, model_filename: str):
+def make_splits(
+    df: pd.DataFrame, test_size: float = 0.2, n_folds: int = 3, seed: int = 0
+) -> dict:
     """
-    Train a collaborative filtering model using BaselineOnly
-    and save the best model.
+    Split the ratings once so that every model is searched on the same folds
+    and evaluated on the same test set.
 
     Parameters:
     df (pd.DataFrame): DataFrame containing the user-item ratings.
-    It should have columns corresponding to user IDs, item IDs, and ratings.
-    model_filename (str): The filename to save the trained model as a pickle.
+    test_size (float): Proportion of the ratings held out for the final test.
+    n_folds (int): Number of cross-validation folds of the search.
+    seed (int): Seed of the random splits.
 
     Returns:
-    best_model: The best trained baseline model based on RMSE.
+    dict: A dictionary containing:
+        - "data": The surprise Dataset of all the ratings.
+        - "trainset" and "testset": The final train/test split.
+        - "folds": The list of (trainset, testset) cross-validation folds.
     """
     # Define the rating scale
     reader = Reader(rating_scale=(0, 10))
@@ -28,34 +43,249 @@ def model_baseline_only(df: pd.DataFrame, model_filename: str):
     data = Dataset.load_from_df(df, reader)
 
     # Split the data into training and testing sets
-    trainset, testset = train_test_split(data, test_size=0.2)
+    trainset, testset = train_test_split(data, test_size=test_size, random_state=seed)
 
-    # Set baseline options
-    bsl_options = {
-        "method": ["als", "sgd"],
-        "n_epochs": [5, 10, 20],
-        "reg_u": [12, 15, 20],
-        "reg_i": [5, 10, 15],
+    # Fold assignment shared by all the searches
+    folds = list(KFold(n_splits=n_folds, random_state=seed).split(data))
+
+    splits = {
+        "data": data,
+        "trainset": trainset,
+        "testset": testset,
+        "folds": folds,
     }
 
-    param_grid = {"bsl_options": bsl_options}
+    return splits
+
+
+def expand_param_grid(param_grid: dict) -> List[dict]:
+    """
+    List every combination of a surprise-style parameter grid, where
+    `sim_options` and `bsl_options` are grids themselves.
+    """
+    param_grid = dict(param_grid)
+    for options in ("sim_options", "bsl_options"):
+        if options in param_grid:
+            grid = param_grid[options]
+            param_grid[options] = [
+                dict(zip(grid, values)) for values in product(*grid.values())
+            ]
+
+    return [dict(zip(param_grid, values)) for values in product(*param_grid.values())]
+
+
+# Folds of the worker processes, set once by `_init_worker`
+_folds = []
+
+
+def _init_worker(folds: list):
+    _folds[:] = folds
+
+
+def _evaluate(algo_class, params: dict, fold: int) -> dict:
+    """Fit one configuration on one fold and measure it."""
+    trainset, testset = _folds[fold]
+    algo = algo_class(**params)
+
+    start = time.perf_counter()
+    algo.fit(trainset)
+    fit_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    predictions = algo.test(testset)
+    test_time = time.perf_counter() - start
+
+    result = {
+        "fold": fold,
+        "fit_time": fit_time,
+        "test_time": test_time,
+        "rmse": accuracy.rmse(predictions, verbose=False),
+        "mae": accuracy.mae(predictions, verbose=False),
+    }
+
+    return result
+
+
+def search(
+    algo_class,
+    param_grid: dict,
+    splits: dict,
+    strategy: str = "grid",
+    n_iter: Optional[int] = None,
+    n_jobs: int = 1,
+    time_budget: Optional[float] = None,
+    results_file: Optional[str] = None,
+    halving_factor: int = 3,
+    seed: int = 0,
+) -> dict:
+    """
+    Search the best parameters of a surprise algorithm on shared folds, with
+    the (configuration, fold) fits spread over a pool of processes.
+
+    Parameters:
+    algo_class: The surprise algorithm class, e.g. SVD.
+    param_grid (dict): Surprise-style grid of parameters.
+    splits (dict): Output of `make_splits`.
+    strategy (str): "grid" evaluates every configuration, "random" a random
+    subset of `n_iter` configurations, and "halving" runs successive halving:
+    all configurations on the first fold, then the best 1 / `halving_factor`
+    on one more fold, and so on.
+    n_iter (Optional[int]): Number of configurations of the random search.
+    n_jobs (int): Number of worker processes, 1 to fit in this process.
+    time_budget (Optional[float]): Wall-clock budget in seconds. Once
+    exceeded, no new fit is started and pending ones are cancelled.
+    results_file (Optional[str]): CSV file where the fit time, RMSE and MAE of
+    every (configuration, fold) fit are appended.
+    halving_factor (int): Reduction factor of the successive halving.
+    seed (int): Seed of the random search.
 
-    # Perform grid search with cross-validation
-    gs = GridSearchCV(BaselineOnly, param_grid, measures=["rmse", "mae"], cv=3)
-    gs.fit(data)
+    Returns:
+    dict: The best parameters according to the mean RMSE over folds.
+    """
+    deadline = time.monotonic() + time_budget if time_budget is not None else math.inf
+    configs = expand_param_grid(param_grid)
+    if strategy == "random" and n_iter is not None and n_iter < len(configs):
+        configs = random.Random(seed).sample(configs, n_iter)
+    elif strategy not in ("grid", "random", "halving"):
+        raise ValueError(f"Unknown search strategy: {strategy}")
+
+    n_folds = len(splits["folds"])
+    if strategy == "halving":
+        rungs = [[fold] for fold in range(n_folds)]
+    else:
+        rungs = [list(range(n_folds))]
+
+    executor = None
+    if n_jobs != 1:
+        executor = ProcessPoolExecutor(
+            max_workers=n_jobs, initializer=_init_worker, initargs=(splits["folds"],)
+        )
+    else:
+        _init_worker(splits["folds"])
+
+    records = []
+    candidates = list(range(len(configs)))
+    try:
+        for rung, folds in enumerate(rungs):
+            tasks = [(c, fold) for c in candidates for fold in folds]
+            records.extend(
+                _run_tasks(algo_class, configs, tasks, executor, deadline, rung)
+            )
+            if strategy != "halving" or time.monotonic() >= deadline:
+                break
+
+            # Keep the best configurations for the next rung
+            scores = _mean_scores(records, min_folds=rung + 1)
+            ranked = sorted(scores, key=scores.get)
+            candidates = ranked[:max(1, len(ranked) // halving_factor)]
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    if not records:
+        raise RuntimeError("The time budget ended before any configuration was fitted")
+
+    results = pd.DataFrame(records)
+    results.insert(0, "algo", algo_class.__name__)
+    results["params"] = [json.dumps(configs[c]) for c in results.pop("config")]
+    if results_file is not None:
+        results.to_csv(
+            results_file,
+            mode="a",
+            header=not os.path.exists(results_file),
+            index=False,
+        )
+
+    # Best configuration among the ones evaluated on the most folds
+    max_folds = max(np.bincount([r["config"] for r in records]))
+    scores = _mean_scores(records, min_folds=max_folds)
+
+    return configs[min(scores, key=scores.get)]
+
+
+def _run_tasks(algo_class, configs, tasks, executor, deadline, rung) -> List[dict]:
+    """Run (configuration, fold) fits until done or out of time budget."""
+    records = []
+    if executor is None:
+        for config, fold in tasks:
+            if time.monotonic() >= deadline:
+                break
+            record = _evaluate(algo_class, configs[config], fold)
+            records.append({"config": config, "rung": rung, **record})
+        return records
+
+    futures = {
+        executor.submit(_evaluate, algo_class, configs[config], fold): config
+        for config, fold in tasks
+    }
+    pending = set(futures)
+    while pending:
+        timeout = None if deadline == math.inf else max(deadline - time.monotonic(), 0)
+        done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        for future in done:
+            if not future.cancelled():
+                records.append({"config": futures[future], "rung": rung, **future.result()})
+        if time.monotonic() >= deadline:
+            for future in pending:
+                future.cancel()
+            break
+
+    return records
+
+
+def _mean_scores(records: List[dict], min_folds: int) -> dict:
+    """Mean RMSE of the configurations evaluated on at least `min_folds` folds."""
+    rmse = {}
+    for record in records:
+        rmse.setdefault(record["config"], []).append(record["rmse"])
+
+    return {
+        config: float(np.mean(values))
+        for config, values in rmse.items()
+        if len(values) >= min_folds
+    }
 
-    # Get the best model from the grid search
-    best_model = gs.best_estimator["rmse"]
+
+def fit_best_model(
+    algo_class,
+    param_grid: dict,
+    df: pd.DataFrame,
+    model_filename: str,
+    splits: Optional[dict] = None,
+    **search_options,
+):
+    """
+    Search the best parameters of an algorithm, train it on the training set,
+    save it and measure it on the test set.
+
+    Parameters:
+    algo_class: The surprise algorithm class, e.g. SVD.
+    param_grid (dict): Surprise-style grid of parameters.
+    df (pd.DataFrame): DataFrame containing the user-item ratings.
+    model_filename (str): The filename to save the trained model as a pickle.
+    splits (Optional[dict]): Output of `make_splits`, computed from `df` if
+    not given. Pass the same splits to compare models on the same folds.
+    **search_options: Options of `search` (strategy, n_jobs, time_budget...).
+
+    Returns:
+    best_model: The best trained model based on RMSE, and its test RMSE.
+    """
+    if splits is None:
+        splits = make_splits(df)
+
+    # Perform the search with cross-validation
+    best_params = search(algo_class, param_grid, splits, **search_options)
 
     # Train the best model on the full training set
-    best_model.fit(trainset)
+    best_model = algo_class(**best_params)
+    best_model.fit(splits["trainset"])
 
     # Save the best model to a file using pickle
     with open(model_filename, "wb") as model_file:
         pickle.dump(best_model, model_file)
 
     # Make predictions on the test set
-    predictions = best_model.test(testset)
+    predictions = best_model.test(splits["testset"])
 
     # Calculate the RMSE
     rmse = accuracy.rmse(predictions, verbose=True)
@@ -63,28 +293,61 @@ def model_baseline_only(df: pd.DataFrame, model_filename: str):
     return best_model, rmse
 
 
-def model_based_knn(df: pd.DataFrame, model_filename: str):
+def model_baseline_only(
+    df: pd.DataFrame,
+    model_filename: str,
+    splits: Optional[dict] = None,
+    **search_options,
+):
     """
-    Train a collaborative filtering model using k-Nearest Neighbors
-    with Means and save the best model.
+    Train a collaborative filtering model using BaselineOnly
+    and save the best model.
 
     Parameters:
     df (pd.DataFrame): DataFrame containing the user-item ratings.
     It should have columns corresponding to user IDs, item IDs, and ratings.
     model_filename (str): The filename to save the trained model as a pickle.
+    splits (Optional[dict]): Shared output of `make_splits`.
+    **search_options: Options of `search` (strategy, n_jobs, time_budget...).
 
     Returns:
-    best_model: The best trained k-NN model based on RMSE.
+    best_model: The best trained baseline model based on RMSE.
     """
-    # Define the rating scale
-    reader = Reader(rating_scale=(0, 10))
+    # Set baseline options
+    bsl_options = {
+        "method": ["als", "sgd"],
+        "n_epochs": [5, 10, 20],
+        "reg_u": [12, 15, 20],
+        "reg_i": [5, 10, 15],
+    }
 
-    # Loads Pandas Dataframe
-    data = Dataset.load_from_df(df, reader)
+    param_grid = {"bsl_options": bsl_options}
+
+    return fit_best_model(
+        BaselineOnly, param_grid, df, model_filename, splits, **search_options
+    )
 
-    # Split the data into training and testing sets
-    trainset, testset = train_test_split(data, test_size=0.2)
 
+def model_based_knn(
+    df: pd.DataFrame,
+    model_filename: str,
+    splits: Optional[dict] = None,
+    **search_options,
+):
+    """
+    Train a collaborative filtering model using k-Nearest Neighbors
+    with Means and save the best model.
+
+    Parameters:
+    df (pd.DataFrame): DataFrame containing the user-item ratings.
+    It should have columns corresponding to user IDs, item IDs, and ratings.
+    model_filename (str): The filename to save the trained model as a pickle.
+    splits (Optional[dict]): Shared output of `make_splits`.
+    **search_options: Options of `search` (strategy, n_jobs, time_budget...).
+
+    Returns:
+    best_model: The best trained k-NN model based on RMSE.
+    """
     # Set similarity options
     sim_options = {
         "name": ["msd"],
@@ -94,34 +357,17 @@ def model_based_knn(df: pd.DataFrame, model_filename: str):
 
     param_grid = {"sim_options": sim_options}
 
-    # Perform grid search with cross-validation
-    gs = GridSearchCV(KNNWithMeans, param_grid, measures=["rmse", "mae"], cv=3)
-    gs.fit(data)
-
-    # Get the best model from the grid search
-    best_model = gs.best_estimator["rmse"]
-
-    # Train the best model on the full training set
-    best_model.fit(trainset)
-
-    # Train the best model on the full training set
-    # trainset = data.build_full_trainset()
-    # best_model.fit(trainset)
-
-    # Save the best model to a file using pickle
-    with open(model_filename, "wb") as model_file:
-        pickle.dump(best_model, model_file)
-
-    # Make predictions on the test set
-    predictions = best_model.test(testset)
-
-    # Calculate the RMSE
-    rmse = accuracy.rmse(predictions, verbose=True)
-
-    return best_model, rmse
+    return fit_best_model(
+        KNNWithMeans, param_grid, df, model_filename, splits, **search_options
+    )
 
 
-def model_based_svd(df: pd.DataFrame, model_filename: str):
+def model_based_svd(
+    df: pd.DataFrame,
+    model_filename: str,
+    splits: Optional[dict] = None,
+    **search_options,
+):
     """
     Train a collaborative filtering model using Singular Value Decomposition
     (SVD) and save the best model.
@@ -130,19 +376,12 @@ def model_based_svd(df: pd.DataFrame, model_filename: str):
     df (pd.DataFrame): DataFrame containing the user-item ratings.
     It should have columns corresponding to user IDs, item IDs, and ratings.
     model_filename (str): The filename to save the trained model as a pickle.
+    splits (Optional[dict]): Shared output of `make_splits`.
+    **search_options: Options of `search` (strategy, n_jobs, time_budget...).
 
     Returns:
     best_model: The best trained SVD model based on RMSE.
     """
-    # Define the rating scale
-    reader = Reader(rating_scale=(0, 10))
-
-    # Load Pandas DataFrame
-    data = Dataset.load_from_df(df, reader)
-
-    # Split the data into training and testing sets
-    trainset, testset = train_test_split(data, test_size=0.2)
-
     # Set parameters for grid search
     param_grid = {
         "n_factors": [50, 150],
@@ -151,24 +390,34 @@ def model_based_svd(df: pd.DataFrame, model_filename: str):
         "reg_all": [0.4, 0.6],
     }
 
-    # Perform grid search with cross-validation
-    gs = GridSearchCV(SVD, param_grid, measures=["rmse", "mae"], cv=3)
-    gs.fit(data)
+    return fit_best_model(SVD, param_grid, df, model_filename, splits, **search_options)
 
-    # Get the best model from the grid search
-    best_model = gs.best_estimator["rmse"]
 
-    # Train the best model on the full training set
-    best_model.fit(trainset)
-
-    # Save the best model to a file using pickle
-    with open(model_filename, "wb") as model_file:
-        pickle.dump(best_model, model_file)
-
-    # Make predictions on the test set
-    predictions = best_model.test(testset)
+def train_all(df: pd.DataFrame, model_dir: str, seed: int = 0, **search_options) -> dict:
+    """
+    Train the three collaborative filtering models on the same split and
+    folds, and save them in `model_dir` under the names served by `predict`.
 
-    # Calculate the RMSE
-    rmse = accuracy.rmse(predictions, verbose=True)
+    Parameters:
+    df (pd.DataFrame): DataFrame containing the user-item ratings.
+    model_dir (str): Directory where the models are saved.
+    seed (int): Seed of the shared split.
+    **search_options: Options of `search` (strategy, n_jobs, time_budget,
+    results_file...).
 
-    return best_model, rmse
+    Returns:
+    dict: The test RMSE of each model.
+    """
+    splits = make_splits(df, seed=seed)
+
+    rmse = {}
+    for name, train in [
+        ("model_baseline_only", model_baseline_only),
+        ("model_based_knn", model_based_knn),
+        ("model_based_svd", model_based_svd),
+    ]:
+        _, rmse[name] = train(
+            df, os.path.join(model_dir, name + ".pickle"), splits, **search_options
+        )
+
+    return rmse
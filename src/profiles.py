@@ -0,0 +1,204 @@
+"""Module containing the user profile embeddings built from the click history"""
+
+# Import packages
+import argparse
+import os
+import shutil
+from typing import Optional
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from src.embeddings import EmbeddingStore
+from src.interactions import InteractionIndex
+
+# Arrays of the on-disk profile store, one .npy file each
+STORE_ARRAYS = ["user_ids", "sums", "weights", "reference_times"]
+
+
+class UserProfiles:
+    """
+    Profile of every user: the mean of the embeddings of the articles they
+    clicked, each weighted by 2 ** (-age / half_life), the age of a click
+    being measured from the user's `reference_time` (their latest update).
+
+    Row `p` of `sums` is the weighted sum of the embeddings of the user
+    `user_ids[p]` and `weights[p]` the sum of the weights: the direction of
+    the sum is the one of the weighted mean, so `vector` only has to
+    normalize it. Keeping the sums lets new clicks be added by decaying the
+    sums of their users only, without reading the history again.
+
+    Like the interaction store, `save` writes one `.npy` file per array and
+    `load` memory-maps them.
+    """
+
+    def __init__(
+        self,
+        user_ids: np.ndarray,
+        sums: np.ndarray,
+        weights: np.ndarray,
+        reference_times: np.ndarray,
+        half_life_hours: float = 24.0,
+    ):
+        self.user_ids = user_ids
+        self.sums = sums
+        self.weights = weights
+        self.reference_times = reference_times
+        self.half_life = half_life_hours * 3600 * 1000  # click timestamps are in ms
+
+    @classmethod
+    def build(
+        cls,
+        interactions: InteractionIndex,
+        embeddings: EmbeddingStore,
+        half_life_hours: float = 24.0,
+        block_users: int = 100_000,
+    ) -> "UserProfiles":
+        """
+        Build the profiles of every user of an interaction index in bulk: the
+        recency weights form a sparse user x article matrix W, sharing the
+        CSR layout of the index, and the sums are W @ E, computed by blocks of
+        `block_users` users. Without click timestamps, every click weighs 1.
+        Articles missing from the embeddings are ignored.
+        """
+        half_life = half_life_hours * 3600 * 1000
+        article_ids = np.asarray(interactions.article_ids, dtype=np.int64)
+        counts = np.diff(interactions.indptr)
+
+        if interactions.timestamps is not None:
+            timestamps = np.asarray(interactions.timestamps, dtype=np.float64)
+            reference_times = np.zeros(interactions.n_users)
+            has_clicks = counts > 0
+            reference_times[has_clicks] = np.maximum.reduceat(
+                timestamps, interactions.indptr[:-1][has_clicks]
+            )
+            ages = np.repeat(reference_times, counts) - timestamps
+            data = 2 ** (-ages / half_life)
+        else:
+            reference_times = np.zeros(interactions.n_users)
+            data = np.ones(len(article_ids))
+        data[article_ids >= embeddings.n_articles] = 0
+
+        weights_matrix = sp.csr_matrix(
+            (data.astype(np.float32), np.minimum(article_ids, embeddings.n_articles - 1),
+             interactions.indptr),
+            shape=(interactions.n_users, embeddings.n_articles),
+        )
+        sums = np.empty((interactions.n_users, embeddings.dim), dtype=np.float32)
+        vectors = np.asarray(embeddings.vectors, dtype=np.float32)
+        for start in range(0, interactions.n_users, block_users):
+            sums[start:start + block_users] = weights_matrix[start:start + block_users] @ vectors
+
+        return cls(
+            np.asarray(interactions.user_ids),
+            sums,
+            np.asarray(weights_matrix.sum(axis=1)).ravel().astype(np.float64),
+            reference_times,
+            half_life_hours,
+        )
+
+    def update(self, df: pd.DataFrame, embeddings: EmbeddingStore) -> "UserProfiles":
+        """
+        New profiles with the new clicks of `df` (columns user_id, article_id
+        and optionally click_timestamp) added: the sums of their users are
+        decayed to the latest of their clicks, and new users are inserted.
+        Users without a reference time (0, e.g. profiles built from clicks
+        without timestamps) keep their sums as they are: only their reference
+        time is set to their latest click.
+        """
+        df = df[df["article_id"].to_numpy() < embeddings.n_articles]
+        users = df["user_id"].to_numpy()
+        new_users = np.setdiff1d(users, self.user_ids)
+        positions = np.searchsorted(self.user_ids, new_users)
+        user_ids = np.insert(self.user_ids, positions, new_users)
+        sums = np.insert(np.asarray(self.sums), positions, 0, axis=0)
+        weights = np.insert(np.asarray(self.weights), positions, 0)
+        reference_times = np.insert(np.asarray(self.reference_times), positions, 0)
+
+        rows = np.searchsorted(user_ids, users)
+        if "click_timestamp" in df.columns:
+            timestamps = df["click_timestamp"].to_numpy(dtype=np.float64)
+            latest = reference_times.copy()
+            np.maximum.at(latest, rows, timestamps)
+            affected = np.unique(rows)
+            timed = reference_times[affected] > 0
+            decay = np.ones(len(affected))
+            decay[timed] = 2 ** (
+                -(latest[affected][timed] - reference_times[affected][timed]) / self.half_life
+            )
+            sums[affected] *= decay[:, None].astype(np.float32)
+            weights[affected] *= decay
+            reference_times = latest
+            click_weights = 2 ** (-(latest[rows] - timestamps) / self.half_life)
+        else:
+            click_weights = np.ones(len(df))
+
+        weights_matrix = sp.csr_matrix(
+            (click_weights.astype(np.float32), (rows, df["article_id"].to_numpy())),
+            shape=(len(user_ids), embeddings.n_articles),
+        )
+        sums += weights_matrix @ np.asarray(embeddings.vectors, dtype=np.float32)
+        np.add.at(weights, rows, click_weights)
+
+        return UserProfiles(
+            user_ids, sums, weights, reference_times, self.half_life / (3600 * 1000)
+        )
+
+    def save(self, dir_path: str) -> str:
+        """Write the profiles as a directory of `.npy` files, replaced at once."""
+        tmp_path = dir_path + ".tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        for name in STORE_ARRAYS:
+            np.save(os.path.join(tmp_path, name + ".npy"), getattr(self, name))
+        np.save(os.path.join(tmp_path, "half_life_hours.npy"), self.half_life / (3600 * 1000))
+
+        old_path = dir_path + ".old"
+        if os.path.exists(dir_path):
+            os.replace(dir_path, old_path)
+        os.replace(tmp_path, dir_path)
+        shutil.rmtree(old_path, ignore_errors=True)
+
+        return dir_path
+
+    @classmethod
+    def load(cls, dir_path: str, mmap: bool = True) -> "UserProfiles":
+        """Load profiles written by `save`, memory-mapped unless `mmap` is False."""
+        arrays = {
+            name: np.load(os.path.join(dir_path, name + ".npy"), mmap_mode="r" if mmap else None)
+            for name in STORE_ARRAYS
+        }
+        half_life_hours = float(np.load(os.path.join(dir_path, "half_life_hours.npy")))
+
+        return cls(**arrays, half_life_hours=half_life_hours)
+
+    @property
+    def n_users(self) -> int:
+        return len(self.user_ids)
+
+    def vector(self, user_id: int) -> Optional[np.ndarray]:
+        """Normalized profile of a user, None if the user has no profile."""
+        position = int(np.searchsorted(self.user_ids, user_id))
+        if position == len(self.user_ids) or self.user_ids[position] != user_id:
+            return None
+
+        row = np.asarray(self.sums[position], dtype=np.float32)
+        norm = np.linalg.norm(row)
+
+        return row / norm if norm > 0 else None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build the user profiles from the interaction store"
+    )
+    parser.add_argument("interactions_path")
+    parser.add_argument("embeddings_path")
+    parser.add_argument("dir_path")
+    parser.add_argument("--half-life-hours", type=float, default=24.0)
+    args = parser.parse_args()
+
+    UserProfiles.build(
+        InteractionIndex.load(args.interactions_path),
+        EmbeddingStore.load(args.embeddings_path),
+        args.half_life_hours,
+    ).save(args.dir_path)
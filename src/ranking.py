@@ -0,0 +1,90 @@
+"""Module containing functions to select the best ranked items"""
+
+# Import packages
+from typing import Iterable, Optional, Tuple
+import numpy as np
+
+
+def top_k(
+    scores: np.ndarray, k: int, exclude: Optional[Iterable[int]] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Select the k highest scores of a vector without sorting all of it.
+
+    The k winners are found with `np.argpartition` in linear time and only
+    they are sorted. Ties are broken by ascending position, so the result is
+    the same as the first k entries of a stable descending sort.
+
+    Parameters:
+    scores (np.ndarray): 1D array of scores, one per item position.
+    k (int): The number of items to keep.
+    exclude (Optional[Iterable[int]]): Item positions that must never be
+    returned (e.g. the query article itself or already clicked articles).
+
+    Returns:
+    Tuple[np.ndarray, np.ndarray]: The positions of the k best items and
+    their scores, both sorted by decreasing score.
+    """
+    scores = np.asarray(scores)
+    n = scores.shape[0]
+
+    if exclude is None:
+        exclude = np.empty(0, dtype=np.intp)
+    else:
+        exclude = np.unique(np.asarray(list(exclude), dtype=np.intp))
+
+    # Take enough winners to still have k items once the excluded are dropped
+    k = max(min(int(k), n - exclude.size), 0)
+    nb_winners = min(n, k + exclude.size)
+    if k == 0:
+        return np.empty(0, dtype=np.intp), scores[:0]
+
+    if nb_winners < n:
+        winners = np.argpartition(scores, n - nb_winners)[n - nb_winners:]
+        # Keep every item tied with the last winner so ordering is deterministic
+        threshold = scores[winners].min()
+        winners = np.flatnonzero(scores >= threshold)
+    else:
+        winners = np.arange(n)
+
+    if exclude.size:
+        winners = winners[~np.isin(winners, exclude)]
+
+    order = np.argsort(-scores[winners], kind="stable")[:k]
+    indices = winners[order]
+
+    return indices, scores[indices]
+
+
+def top_k_rows(scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Row-wise version of `top_k` for a 2D matrix of scores, e.g. one row of
+    similarities per query. Entries to exclude should be set to -inf
+    beforehand.
+
+    Parameters:
+    scores (np.ndarray): 2D array of scores of shape (n_queries, n_items).
+    k (int): The number of items to keep per row.
+
+    Returns:
+    Tuple[np.ndarray, np.ndarray]: Arrays of shape (n_queries, k) with the
+    positions of the best items of each row and their scores, sorted by
+    decreasing score.
+    """
+    scores = np.asarray(scores)
+    n = scores.shape[1]
+    k = max(min(int(k), n), 0)
+
+    if k == 0:
+        return np.empty((scores.shape[0], 0), dtype=np.intp), scores[:, :0]
+    if k < n:
+        winners = np.argpartition(scores, n - k, axis=1)[:, n - k:]
+    else:
+        winners = np.broadcast_to(np.arange(n), scores.shape)
+    winner_scores = np.take_along_axis(scores, winners, axis=1)
+
+    # Sort the winners by decreasing score, then by ascending position
+    order = np.lexsort((winners, -winner_scores), axis=1)
+    indices = np.take_along_axis(winners, order, axis=1)
+
+    return indices, np.take_along_axis(winner_scores, order, axis=1)
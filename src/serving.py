@@ -0,0 +1,215 @@
+"""Module containing the worker pools isolating the scoring of each model"""
+
+# Import packages
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List
+
+
+class PoolSaturated(Exception):
+    """Raised when a scoring pool has no room left for a new request."""
+
+
+class ScoringPool:
+    """
+    Bounded pool of threads dedicated to the scoring of one model or endpoint.
+
+    Scoring functions run outside of the event loop, so that an async FastAPI
+    route never blocks it, and each model gets its own threads, so that slow
+    requests of one model (e.g. KNN) cannot starve the others. NumPy releases
+    the GIL in its heavy operations, and threads share the models resident in
+    memory. At most `max_workers` requests are scored at once and
+    `max_queue` more may wait; beyond that, requests are rejected right away
+    with `PoolSaturated` (load shedding). A request not finished after
+    `timeout` seconds raises `asyncio.TimeoutError`; its thread keeps its
+    slot until the scoring actually ends.
+    """
+
+    def __init__(
+        self, name: str, max_workers: int = 2, max_queue: int = 16, timeout: float = 10.0
+    ):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    @classmethod
+    def from_env(
+        cls, name: str, max_workers: int, max_queue: int, timeout: float
+    ) -> "ScoringPool":
+        """
+        Pool configured by the environment variables <NAME>_WORKERS,
+        <NAME>_QUEUE and <NAME>_TIMEOUT, with the given defaults.
+        """
+        prefix = name.upper()
+
+        return cls(
+            name,
+            max_workers=int(os.getenv(f"{prefix}_WORKERS", max_workers)),
+            max_queue=int(os.getenv(f"{prefix}_QUEUE", max_queue)),
+            timeout=float(os.getenv(f"{prefix}_TIMEOUT", timeout)),
+        )
+
+    def _release(self, _):
+        with self._lock:
+            self.in_flight -= 1
+            self.completed += 1
+
+    async def run(self, func: Callable, *args, **kwargs):
+        """Run `func(*args, **kwargs)` in the pool and wait for its result."""
+        with self._lock:
+            if self.in_flight >= self.max_workers + self.max_queue:
+                self.rejected += 1
+                raise PoolSaturated(self.name)
+            self.in_flight += 1
+
+        # Run in a copy of the context, for the per-request timings of metrics
+        context = contextvars.copy_context()
+        future = self.executor.submit(context.run, functools.partial(func, *args, **kwargs))
+        future.add_done_callback(self._release)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self.timeouts += 1
+            raise
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "timeout": self.timeout,
+                "in_flight": self.in_flight,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "timeouts": self.timeouts,
+            }
+
+
+class RequestCoalescer:
+    """
+    Micro-batching of concurrent requests into one scoring call.
+
+    Requests submitted within `max_wait` seconds of the first pending one are
+    gathered, up to `max_batch` of them, and handed together to
+    `process_batch` in the scoring pool, e.g. to score many users with a
+    single matrix product instead of one product per user. Each caller then
+    gets its own result back. A full batch is sent at once, without waiting.
+    `process_batch` takes the list of the submitted items and returns the list
+    of their results in the same order; if it raises, every caller of the
+    batch gets the exception.
+    """
+
+    def __init__(
+        self,
+        pool: ScoringPool,
+        process_batch: Callable[[List[Any]], List[Any]],
+        max_wait: float = 0.002,
+        max_batch: int = 32,
+    ):
+        self.pool = pool
+        self.process_batch = process_batch
+        self.max_wait = max_wait
+        self.max_batch = max_batch
+        self._pending = []
+        self._timer = None
+        # The event loop only keeps weak references to the running batches
+        self._tasks = set()
+        self.batch_sizes = Counter()
+        self.batches = 0
+        self.requests = 0
+        self.total_wait = 0.0
+        self.max_observed_wait = 0.0
+
+    @classmethod
+    def from_env(
+        cls,
+        pool: ScoringPool,
+        process_batch: Callable[[List[Any]], List[Any]],
+        max_wait: float,
+        max_batch: int,
+    ) -> "RequestCoalescer":
+        """
+        Coalescer configured by the environment variables
+        <POOL NAME>_BATCH_WAIT_MS and <POOL NAME>_BATCH_SIZE, with the given
+        defaults (`max_wait` in seconds).
+        """
+        prefix = pool.name.upper()
+
+        return cls(
+            pool,
+            process_batch,
+            max_wait=float(os.getenv(f"{prefix}_BATCH_WAIT_MS", max_wait * 1000)) / 1000,
+            max_batch=int(os.getenv(f"{prefix}_BATCH_SIZE", max_batch)),
+        )
+
+    async def submit(self, item: Any):
+        """Add `item` to the next batch and wait for its result."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future, time.perf_counter()))
+
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+
+        now = time.perf_counter()
+        waits = [now - enqueued_at for _, _, enqueued_at in batch]
+        self.batch_sizes[len(batch)] += 1
+        self.batches += 1
+        self.requests += len(batch)
+        self.total_wait += sum(waits)
+        self.max_observed_wait = max(self.max_observed_wait, max(waits))
+
+        task = asyncio.ensure_future(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch):
+        try:
+            results = await self.pool.run(self.process_batch, [item for item, _, _ in batch])
+        except Exception as error:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(error)
+            return
+
+        for (_, future, _), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self) -> dict:
+        return {
+            "max_wait_ms": self.max_wait * 1000,
+            "max_batch": self.max_batch,
+            "batches": self.batches,
+            "requests": self.requests,
+            "mean_batch_size": self.requests / self.batches if self.batches else 0.0,
+            "batch_sizes": dict(sorted(self.batch_sizes.items())),
+            "mean_queue_wait_ms": 1000 * self.total_wait / self.requests if self.requests else 0.0,
+            "max_queue_wait_ms": 1000 * self.max_observed_wait,
+        }
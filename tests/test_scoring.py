@@ -0,0 +1,64 @@
+"""Vectorized scorers against surprise's own `predict` on a toy trainset"""
+
+# Import packages
+import numpy as np
+import pandas as pd
+import pytest
+from surprise import BaselineOnly, Dataset, KNNWithMeans, Reader, SVD
+from src.modeling.scoring import FactorScorer, KNNScorer
+
+# Scores equal within this tolerance are ties, broken by ascending article id
+TOLERANCE = 1e-9
+
+
+@pytest.fixture(scope="module")
+def trainset():
+    rng = np.random.default_rng(0)
+    n_ratings = 400
+    ratings = pd.DataFrame(
+        {
+            "user_id": rng.integers(0, 30, n_ratings),
+            "article_id": rng.integers(100, 140, n_ratings),
+            # Integer ratings, so that many estimates tie
+            "rating": rng.integers(0, 11, n_ratings).astype(float),
+        }
+    ).drop_duplicates(["user_id", "article_id"])
+
+    return Dataset.load_from_df(ratings, Reader(rating_scale=(0, 10))).build_full_trainset()
+
+
+def ranked(article_ids: np.ndarray, scores: np.ndarray) -> list:
+    """Article ids by decreasing score, ties within TOLERANCE by ascending id."""
+    buckets = np.round(np.asarray(scores) / TOLERANCE)
+    return article_ids[np.lexsort((article_ids, -buckets))].tolist()
+
+
+MODELS = {
+    "knn_item_based": lambda: KNNWithMeans(
+        k=5, min_k=4, sim_options={"name": "msd", "user_based": False}, verbose=False
+    ),
+    "knn_item_based_pearson": lambda: KNNWithMeans(
+        k=3, sim_options={"name": "pearson", "min_support": 2, "user_based": False},
+        verbose=False,
+    ),
+    "svd": lambda: SVD(n_factors=5, n_epochs=5, random_state=0),
+    "svd_unbiased": lambda: SVD(n_factors=5, n_epochs=5, biased=False, random_state=0),
+    "baseline_only": lambda: BaselineOnly(verbose=False),
+}
+
+
+@pytest.mark.parametrize("name", MODELS)
+def test_scorer_matches_surprise_predict(trainset, name):
+    model = MODELS[name]()
+    model.fit(trainset)
+    scorer = KNNScorer(model) if name.startswith("knn") else FactorScorer(model)
+
+    # Known articles, plus one the model has never seen
+    article_ids = np.arange(100, 141)
+    # Known users, plus one the model has never seen
+    for user_id in [0, 7, 18, 29, 999]:
+        expected = np.array([model.predict(user_id, int(a)).est for a in article_ids])
+        scores = scorer.score(user_id, article_ids)
+
+        np.testing.assert_allclose(scores, expected, rtol=0, atol=TOLERANCE)
+        assert ranked(article_ids, scores)[:10] == ranked(article_ids, expected)[:10]